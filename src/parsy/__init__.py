@@ -1,37 +1,85 @@
 from __future__ import annotations
 
 import enum
+import mmap
 import operator
 import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from contextvars import ContextVar
 from dataclasses import dataclass
-from functools import wraps
-from typing import Any, Callable, FrozenSet
+from functools import partial, wraps
+from typing import IO, Any, Callable, FrozenSet, Iterable, Iterator, NamedTuple
 
 __version__ = "2.2"
 
-noop = lambda x: x
+
+def noop(x):
+    return x
 
 
 def line_info_at(stream, index):
+    if stream.__class__ is _StreamBuffer or stream.__class__ is TokenStream:
+        return stream.line_info_at(index)
     if index > len(stream):
         raise ValueError("invalid index")
+    if stream.__class__ is str:
+        state = _parse_state.get()
+        if state is not None and state.stream is stream:
+            return state.line_index().line_info_at(index)
     line = stream.count("\n", 0, index)
     last_nl = stream.rfind("\n", 0, index)
     col = index - (last_nl + 1)
     return (line, col)
 
 
+class _LineIndex:
+    """
+    The positions of the newlines in a string, found as far as they are needed,
+    to look up the line and column of positions with a binary search.
+    """
+
+    __slots__ = ("stream", "newlines", "scanned")
+
+    def __init__(self, stream: str):
+        self.stream = stream
+        self.newlines = []
+        # Newlines before this position have been found
+        self.scanned = 0
+
+    def line_info_at(self, index: int) -> tuple[int, int]:
+        newlines = self.newlines
+        if index > self.scanned:
+            find = self.stream.find
+            position = find("\n", self.scanned, index)
+            while position != -1:
+                newlines.append(position)
+                position = find("\n", position + 1, index)
+            self.scanned = index
+        line = bisect_left(newlines, index)
+        return (line, index - newlines[line - 1] - 1 if line else index)
+
+
 class ParseError(RuntimeError):
+    # The line index of the parse that failed, if it built one
+    _line_index: _LineIndex | None = None
+
     def __init__(self, expected, stream, index):
         self.expected = expected
         self.stream = stream
         self.index = index
 
     def line_info(self) -> str:
+        if self._line_index is not None:
+            return "{}:{}".format(*self._line_index.line_info_at(self.index))
         try:
             return "{}:{}".format(*line_info_at(self.stream, self.index))
         except (TypeError, AttributeError):  # not a str
             return str(self.index)
+        except ValueError:  # discarded from a stream
+            return str(self.index)
 
     def __str__(self):
         expected_list = sorted(repr(e) for e in self.expected)
@@ -42,8 +90,16 @@ class ParseError(RuntimeError):
             return f"expected one of {', '.join(expected_list)} at {self.line_info()}"
 
 
+# Shared by every result that doesn't carry any expected messages.
+_NO_EXPECTED: FrozenSet[str] = frozenset()
+
+
 @dataclass
 class Result:
+    # Results are created for every step of every parse, so we avoid a
+    # per-instance __dict__.
+    __slots__ = ("status", "index", "value", "furthest", "expected")
+
     status: bool
     index: int
     value: Any
@@ -52,7 +108,7 @@ class Result:
 
     @staticmethod
     def success(index, value) -> Result:
-        return Result(True, index, value, -1, frozenset())
+        return Result(True, index, value, -1, _NO_EXPECTED)
 
     @staticmethod
     def failure(index, expected) -> Result:
@@ -60,18 +116,329 @@ class Result:
 
     # collect the furthest failure from self and other
     def aggregate(self, other) -> Result:
-        if not other:
+        if other is None:
             return self
 
         if self.furthest > other.furthest:
             return self
         elif self.furthest == other.furthest:
             # if we both have the same failure index, we combine the expected messages.
+            if other.expected is self.expected or not other.expected:
+                return self
+            if not self.expected:
+                return Result(self.status, self.index, self.value, self.furthest, other.expected)
             return Result(self.status, self.index, self.value, self.furthest, self.expected | other.expected)
         else:
             return Result(self.status, self.index, self.value, other.furthest, other.expected)
 
 
+class Span:
+    """
+    The value produced by a parser, with the indexes where its match starts
+    and ends, see ``Parser.span``.
+    """
+
+    __slots__ = ("value", "start", "end", "_lines")
+
+    def __init__(self, value: Any, start: int, end: int, lines):
+        self.value = value
+        self.start = start
+        self.end = end
+        # Anything with a line_info_at(index) method, usually a _LineIndex
+        self._lines = lines
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not Span:
+            return NotImplemented
+        return (self.value, self.start, self.end) == (other.value, other.start, other.end)
+
+    def __repr__(self) -> str:
+        return f"Span(value={self.value!r}, start={self.start!r}, end={self.end!r})"
+
+    @property
+    def start_line_info(self) -> tuple[int, int]:
+        """
+        The line and column of ``start``, counting from zero.
+        """
+        return self._lines.line_info_at(self.start)
+
+    @property
+    def end_line_info(self) -> tuple[int, int]:
+        """
+        The line and column of ``end``, counting from zero.
+        """
+        return self._lines.line_info_at(self.end)
+
+
+class Token(NamedTuple):
+    """
+    An item of a ``TokenStream``: the kind of a token and its text.
+    """
+
+    kind: str
+    text: str | bytes
+
+
+class TokenStream:
+    """
+    The tokens produced by a parser made with ``lexer``. The kind code, start
+    and end of each token in the source are kept in arrays, and the ``Token``
+    items are made when they are read.
+    """
+
+    __slots__ = ("source", "kind_names", "kinds", "starts", "ends", "_lines")
+
+    def __init__(self, source: str | bytes, kind_names: tuple[str, ...], kinds: array, starts: array, ends: array):
+        self.source = source
+        # The kind of each code in ``kinds``
+        self.kind_names = kind_names
+        self.kinds = kinds
+        self.starts = starts
+        self.ends = ends
+        # Built the first time a line and column are needed
+        self._lines = None
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        if index.__class__ is slice:
+            return TokenStream(self.source, self.kind_names, self.kinds[index], self.starts[index], self.ends[index])
+        return Token(self.kind_names[self.kinds[index]], self.source[self.starts[index] : self.ends[index]])
+
+    def __eq__(self, other) -> bool:
+        if other.__class__ is not TokenStream:
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"TokenStream({list(self)!r})"
+
+    def line_info_at(self, index: int) -> tuple[int, int]:
+        """
+        The line and column in the source of the token at ``index``, or of the
+        end of the last token for the end of the stream.
+        """
+        if index > len(self.kinds):
+            raise ValueError("invalid index")
+        if index < len(self.kinds):
+            offset = self.starts[index]
+        else:
+            offset = self.ends[-1] if self.ends else 0
+        if self._lines is None:
+            self._lines = _LineIndex(self.source)
+        return self._lines.line_info_at(offset)
+
+
+@dataclass
+class MemoStats:
+    """
+    Counters for a memoized parser, accumulated over every parse it takes part in.
+    """
+
+    hits: int = 0
+    misses: int = 0
+
+
+DEFAULT_MEMO_SIZE = 100_000
+
+DEFAULT_CHUNK_SIZE = 65_536
+
+DEFAULT_YIELD_EVERY = 1000
+
+
+class _ParseState:
+    """
+    Mutable state for a single call to ``parse`` or ``parse_partial``.
+    """
+
+    __slots__ = ("stream", "packrat", "memo", "memo_size", "memo_counts", "left_recursion", "seed_uses", "lines")
+
+    def __init__(self, stream, packrat: bool, memo_size: int, lines: _LineIndex | None = None):
+        self.stream = stream
+        self.packrat = packrat
+        # Maps (parser, index) to Result, least recently used first.
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        # Maps parsers to their memo [hits, misses] in this parse, added to
+        # their memo_stats when it is done.
+        self.memo_counts = {}
+        # Maps (forward_declaration, index) to the _LeftRecursion of each
+        # forward declaration currently being evaluated.
+        self.left_recursion = {}
+        # Incremented each time a left recursive call is answered with a seed.
+        self.seed_uses = 0
+        # Built the first time a line and column are needed, for str streams
+        self.lines = lines
+
+    def line_index(self) -> _LineIndex:
+        if self.lines is None:
+            self.lines = _LineIndex(self.stream)
+        return self.lines
+
+    def finish(self):
+        """
+        Adds the memo hits and misses of the parse to the ``memo_stats`` of the
+        parsers, which parses on other threads may be adding to.
+        """
+        if not self.memo_counts:
+            return
+        with _memo_stats_lock:
+            for parser, (hits, misses) in self.memo_counts.items():
+                stats = parser.memo_stats
+                if stats is None:
+                    stats = parser.memo_stats = MemoStats()
+                stats.hits += hits
+                stats.misses += misses
+        self.memo_counts = {}
+
+
+class _StreamBuffer:
+    """
+    The part of a stream read from a file or iterable of chunks that parsers
+    can still go back to, indexed by position from the start of the stream.
+    More is read on demand, and the start is discarded once no parser can
+    backtrack to it.
+    """
+
+    __slots__ = ("chunks", "chunk_size", "data", "offset", "at_eof", "pins", "lines", "last_newline")
+
+    def __init__(self, chunks: Iterator, chunk_size: int):
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+        first = next(chunks, None)
+        self.data = "" if first is None else first
+        # Position in the stream of data[0]
+        self.offset = 0
+        self.at_eof = first is None
+        # Positions that parsers may backtrack to, in increasing order
+        self.pins = []
+        # Newlines in the discarded part, and the position of the last one
+        self.lines = 0
+        self.last_newline = -1
+
+    def fill(self, end: int):
+        """
+        Reads until the stream is known up to ``end``, or the end of the stream.
+        """
+        while self.offset + len(self.data) < end and not self.at_eof:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.at_eof = True
+            else:
+                self.data += chunk
+
+    def release(self, index: int):
+        """
+        Discards the stream before ``index``, if enough of it has been read.
+        """
+        cut = index - self.offset
+        if cut < self.chunk_size:
+            return
+        if isinstance(self.data, str):
+            newlines = self.data.count("\n", 0, cut)
+            if newlines:
+                self.lines += newlines
+                self.last_newline = self.offset + self.data.rfind("\n", 0, cut)
+        self.data = self.data[cut:]
+        self.offset = index
+
+    def check(self, index: int):
+        if index < self.offset:
+            raise ValueError(f"position {index} of the stream has already been discarded")
+
+    def __len__(self) -> int:
+        self.fill(float("inf"))
+        return self.offset + len(self.data)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = 0 if key.start is None else key.start
+            self.check(start)
+            self.fill(float("inf") if key.stop is None else key.stop)
+            stop = None if key.stop is None else key.stop - self.offset
+            return self.data[start - self.offset : stop : key.step]
+        self.check(key)
+        self.fill(key + 1)
+        return self.data[key - self.offset]
+
+    def startswith(self, prefix, index: int) -> bool:
+        self.check(index)
+        self.fill(index + len(prefix))
+        return self.data.startswith(prefix, index - self.offset)
+
+    def line_info_at(self, index: int) -> tuple[int, int]:
+        self.check(index)
+        self.fill(index)
+        if index > self.offset + len(self.data):
+            raise ValueError("invalid index")
+        relative = index - self.offset
+        line = self.lines + self.data.count("\n", 0, relative)
+        last_newline = self.data.rfind("\n", 0, relative)
+        last_newline = self.last_newline if last_newline == -1 else self.offset + last_newline
+        return (line, index - (last_newline + 1))
+
+
+class _LeftRecursion:
+    """
+    The seed of a forward declaration that is being evaluated at some index,
+    which is returned if it calls itself again at the same index.
+    """
+
+    __slots__ = ("seed", "detected")
+
+    def __init__(self):
+        # Initially the left recursive call fails, without adding anything to
+        # the expected messages.
+        self.seed = Result(False, -1, None, -1, frozenset())
+        self.detected = False
+
+
+_parse_state: ContextVar[_ParseState | None] = ContextVar("parsy_parse_state", default=None)
+
+# The active parsy._profile.Profile, see ``profile``
+_profile_state: ContextVar[Any] = ContextVar("parsy_profile_state", default=None)
+
+
+_memo_stats_lock = threading.Lock()
+
+
+def _memo_call(state: _ParseState, parser: Parser, fn: Callable, stream, index: int) -> Result:
+    memo = state.memo
+    key = (parser, index)
+    counts = state.memo_counts.get(parser)
+    if counts is None:
+        counts = state.memo_counts[parser] = [0, 0]
+    result = memo.get(key)
+    if result is not None:
+        memo.move_to_end(key)
+        counts[0] += 1
+        return result
+
+    counts[1] += 1
+    seed_uses = state.seed_uses
+    result = fn(stream, index)
+    if seed_uses != state.seed_uses and state.left_recursion:
+        # The result was built on the seed of a left recursive rule that is
+        # still growing, so it is not final.
+        return result
+    memo[key] = result
+    if len(memo) > state.memo_size:
+        memo.popitem(last=False)
+    return result
+
+
+def _as_stream(stream):
+    """
+    Returns ``stream``, with ``mmap.mmap`` and ``memoryview`` streams viewed as
+    a read-only memoryview of bytes rather than copied, which parsers treat
+    like bytes.
+    """
+    if stream.__class__ is memoryview or stream.__class__ is mmap.mmap:
+        return memoryview(stream).cast("B").toreadonly()
+    return stream
+
+
 # Roughly, a stream is str|bytes|list, but in practice we are duck-typed
 # and could accept other things.
 # We should switch to this alias when all supported Python versions allow it:
@@ -87,54 +454,316 @@ class Parser:
     the yielded value, or Result.failure(index, expected), where expected
     is a string indicating what was expected, and the index is the index
     of the failure.
+
+    The built-in combinators call the ``wrapped_fn`` of the parsers they are
+    made from directly, rather than going through ``__call__``.
+
+    Parsing is done in two phases. The first phase uses ``fast_fn``, which may
+    skip collecting the expected messages of failures, but must otherwise
+    behave exactly like ``wrapped_fn``. Only if the first phase fails is the
+    parse run again with ``wrapped_fn``, to build the error message.
     """
 
-    def __init__(self, wrapped_fn: Callable[[str | bytes | list, int], Result]):
+    # Set on parsers that have been memoized, see ``memoize``
+    memo_stats: MemoStats | None = None
+
+    # How the parser was built, set by ``_node`` for the built-in parsers.
+    _kind: str | None = None
+    _children: tuple = ()
+    _params: dict = {}
+    _regular = False
+    # Set on the parsers made by ``optimize``, whose ``wrapped_fn`` is the one
+    # of the parser they replace.
+    _errors_from: Parser | None = None
+    # Set on the parsers made by ``compile`` and ``iterative``, as the function
+    # and arguments that make them again when they are unpickled.
+    _made_by: tuple | None = None
+    # Functions that build what the parser otherwise builds the first time it
+    # runs, see ``freeze``. They return True if the parsers it is made from
+    # are not run by it, and don't need to be prepared.
+    _prepare: tuple = ()
+    # The parsy._engine._Engine used by ``parse_async``, made on first use.
+    _async_engine: Any = None
+    # The grammar rebuilt by parsy._bounded for ``parse_prefix`` with an
+    # ``end``, made on first use.
+    _bounded: Parser | None = None
+
+    def __init__(
+        self,
+        wrapped_fn: Callable[[str | bytes | list, int], Result],
+        fast_fn: Callable[[str | bytes | list, int], Result] | None = None,
+    ):
         """
         Creates a new Parser from a function that takes a stream
         and returns a Result.
+
+        Optionally, a faster version of the function can be passed, which
+        need not produce correct ``furthest`` and ``expected`` values.
         """
         self.wrapped_fn = wrapped_fn
+        self.fast_fn = wrapped_fn if fast_fn is None else fast_fn
 
     def __call__(self, stream: str | bytes | list, index: int) -> Any:
         return self.wrapped_fn(stream, index)
 
-    def parse(self, stream: str | bytes | list) -> Any:
-        """Parses a string or list of tokens and returns the result or raise a ParseError."""
-        (result, _) = (self << eof).parse_partial(stream)
-        return result
+    def __reduce__(self):
+        from parsy._reduce import reduce_parser
+
+        return reduce_parser(self)
+
+    @property
+    def kind(self) -> str | None:
+        """
+        The name of the primitive or combinator that created the parser, e.g.
+        ``"seq"`` or ``"string"``, or ``None`` for parsers created directly.
+        """
+        return self._kind
+
+    @property
+    def children(self) -> tuple[Parser, ...]:
+        """
+        The parsers this parser was made from.
+        """
+        return self._children
+
+    @property
+    def params(self) -> dict[str, Any]:
+        """
+        The other arguments this parser was made from, by name.
+        """
+        return dict(self._params)
+
+    def optimize(self) -> Parser:
+        """
+        Returns a parser that produces the same results and error messages,
+        with a simplified grammar for the first phase of parsing.
+        """
+        from parsy._optimize import optimize
+
+        return optimize(self)
+
+    def iterative(self) -> Parser:
+        """
+        Returns a parser that produces the same results and error messages,
+        running the grammar with a stack of its own rather than nested Python
+        calls, so that deeply nested input doesn't hit the recursion limit.
+        """
+        from parsy._engine import iterative
+
+        parser = iterative(self)
+        parser._made_by = (Parser.iterative, (self,))
+        return parser
 
-    def parse_partial(self, stream: str | bytes | list) -> tuple[Any, str | bytes | list]:
+    def freeze(self) -> Parser:
+        """
+        Prepares the grammar for parsing on several threads at once, and
+        returns this parser. Checks that every forward declaration has been
+        given its parser, and builds the tables that are otherwise built the
+        first time each parser runs, so that parsing only reads the grammar.
+        """
+        seen = set()
+        pending = [self]
+        while pending:
+            parser = pending.pop()
+            if id(parser) in seen:
+                continue
+            seen.add(id(parser))
+            if parser._kind == "forward_declaration" and parser._parser is None:
+                raise ValueError("You must use 'become' on every forward_declaration before calling `freeze`")
+            covered = False
+            for prepare in parser._prepare:
+                covered = prepare() or covered
+            if not covered:
+                pending.extend(parser._children)
+        return self
+
+    def parse(self, stream: str | bytes | list, *, packrat: bool = False, memo_size: int = DEFAULT_MEMO_SIZE) -> Any:
+        """
+        Parses a string or list of tokens and returns the result or raise a ParseError.
+
+        If ``packrat`` is ``True``, the results of forward declarations and
+        generator based parsers are memoized for the duration of the parse, as
+        if they had been wrapped with ``memoize``. At most ``memo_size``
+        results are kept, evicting the least recently used first.
+        """
+        stream = _as_stream(stream)
+        return self._parse(stream, 0, packrat, memo_size, to_end=True).value
+
+    def parse_partial(
+        self, stream: str | bytes | list, *, packrat: bool = False, memo_size: int = DEFAULT_MEMO_SIZE
+    ) -> tuple[Any, str | bytes | list]:
         """
         Parses the longest possible prefix of a given string.
         Returns a tuple of the result and the unparsed remainder,
         or raises ParseError
         """
-        result = self(stream, 0)
+        stream = _as_stream(stream)
+        result = self._parse(stream, 0, packrat, memo_size)
+        return (result.value, stream[result.index :])
+
+    async def parse_async(
+        self,
+        stream: str | bytes | list,
+        *,
+        yield_every: int = DEFAULT_YIELD_EVERY,
+        packrat: bool = False,
+        memo_size: int = DEFAULT_MEMO_SIZE,
+    ) -> Any:
+        """
+        Like ``parse``, as a coroutine that lets the event loop run other tasks
+        after every ``yield_every`` steps of parsing.
+        """
+        from parsy._engine import parse_async
 
-        if result.status:
-            return (result.value, stream[result.index :])
-        else:
-            raise ParseError(result.expected, stream, result.furthest)
+        return await parse_async(self, stream, yield_every, packrat, memo_size)
+
+    def iter_parse(
+        self, stream: str | bytes | list, *, packrat: bool = False, memo_size: int = DEFAULT_MEMO_SIZE
+    ) -> Iterator[Any]:
+        """
+        Parses the initial parser as many times as possible, followed by the end
+        of the stream, yielding each result as soon as it is parsed. Raises
+        ParseError where ``self.many().parse(stream)`` would, after the results
+        before that.
+        """
+        stream = _as_stream(stream)
+        fast_fn = self.fast_fn
+        state = _ParseState(stream, packrat, memo_size)
+        index = 0
+        try:
+            while True:
+                token = _parse_state.set(state)
+                try:
+                    result = fast_fn(stream, index)
+                finally:
+                    _parse_state.reset(token)
+                if not result.status:
+                    break
+                index = result.index
+                yield result.value
+        finally:
+            state.finish()
+        if index < len(stream):
+            # Parse again from the start without keeping the results, for the
+            # error message, like ``self.many() << eof``.
+            fn = self.wrapped_fn
+
+            def items_parser(stream: str | bytes | list, index: int) -> Result:
+                result = None
+                while True:
+                    result = fn(stream, index).aggregate(result)
+                    if not result.status:
+                        return eof(stream, index).aggregate(result)
+                    index = result.index
+
+            state = _ParseState(stream, packrat, memo_size, state.lines)
+            result = self._run(items_parser, state, 0)
+            error = ParseError(result.expected, stream, result.furthest)
+            error._line_index = state.lines
+            raise error
+
+    def parse_prefix(
+        self,
+        stream: str | bytes | list,
+        start: int = 0,
+        end: int | None = None,
+        *,
+        packrat: bool = False,
+        memo_size: int = DEFAULT_MEMO_SIZE,
+    ) -> tuple[Any, int]:
+        """
+        Parses the longest possible prefix of ``stream[start:end]``, without
+        copying the stream. Returns a tuple of the result and the index where
+        parsing stopped, or raises ParseError.
+        """
+        stream = _as_stream(stream)
+        if end is not None and end < len(stream):
+            if stream.__class__ is memoryview:
+                stream = stream[:end]
+            else:
+                from parsy._bounded import parse_bounded
+
+                result = parse_bounded(self, stream, start, end, packrat, memo_size)
+                return (result.value, result.index)
+        result = self._parse(stream, start, packrat, memo_size)
+        return (result.value, result.index)
+
+    def parse_stream(
+        self,
+        source: IO | Iterable[str | bytes | list],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        *,
+        packrat: bool = False,
+        memo_size: int = DEFAULT_MEMO_SIZE,
+    ) -> Any:
+        """
+        Parses a file object, or an iterable of strings or lists, reading
+        ``chunk_size`` items at a time, and returns the result or raises a
+        ParseError. Parts of the stream that can no longer be backtracked to
+        are discarded as parsing goes on.
+        """
+        from parsy._streaming import parse_stream
+
+        return parse_stream(self, source, chunk_size, packrat, memo_size)
+
+    def _parse(
+        self, stream: str | bytes | list, index: int, packrat: bool, memo_size: int, to_end: bool = False
+    ) -> Result:
+        """
+        Parses from ``index``, and then expects the end of the stream if
+        ``to_end`` is true, like ``self << eof``.
+        """
+        profile = _profile_state.get()
+        parser = self if profile is None else profile.instrument(self)
+        state = _ParseState(stream, packrat, memo_size)
+        result = self._run(parser.fast_fn, state, index)
+        if not result.status or (to_end and result.index < len(stream)):
+            # Parse again, collecting everything that was expected at the
+            # furthest point reached, for the error message. A profile only
+            # records the first parse.
+            state = _ParseState(stream, packrat, memo_size, state.lines)
+            fn = partial(_to_end, self.wrapped_fn) if to_end else self.wrapped_fn
+            result = self._run(fn, state, index)
+            if not result.status:
+                error = ParseError(result.expected, stream, result.furthest)
+                error._line_index = state.lines
+                raise error
+        return result
+
+    def _run(self, fn, state: _ParseState, index: int) -> Result:
+        token = _parse_state.set(state)
+        try:
+            return fn(state.stream, index)
+        finally:
+            _parse_state.reset(token)
+            state.finish()
 
     def bind(self, bind_fn: Callable[[Any], Parser]) -> Parser:
-        @Parser
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
+
         def bound_parser(stream: str | bytes | list, index: int) -> Result:
-            result = self(stream, index)
+            result = fn(stream, index)
 
             if result.status:
                 next_parser = bind_fn(result.value)
-                return next_parser(stream, result.index).aggregate(result)
+                return next_parser.wrapped_fn(stream, result.index).aggregate(result)
             else:
                 return result
 
-        return bound_parser
+        def bound_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            result = fast_fn(stream, index)
+            if result.status:
+                return bind_fn(result.value).fast_fn(stream, result.index)
+            return result
+
+        return _node(Parser(bound_parser, bound_parser_fast), "bind", (self,), fn=bind_fn)
 
     def map(self, map_function: Callable) -> Parser:
         """
         Returns a parser that transforms the produced value of the initial parser with map_function.
         """
-        return self.bind(lambda res: success(map_function(res)))
+        return _node(_mapped(self, map_function), "map", (self,), fn=map_function)
 
     def combine(self, combine_fn: Callable) -> Parser:
         """
@@ -143,7 +772,24 @@ class Parser:
 
         The initial parser should return a list/sequence of parse results.
         """
-        return self.bind(lambda res: success(combine_fn(*res)))
+        if combine_fn in _PAIRS and self._kind == "seq" and self._params["names"] is None and len(self._children) == 2:
+            return _PAIRS[combine_fn](self)
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
+
+        def combine_parser(stream: str | bytes | list, index: int) -> Result:
+            result = fn(stream, index)
+            if not result.status:
+                return result
+            return Result(True, result.index, combine_fn(*result.value), result.furthest, result.expected)
+
+        def combine_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            result = fast_fn(stream, index)
+            if not result.status:
+                return result
+            return Result(True, result.index, combine_fn(*result.value), -1, _NO_EXPECTED)
+
+        return _node(Parser(combine_parser, combine_parser_fast), "combine", (self,), fn=combine_fn)
 
     def combine_dict(self, combine_fn: Callable) -> Parser:
         """
@@ -158,24 +804,24 @@ class Parser:
         If ``None`` is present as a key in the dictionary it will be removed
         before passing to ``fn``, as will all keys starting with ``_``.
         """
-        return self.bind(
-            lambda res: success(
-                combine_fn(
-                    **{
-                        k: v
-                        for k, v in dict(res).items()
-                        if k is not None and not (isinstance(k, str) and k.startswith("_"))
-                    }
-                )
-            )
-        )
+        if self._kind == "seq" and self._params["names"] is not None:
+            # The names are known, so the ones to pass can be found now.
+            names = self._params["names"]
+            kept = tuple(name for name in names if not name.startswith("_"))
+            if len(kept) == len(names):
+                transform = lambda values: combine_fn(**values)
+            else:
+                transform = lambda values: combine_fn(**{name: values[name] for name in kept})
+        else:
+            transform = lambda values: combine_fn(**_combine_dict_kwargs(values))
+        return _node(_mapped(self, transform), "combine_dict", (self,), fn=combine_fn)
 
     def concat(self) -> Parser:
         """
         Returns a parser that concatenates together (as a string) the previously
         produced values.
         """
-        return self.map("".join)
+        return _node(_mapped(self, "".join), "concat", (self,))
 
     def then(self, other: Parser) -> Parser:
         """
@@ -184,7 +830,7 @@ class Parser:
         value produced by ``other``.
 
         """
-        return seq(self, other).combine(lambda left, right: right)
+        return seq(self, other).combine(_right)
 
     def skip(self, other: Parser) -> Parser:
         """
@@ -192,7 +838,7 @@ class Parser:
         continue parsing with ``other``. It will produce the
         value produced by the initial parser.
         """
-        return seq(self, other).combine(lambda left, right: left)
+        return seq(self, other).combine(_left)
 
     def result(self, value: Any) -> Parser:
         """
@@ -216,15 +862,32 @@ class Parser:
         """
         if max is None:
             max = min
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
 
-        @Parser
         def times_parser(stream: str | bytes | list, index: int) -> Result:
             values = []
             times = 0
             result = None
 
             while times < max:
-                result = self(stream, index).aggregate(result)
+                result = fn(stream, index).aggregate(result)
+                if result.status:
+                    values.append(result.value)
+                    index = result.index
+                    times += 1
+                elif times >= min:
+                    break
+                else:
+                    return result
+
+            return Result(True, index, values, -1, _NO_EXPECTED).aggregate(result)
+
+        def times_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            values = []
+            times = 0
+            while times < max:
+                result = fast_fn(stream, index)
                 if result.status:
                     values.append(result.value)
                     index = result.index
@@ -234,9 +897,9 @@ class Parser:
                 else:
                     return result
 
-            return Result.success(index, values).aggregate(result)
+            return Result(True, index, values, -1, _NO_EXPECTED)
 
-        return times_parser
+        return _node(Parser(times_parser, times_parser_fast), "times", (self,), min=min, max=max)
 
     def at_most(self, n: int) -> Parser:
         """
@@ -250,7 +913,7 @@ class Parser:
         Returns a parser that expects the initial parser at least ``n`` times, and
         produces a list of the results.
         """
-        return self.times(n) + self.many()
+        return self.times(n, float("inf"))
 
     def optional(self, default: Any = None) -> Parser:
         """
@@ -258,7 +921,22 @@ class Parser:
         the result to a given default value in the case of no match. If no default
         value is given, ``None`` is used.
         """
-        return self.times(0, 1).map(lambda v: v[0] if v else default)
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
+
+        def optional_parser(stream: str | bytes | list, index: int) -> Result:
+            result = fn(stream, index)
+            if result.status:
+                return result
+            return Result(True, index, default, result.furthest, result.expected)
+
+        def optional_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            result = fast_fn(stream, index)
+            if result.status:
+                return result
+            return Result(True, index, default, -1, _NO_EXPECTED)
+
+        return _like(Parser(optional_parser, optional_parser_fast), self.times(0, 1).map(partial(_first_or, default)))
 
     def until(self, other: Parser, min: int = 0, max: int = float("inf"), consume_other: bool = False) -> Parser:
         """
@@ -268,42 +946,96 @@ class Parser:
         results excluding ``other``. If ``consume_other`` is ``True`` then
         ``other`` is consumed and its result is included in the list of results.
         """
-
-        @Parser
-        def until_parser(stream: str | bytes | list, index: int) -> Result:
-            values = []
-            times = 0
-            while True:
-
-                # try parser first
-                res = other(stream, index)
-                if res.status and times >= min:
-                    if consume_other:
-                        # consume other
-                        values.append(res.value)
-                        index = res.index
-                    return Result.success(index, values)
-
-                # exceeded max?
-                if times >= max:
-                    # return failure, it matched parser more than max times
-                    return Result.failure(index, f"at most {max} items")
-
-                # failed, try parser
-                result = self(stream, index)
-                if result.status:
-                    # consume
-                    values.append(result.value)
-                    index = result.index
-                    times += 1
-                elif times >= min:
-                    # return failure, parser is not followed by other
-                    return Result.failure(index, "did not find other parser")
+        too_many = frozenset([f"at most {max} items"])
+        no_other = frozenset(["did not find other parser"])
+
+        def make_until_parser(fn, other_fn):
+            def until_parser(stream: str | bytes | list, index: int) -> Result:
+                values = []
+                times = 0
+                while True:
+
+                    # try parser first
+                    res = other_fn(stream, index)
+                    if res.status and times >= min:
+                        if consume_other:
+                            # consume other
+                            values.append(res.value)
+                            index = res.index
+                        return Result(True, index, values, -1, _NO_EXPECTED)
+
+                    # exceeded max?
+                    if times >= max:
+                        # return failure, it matched parser more than max times
+                        return Result(False, -1, None, index, too_many)
+
+                    # failed, try parser
+                    result = fn(stream, index)
+                    if result.status:
+                        # consume
+                        values.append(result.value)
+                        index = result.index
+                        times += 1
+                    elif times >= min:
+                        # return failure, parser is not followed by other
+                        return Result(False, -1, None, index, no_other)
+                    else:
+                        # return failure, it did not match parser at least min times
+                        return Result.failure(index, f"at least {min} items; got {times} item(s)")
+
+            return until_parser
+
+        terminator = None
+        if self._kind == "any_char" and max >= min:
+            if other._kind == "string" and other._params["transform"] is noop:
+                terminator = other._params["expected_string"]
+            elif other._kind == "regex":
+                terminator = other._params["exp"]
+
+        def make_scanning_parser(until_parser, other_fn):
+            # Finds where other next matches in one call, instead of trying it
+            # at each index, in the str or bytes streams it can be found in.
+            find = _finder(terminator)
+            stream_type = getattr(terminator, "pattern", terminator).__class__
+            fewest = min if min > 0 else 0
+
+            def scanning_parser(stream: str | bytes | list, index: int) -> Result:
+                if stream.__class__ is not stream_type:
+                    return until_parser(stream, index)
+                length = len(stream)
+                found = find(stream, index + fewest) if index + fewest <= length else -1
+                if found == -1 or found - index > max:
+                    # Fail where until_parser would stop
+                    if index + max <= length:
+                        return Result(False, -1, None, index + max, too_many)
+                    if length - index >= min:
+                        return Result(False, -1, None, length, no_other)
+                    return Result.failure(length, f"at least {min} items; got {length - index} item(s)")
+                if stream_type is str:
+                    values = list(stream[index:found])
                 else:
-                    # return failure, it did not match parser at least min times
-                    return Result.failure(index, f"at least {min} items; got {times} item(s)")
-
-        return until_parser
+                    values = [stream[i : i + 1] for i in range(index, found)]
+                if consume_other:
+                    result = other_fn(stream, found)
+                    values.append(result.value)
+                    found = result.index
+                return Result(True, found, values, -1, _NO_EXPECTED)
+
+            return scanning_parser
+
+        until_parser = make_until_parser(self.wrapped_fn, other.wrapped_fn)
+        until_parser_fast = make_until_parser(self.fast_fn, other.fast_fn)
+        if terminator is not None:
+            until_parser = make_scanning_parser(until_parser, other.wrapped_fn)
+            until_parser_fast = make_scanning_parser(until_parser_fast, other.fast_fn)
+        return _node(
+            Parser(until_parser, until_parser_fast),
+            "until",
+            (self, other),
+            min=min,
+            max=max,
+            consume_other=consume_other,
+        )
 
     def sep_by(self, sep: Parser, *, min: int = 0, max: int = float("inf")) -> Parser:
         """
@@ -318,23 +1050,90 @@ class Parser:
         res = self.times(1) + (sep >> self).times(min - 1, max - 1)
         if min == 0:
             res |= zero_times
-        return res
+
+        def make_sep_by_parser(fn, sep_fn, aggregate):
+            def sep_by_parser(stream: str | bytes | list, index: int) -> Result:
+                result = fn(stream, index)
+                if not result.status:
+                    if min == 0:
+                        return Result(True, index, [], -1, _NO_EXPECTED).aggregate(result if aggregate else None)
+                    return result
+                values = [result.value]
+                index = result.index
+                while len(values) < max:
+                    item = sep_fn(stream, index)
+                    if aggregate:
+                        item = item.aggregate(result)
+                    if item.status:
+                        item = fn(stream, item.index).aggregate(item) if aggregate else fn(stream, item.index)
+                    if not item.status:
+                        if len(values) >= min:
+                            # The failed separator or item is left unparsed
+                            result = item
+                            break
+                        return item
+                    values.append(item.value)
+                    index = item.index
+                    result = item
+                if aggregate:
+                    return Result(True, index, values, -1, _NO_EXPECTED).aggregate(result)
+                return Result(True, index, values, -1, _NO_EXPECTED)
+
+            return sep_by_parser
+
+        return _like(
+            Parser(
+                make_sep_by_parser(self.wrapped_fn, sep.wrapped_fn, True),
+                make_sep_by_parser(self.fast_fn, sep.fast_fn, False),
+            ),
+            res,
+        )
+
+    def memoize(self) -> Parser:
+        """
+        Returns a parser that caches the results of the initial parser for each
+        index it is run at, for the duration of a single ``parse`` or
+        ``parse_partial`` call. Hit and miss counts are accumulated on the
+        ``memo_stats`` attribute of the returned parser.
+        """
+
+        def make_memo_parser(fn):
+            def memo_parser(stream: str | bytes | list, index: int) -> Result:
+                state = _parse_state.get()
+                if state is None or state.stream is not stream:
+                    return fn(stream, index)
+                return _memo_call(state, parser, fn, stream, index)
+
+            return memo_parser
+
+        parser = _node(Parser(make_memo_parser(self.wrapped_fn), make_memo_parser(self.fast_fn)), "memoize", (self,))
+        parser.memo_stats = MemoStats()
+        return parser
 
     def desc(self, description: str) -> Parser:
         """
         Returns a new parser with a description added, which is used in the error message
         if parsing fails.
         """
+        fn = self.wrapped_fn
+        expected = frozenset([description])
 
-        @Parser
         def desc_parser(stream: str | bytes | list, index: int) -> Result:
-            result = self(stream, index)
+            result = fn(stream, index)
             if result.status:
                 return result
             else:
-                return Result.failure(index, description)
+                return Result(False, -1, None, index, expected)
+
+        # The description only changes the failure message.
+        return _node(Parser(desc_parser, self.fast_fn), "desc", (self,), description=description)
 
-        return desc_parser
+    def named(self, name: str) -> Parser:
+        """
+        Returns a parser that behaves exactly like the initial parser, labelled
+        with ``name`` for ``profile``.
+        """
+        return _node(Parser(self.wrapped_fn, self.fast_fn), "named", (self,), name=name)
 
     def mark(self) -> Parser:
         """
@@ -346,15 +1145,28 @@ class Parser:
          original_value,
          (end_row, end_column))
         """
+        return seq(line_info, self, line_info).map(tuple)
+
+    def span(self) -> Parser:
+        """
+        Returns a parser that wraps the initial parser's result in a ``Span``,
+        with the start and end indexes of the match. Unlike ``mark``, lines and
+        columns are only looked up when they are read from the ``Span``.
+        """
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
+
+        def make_span_parser(fn):
+            def span_parser(stream: str | bytes | list, start: int) -> Result:
+                result = fn(stream, start)
+                if not result.status:
+                    return result
+                value = Span(result.value, start, result.index, _line_index(stream))
+                return Result(True, result.index, value, result.furthest, result.expected)
 
-        @generate
-        def marked():
-            start = yield line_info
-            body = yield self
-            end = yield line_info
-            return (start, body, end)
+            return span_parser
 
-        return marked
+        return _node(Parser(make_span_parser(fn), make_span_parser(fast_fn)), "span", (self,))
 
     def tag(self, name: str) -> Parser:
         """
@@ -362,7 +1174,22 @@ class Parser:
         2 tuple containing ``(name, value)``. This provides a very simple way to
         label parsed components
         """
-        return self.map(lambda v: (name, v))
+        fn = self.wrapped_fn
+        fast_fn = self.fast_fn
+
+        def tag_parser(stream: str | bytes | list, index: int) -> Result:
+            result = fn(stream, index)
+            if not result.status:
+                return result
+            return Result(True, result.index, (name, result.value), result.furthest, result.expected)
+
+        def tag_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            result = fast_fn(stream, index)
+            if not result.status:
+                return result
+            return Result(True, result.index, (name, result.value), -1, _NO_EXPECTED)
+
+        return _node(Parser(tag_parser, tag_parser_fast), "map", (self,), fn=partial(_tagged, name))
 
     def should_fail(self, description: str) -> Parser:
         """
@@ -372,15 +1199,19 @@ class Parser:
 
         This is essentially a negative lookahead
         """
+        # The value produced on success is the Result of the failed initial
+        # parser, so this always needs the complete version.
+        fn = self.wrapped_fn
+        expected = frozenset([description])
 
         @Parser
         def fail_parser(stream: str | bytes | list, index: int) -> Result:
-            res = self(stream, index)
+            res = fn(stream, index)
             if res.status:
-                return Result.failure(index, description)
-            return Result.success(index, res)
+                return Result(False, -1, None, index, expected)
+            return Result(True, index, res, -1, _NO_EXPECTED)
 
-        return fail_parser
+        return _node(fail_parser, "should_fail", (self,), description=description)
 
     def __add__(self, other: Parser) -> Parser:
         return seq(self, other).combine(operator.add)
@@ -404,6 +1235,274 @@ class Parser:
         return self.skip(other)
 
 
+def _left(left, right):
+    return left
+
+
+def _right(left, right):
+    return right
+
+
+def _to_end(fn: Callable, stream: str | bytes | list, index: int) -> Result:
+    """
+    Runs the parsing function ``fn`` and then expects the end of the stream,
+    like ``parser << eof``.
+    """
+    result = fn(stream, index)
+    if not result.status:
+        return result
+    end = eof(stream, result.index).aggregate(result)
+    if not end.status:
+        return end
+    return Result(True, end.index, result.value, end.furthest, end.expected)
+
+
+def _then_pair(pair: Parser) -> Parser:
+    """
+    ``seq(left, right).combine(_right)``, running ``left`` and ``right``
+    directly.
+    """
+    (fn, other_fn), (fast_fn, other_fast_fn) = _pair_fns(pair)
+    if pair._children[1]._kind == "success":
+        return _node(_result_parser(fn, fast_fn, pair._children[1]._params["value"]), "combine", (pair,), fn=_right)
+
+    def then_parser(stream: str | bytes | list, index: int) -> Result:
+        result = fn(stream, index)
+        if not result.status:
+            return result
+        return other_fn(stream, result.index).aggregate(result)
+
+    def then_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        result = fast_fn(stream, index)
+        if not result.status:
+            return result
+        return other_fast_fn(stream, result.index)
+
+    return _node(Parser(then_parser, then_parser_fast), "combine", (pair,), fn=_right)
+
+
+def _result_parser(fn: Callable, fast_fn: Callable, value: Any) -> Parser:
+    """
+    ``Parser.result``, which doesn't need to run the ``success`` parser.
+    """
+
+    def result_parser(stream: str | bytes | list, index: int) -> Result:
+        result = fn(stream, index)
+        if not result.status:
+            return result
+        return Result(True, result.index, value, result.furthest, result.expected)
+
+    def result_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        result = fast_fn(stream, index)
+        if not result.status:
+            return result
+        return Result(True, result.index, value, -1, _NO_EXPECTED)
+
+    return Parser(result_parser, result_parser_fast)
+
+
+def _skip_pair(pair: Parser) -> Parser:
+    """
+    ``seq(left, right).combine(_left)``, running ``left`` and ``right``
+    directly.
+    """
+    (fn, other_fn), (fast_fn, other_fast_fn) = _pair_fns(pair)
+
+    def skip_parser(stream: str | bytes | list, index: int) -> Result:
+        result = fn(stream, index)
+        if not result.status:
+            return result
+        other_result = other_fn(stream, result.index).aggregate(result)
+        if not other_result.status:
+            return other_result
+        return Result(True, other_result.index, result.value, other_result.furthest, other_result.expected)
+
+    def skip_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        result = fast_fn(stream, index)
+        if not result.status:
+            return result
+        other_result = other_fast_fn(stream, result.index)
+        if not other_result.status:
+            return other_result
+        return Result(True, other_result.index, result.value, -1, _NO_EXPECTED)
+
+    return _node(Parser(skip_parser, skip_parser_fast), "combine", (pair,), fn=_left)
+
+
+def _add_pair(pair: Parser) -> Parser:
+    """
+    ``seq(left, right).combine(operator.add)``, running ``left`` and
+    ``right`` directly.
+    """
+    (fn, other_fn), (fast_fn, other_fast_fn) = _pair_fns(pair)
+
+    def add_parser(stream: str | bytes | list, index: int) -> Result:
+        result = fn(stream, index)
+        if not result.status:
+            return result
+        other_result = other_fn(stream, result.index).aggregate(result)
+        if not other_result.status:
+            return other_result
+        value = result.value + other_result.value
+        return Result(True, other_result.index, value, other_result.furthest, other_result.expected)
+
+    def add_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        result = fast_fn(stream, index)
+        if not result.status:
+            return result
+        other_result = other_fast_fn(stream, result.index)
+        if not other_result.status:
+            return other_result
+        return Result(True, other_result.index, result.value + other_result.value, -1, _NO_EXPECTED)
+
+    return _node(Parser(add_parser, add_parser_fast), "combine", (pair,), fn=operator.add)
+
+
+def _mapped(parser: Parser, transform: Callable[[Any], Any]) -> Parser:
+    """
+    Returns a parser that produces ``transform`` of the values produced by
+    ``parser``, for ``map`` and the like.
+    """
+    fn = parser.wrapped_fn
+    fast_fn = parser.fast_fn
+
+    def mapped_parser(stream: str | bytes | list, index: int) -> Result:
+        result = fn(stream, index)
+        if not result.status:
+            return result
+        return Result(True, result.index, transform(result.value), result.furthest, result.expected)
+
+    def mapped_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        result = fast_fn(stream, index)
+        if not result.status:
+            return result
+        return Result(True, result.index, transform(result.value), -1, _NO_EXPECTED)
+
+    return Parser(mapped_parser, mapped_parser_fast)
+
+
+def _pair_fns(pair: Parser) -> tuple:
+    left, right = pair._children
+    return (left.wrapped_fn, right.wrapped_fn), (left.fast_fn, right.fast_fn)
+
+
+# How ``combine`` runs the two parsers of a ``seq`` with these functions,
+# which ``then``, ``skip`` and ``+`` are made with.
+_PAIRS = {_right: _then_pair, _left: _skip_pair, operator.add: _add_pair}
+
+
+def _first_or(default, values: list):
+    return values[0] if values else default
+
+
+def _tagged(name: str, value) -> tuple:
+    return (name, value)
+
+
+def _combine_dict_kwargs(res) -> dict:
+    return {k: v for k, v in dict(res).items() if k is not None and not (isinstance(k, str) and k.startswith("_"))}
+
+
+# Combinators that are regular if all the parsers they are made from are.
+_REGULAR_COMBINATORS = frozenset(
+    ["seq", "alt", "times", "map", "combine", "combine_dict", "concat", "desc", "named", "peek"]
+)
+
+
+def _node(parser: Parser, kind: str, children: tuple = (), regular: bool = False, **params) -> Parser:
+    """
+    Records how a built-in parser was made. Combinators made only from regular
+    parts get a fast path that matches a single compiled regular expression.
+    """
+    parser._kind = kind
+    parser._children = children
+    parser._params = params
+    if kind in _REGULAR_COMBINATORS:
+        regular = all(child._regular for child in children)
+        if regular:
+            parser.fast_fn = _make_regular_parser(parser, parser.fast_fn)
+    parser._regular = regular
+    return parser
+
+
+def _like(parser: Parser, template: Parser) -> Parser:
+    """
+    Records ``parser`` as made like ``template``, which it parses the same as,
+    with fewer calls.
+    """
+    return _node(parser, template._kind, template._children, **template._params)
+
+
+def _make_regular_parser(parser: Parser, fallback_fn: Callable) -> Callable:
+    # The expression is only compiled the first time the parser is run, so
+    # that only the outermost regular parsers of a grammar are compiled.
+    compiled = None
+
+    def prepare() -> bool:
+        nonlocal compiled
+        if compiled is None:
+            from parsy._regular import compile_parser
+
+            compiled = compile_parser(parser) or False
+        return bool(compiled)
+
+    parser._prepare += (prepare,)
+
+    def regular_parser(stream: str | bytes | list, index: int) -> Result:
+        if compiled is None:
+            prepare()
+        if not compiled:
+            return fallback_fn(stream, index)
+        stream_type, match_fn, build = compiled
+        if stream.__class__ is not stream_type and (stream.__class__ is not memoryview or stream_type is not bytes):
+            return fallback_fn(stream, index)
+        match = match_fn(stream, index)
+        if match:
+            return Result(True, match.end(), build(match, stream), -1, _NO_EXPECTED)
+        return Result(False, -1, None, index, _NO_EXPECTED)
+
+    return regular_parser
+
+
+def _line_index(stream: str | bytes | list) -> _LineIndex:
+    """
+    Returns the line index of ``stream``, shared with the current parse.
+    """
+    if stream.__class__ is TokenStream:
+        return stream
+    state = _parse_state.get()
+    if state is not None and state.stream is stream:
+        return state.line_index()
+    return _LineIndex(stream)
+
+
+# Returned by the first phase when no alternatives can match
+_NO_MATCH = Result(False, -1, None, -1, _NO_EXPECTED)
+
+
+def _make_dispatch(parsers: tuple[Parser, ...], tokens: bool = False) -> tuple[dict, tuple] | bool:
+    from parsy._first import dispatch_table
+
+    # Nested alts, as built by `a | b | c`, are dispatched in one step.
+    flattened = []
+    for parser in parsers:
+        flattened.extend(_alternatives(parser))
+    dispatch = dispatch_table(flattened, tokens)
+    if dispatch is None:
+        return False
+    table, default = dispatch
+    return (
+        {key: tuple(flattened[i].fast_fn for i in indices) for key, indices in table.items()},
+        tuple(flattened[i].fast_fn for i in default),
+    )
+
+
+def _alternatives(parser: Parser) -> list[Parser]:
+    if parser._kind != "alt":
+        return [parser]
+    return [alternative for child in parser._children for alternative in _alternatives(child)]
+
+
 def alt(*parsers: Parser) -> Parser:
     """
     Creates a parser from the passed in argument list of alternative
@@ -412,18 +1511,57 @@ def alt(*parsers: Parser) -> Parser:
     """
     if not parsers:
         return fail("<empty alt>")
+    fns = tuple(parser.wrapped_fn for parser in parsers)
+    fast_fns = tuple(parser.fast_fn for parser in parsers)
 
-    @Parser
     def alt_parser(stream: str | bytes | list, index: int) -> Result:
         result = None
-        for parser in parsers:
-            result = parser(stream, index).aggregate(result)
+        for fn in fns:
+            result = fn(stream, index).aggregate(result)
             if result.status:
                 return result
 
         return result
 
-    return alt_parser
+    # Maps the next item of the stream to the alternatives that can start
+    # with it, built on first use so that forward declarations are set.
+    dispatch = None
+    # The same, from the kind of the next token, for alternatives made from
+    # `token` and `token_from`
+    kind_dispatch = None
+
+    def prepare() -> bool:
+        nonlocal dispatch, kind_dispatch
+        if dispatch is None:
+            dispatch = _make_dispatch(parsers)
+            kind_dispatch = _make_dispatch(parsers, tokens=True)
+        return False
+
+    def alt_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        if dispatch is None:
+            prepare()
+        if dispatch and (stream.__class__ is str or stream.__class__ is bytes or stream.__class__ is memoryview):
+            try:
+                candidates = dispatch[0].get(stream[index], dispatch[1])
+            except IndexError:
+                candidates = dispatch[1]
+        elif kind_dispatch:
+            try:
+                candidates = kind_dispatch[0].get(_kind_at(stream, index), kind_dispatch[1])
+            except (IndexError, KeyError, TypeError):
+                candidates = kind_dispatch[1]
+        else:
+            candidates = fast_fns
+        result = _NO_MATCH
+        for fn in candidates:
+            result = fn(stream, index)
+            if result.status:
+                return result
+        return result
+
+    parser = _node(Parser(alt_parser, alt_parser_fast), "alt", parsers)
+    parser._prepare += (prepare,)
+    return parser
 
 
 def seq(*parsers: Parser, **kw_parsers: Parser) -> Parser:
@@ -439,35 +1577,62 @@ def seq(*parsers: Parser, **kw_parsers: Parser) -> Parser:
         raise ValueError("Use either positional arguments or keyword arguments with seq, not both")
 
     if parsers:
+        fns = tuple(parser.wrapped_fn for parser in parsers)
+        fast_fns = tuple(parser.fast_fn for parser in parsers)
 
-        @Parser
         def seq_parser(stream: str | bytes | list, index: int) -> Result:
             result = None
             values = []
-            for parser in parsers:
-                result = parser(stream, index).aggregate(result)
+            for fn in fns:
+                result = fn(stream, index).aggregate(result)
                 if not result.status:
                     return result
                 index = result.index
                 values.append(result.value)
-            return Result.success(index, values).aggregate(result)
+            return Result(True, index, values, -1, _NO_EXPECTED).aggregate(result)
 
-        return seq_parser
+        def seq_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            values = []
+            for fn in fast_fns:
+                result = fn(stream, index)
+                if not result.status:
+                    return result
+                index = result.index
+                values.append(result.value)
+            return Result(True, index, values, -1, _NO_EXPECTED)
+
+        return _node(Parser(seq_parser, seq_parser_fast), "seq", parsers, names=None)
     else:
+        named_fns = tuple((name, parser.wrapped_fn) for name, parser in kw_parsers.items())
+        named_fast_fns = tuple((name, parser.fast_fn) for name, parser in kw_parsers.items())
 
-        @Parser
         def seq_kwarg_parser(stream: str | bytes | list, index: int) -> Result:
             result = None
             values = {}
-            for name, parser in kw_parsers.items():
-                result = parser(stream, index).aggregate(result)
+            for name, fn in named_fns:
+                result = fn(stream, index).aggregate(result)
+                if not result.status:
+                    return result
+                index = result.index
+                values[name] = result.value
+            return Result(True, index, values, -1, _NO_EXPECTED).aggregate(result)
+
+        def seq_kwarg_parser_fast(stream: str | bytes | list, index: int) -> Result:
+            values = {}
+            for name, fn in named_fast_fns:
+                result = fn(stream, index)
                 if not result.status:
                     return result
                 index = result.index
                 values[name] = result.value
-            return Result.success(index, values).aggregate(result)
+            return Result(True, index, values, -1, _NO_EXPECTED)
 
-        return seq_kwarg_parser
+        return _node(
+            Parser(seq_kwarg_parser, seq_kwarg_parser_fast),
+            "seq",
+            tuple(kw_parsers.values()),
+            names=tuple(kw_parsers),
+        )
 
 
 def generate(fn) -> Parser:
@@ -477,9 +1642,17 @@ def generate(fn) -> Parser:
     if isinstance(fn, str):
         return lambda f: generate(f).desc(fn)
 
-    @Parser
-    @wraps(fn)
-    def generated(stream: str | bytes | list, index: int) -> Result:
+    def make_generated(run):
+        @wraps(fn)
+        def generated(stream: str | bytes | list, index: int) -> Result:
+            state = _parse_state.get()
+            if state is not None and state.packrat and state.stream is stream:
+                return _memo_call(state, parser, run, stream, index)
+            return run(stream, index)
+
+        return generated
+
+    def run_generator(stream: str | bytes | list, index: int) -> Result:
         # start up the generator
         iterator = fn()
 
@@ -488,7 +1661,24 @@ def generate(fn) -> Parser:
         try:
             while True:
                 next_parser = iterator.send(value)
-                result = next_parser(stream, index).aggregate(result)
+                result = next_parser.wrapped_fn(stream, index).aggregate(result)
+                if not result.status:
+                    return result
+                value = result.value
+                index = result.index
+        except StopIteration as stop:
+            returnVal = stop.value
+            if isinstance(returnVal, Parser):
+                return returnVal.wrapped_fn(stream, index).aggregate(result)
+
+            return Result(True, index, returnVal, -1, _NO_EXPECTED).aggregate(result)
+
+    def run_generator_fast(stream: str | bytes | list, index: int) -> Result:
+        iterator = fn()
+        value = None
+        try:
+            while True:
+                result = iterator.send(value).fast_fn(stream, index)
                 if not result.status:
                     return result
                 value = result.value
@@ -496,15 +1686,18 @@ def generate(fn) -> Parser:
         except StopIteration as stop:
             returnVal = stop.value
             if isinstance(returnVal, Parser):
-                return returnVal(stream, index).aggregate(result)
+                return returnVal.fast_fn(stream, index)
 
-            return Result.success(index, returnVal).aggregate(result)
+            return Result(True, index, returnVal, -1, _NO_EXPECTED)
 
-    return generated
+    parser = _node(Parser(make_generated(run_generator), make_generated(run_generator_fast)), "generate", fn=fn)
+    return parser
 
 
-index = Parser(lambda _, index: Result.success(index, index))
-line_info = Parser(lambda stream, index: Result.success(index, line_info_at(stream, index)))
+index = _node(Parser(lambda _, index: Result(True, index, index, -1, _NO_EXPECTED)), "index")
+line_info = _node(
+    Parser(lambda stream, index: Result(True, index, line_info_at(stream, index), -1, _NO_EXPECTED)), "line_info"
+)
 
 
 def success(value: Any) -> Parser:
@@ -512,14 +1705,17 @@ def success(value: Any) -> Parser:
     Returns a parser that does not consume any of the stream, but
     produces ``value``.
     """
-    return Parser(lambda _, index: Result.success(index, value))
+    return _node(
+        Parser(lambda _, index: Result(True, index, value, -1, _NO_EXPECTED)), "success", value=value, regular=True
+    )
 
 
 def fail(expected: str) -> Parser:
     """
     Returns a parser that always fails with the provided error message.
     """
-    return Parser(lambda _, index: Result.failure(index, expected))
+    expected_set = frozenset([expected])
+    return _node(Parser(lambda _, index: Result(False, -1, None, index, expected_set)), "fail", expected=expected)
 
 
 def string(expected_string: str, transform: Callable[[str], str] = noop) -> Parser:
@@ -533,15 +1729,33 @@ def string(expected_string: str, transform: Callable[[str], str] = noop) -> Pars
 
     slen = len(expected_string)
     transformed_s = transform(expected_string)
+    expected = frozenset([expected_string])
 
-    @Parser
-    def string_parser(stream: str, index: int) -> Result:
-        if transform(stream[index : index + slen]) == transformed_s:
-            return Result.success(index + slen, expected_string)
-        else:
-            return Result.failure(index, expected_string)
+    if transform is noop:
 
-    return string_parser
+        @Parser
+        def string_parser(stream: str, index: int) -> Result:
+            try:
+                matched = stream.startswith(expected_string, index)
+            except (AttributeError, TypeError):  # not the same type of string
+                matched = stream[index : index + slen] == expected_string
+            if matched:
+                return Result(True, index + slen, expected_string, -1, _NO_EXPECTED)
+            else:
+                return Result(False, -1, None, index, expected)
+
+    else:
+
+        @Parser
+        def string_parser(stream: str, index: int) -> Result:
+            if transform(stream[index : index + slen]) == transformed_s:
+                return Result(True, index + slen, expected_string, -1, _NO_EXPECTED)
+            else:
+                return Result(False, -1, None, index, expected)
+
+    return _node(
+        string_parser, "string", expected_string=expected_string, transform=transform, regular=transform is noop
+    )
 
 
 def regex(exp: str, flags=0, group: int | str | tuple = 0) -> Parser:
@@ -560,16 +1774,146 @@ def regex(exp: str, flags=0, group: int | str | tuple = 0) -> Parser:
         exp = re.compile(exp, flags)
     if isinstance(group, (str, int)):
         group = (group,)
+    match_fn = exp.match
+    expected = frozenset([exp.pattern])
 
     @Parser
     def regex_parser(stream: str | bytes | list, index: int) -> Result:
-        match = exp.match(stream, index)
+        match = match_fn(stream, index)
         if match:
-            return Result.success(match.end(), match.group(*group))
+            return Result(True, match.end(), match.group(*group), -1, _NO_EXPECTED)
         else:
-            return Result.failure(index, exp.pattern)
+            return Result(False, -1, None, index, expected)
+
+    # Only whole matches can be embedded in a larger pattern, see _regular.
+    regular = group == (0,) and not exp.flags & re.LOCALE
+    return _node(regex_parser, "regex", exp=exp, group=group, regular=regular)
+
+
+def scan_until(terminator: str | bytes | re.Pattern) -> Parser:
+    """
+    Returns a parser that matches everything up to where ``terminator`` is next
+    found, without consuming it, and produces the matched string.
+    ``terminator`` is a string to find, or a compiled regular expression to
+    search for.
+    """
+    find = _finder(terminator)
+    if isinstance(terminator, re.Pattern):
+        search = terminator.search
+        expected = frozenset([terminator.pattern])
+    else:
+        search = re.compile(re.escape(terminator)).search
+        expected = frozenset([terminator])
+
+    @Parser
+    def scan_until_parser(stream: str | bytes | list, index: int) -> Result:
+        try:
+            end = find(stream, index)
+        except (AttributeError, TypeError):
+            if stream.__class__ is memoryview:
+                match = search(stream, index)
+                end = match.start() if match else -1
+            else:
+                end = _find_items(stream, index, len(stream), terminator)
+        if end == -1:
+            return Result(False, -1, None, len(stream), expected)
+        value = stream[index:end]
+        if value.__class__ is memoryview:
+            value = value.tobytes()
+        return Result(True, end, value, -1, _NO_EXPECTED)
+
+    return _node(scan_until_parser, "scan_until", terminator=terminator)
+
+
+def _finder(terminator: str | bytes | re.Pattern) -> Callable[[str | bytes, int], int]:
+    """
+    Returns a function that returns the first index from a given index where
+    ``terminator`` is found in a stream, or -1.
+    """
+    if isinstance(terminator, re.Pattern):
+        search = terminator.search
+
+        def find(stream: str | bytes, index: int) -> int:
+            match = search(stream, index)
+            return match.start() if match else -1
+
+        return find
 
-    return regex_parser
+    def find(stream: str | bytes, index: int) -> int:
+        return stream.find(terminator, index)
+
+    return find
+
+
+def _find_items(stream: list, index: int, end: int, terminator: str | bytes | re.Pattern) -> int:
+    """
+    Returns the first index from ``index`` where ``terminator`` is found before
+    ``end`` in a stream that isn't text, comparing items as ``string`` does, or
+    -1. A regular expression is never found.
+    """
+    if isinstance(terminator, re.Pattern):
+        return -1
+    size = len(terminator)
+    for position in range(index, end - size + 1):
+        if stream[position : position + size] == terminator:
+            return position
+    return -1
+
+
+def lexer(rules: Iterable[tuple[str, str | bytes]], skip: Iterable[str | bytes] = (), flags=0) -> Parser:
+    """
+    Returns a parser that splits the stream into tokens and produces them as a
+    ``TokenStream``. ``rules`` are pairs of a kind and a regular expression,
+    tried in order, and text matching one of the ``skip`` expressions is left
+    out. The expressions are matched as one regular expression, and the parser
+    stops where none of them match.
+    """
+    rules = tuple((kind, pattern) for kind, pattern in rules)
+    skip = tuple(skip)
+    patterns = [pattern for _, pattern in rules] + list(skip)
+    if not patterns:
+        raise ValueError("lexer needs at least one rule")
+    if isinstance(patterns[0], bytes):
+        master = re.compile(b"|".join(b"(?P<_%d>%s)" % (i, pattern) for i, pattern in enumerate(patterns)), flags)
+    else:
+        master = re.compile("|".join(f"(?P<_{i}>{pattern})" for i, pattern in enumerate(patterns)), flags)
+    kind_names = tuple(dict.fromkeys(kind for kind, _ in rules))
+    kind_codes = {kind: code for code, kind in enumerate(kind_names)}
+    # The kind code of the token matched by each group, -1 for skipped text
+    codes = [-1] * (master.groups + 1)
+    for i, (kind, _) in enumerate(rules):
+        codes[master.groupindex[f"_{i}"]] = kind_codes[kind]
+    expected = frozenset(kind_names)
+
+    def make_lexer_parser(report: bool):
+        # ``stop`` is where the stream is read up to, see parsy._bounded
+        def lexer_parser(stream: str | bytes, index: int, stop: int | None = None) -> Result:
+            if stop is None:
+                stop = len(stream)
+            kinds = array("H")
+            starts = array("q")
+            ends = array("q")
+            add_kind, add_start, add_end = kinds.append, starts.append, ends.append
+            position = index
+            for match in iter(master.scanner(stream, index, stop).match, None):
+                end = match.end()
+                if end == position:
+                    break
+                code = codes[match.lastindex]
+                if code >= 0:
+                    add_kind(code)
+                    add_start(position)
+                    add_end(end)
+                position = end
+            tokens = TokenStream(stream, kind_names, kinds, starts, ends)
+            if report and position < stop:
+                return Result(True, position, tokens, position, expected)
+            return Result(True, position, tokens, -1, _NO_EXPECTED)
+
+        return lexer_parser
+
+    parser = Parser(make_lexer_parser(True), make_lexer_parser(False))
+    return _node(parser, "lexer", rules=rules, skip=skip, flags=flags)
 
 
 def test_item(func: Callable[..., bool], description: str) -> Parser:
@@ -579,6 +1923,7 @@ def test_item(func: Callable[..., bool], description: str) -> Parser:
     parse succeeds, otherwise the parse fails with the description
     ``description``.
     """
+    expected = frozenset([description])
 
     @Parser
     def test_item_parser(stream: str | bytes | list, index: int) -> Result:
@@ -587,13 +1932,15 @@ def test_item(func: Callable[..., bool], description: str) -> Parser:
                 # Subscripting bytes with `[index]` instead of
                 # `[index:index + 1]` returns an int
                 item = stream[index : index + 1]
+            elif stream.__class__ is memoryview:
+                item = stream[index : index + 1].tobytes()
             else:
                 item = stream[index]
             if func(item):
-                return Result.success(index + 1, item)
-        return Result.failure(index, description)
+                return Result(True, index + 1, item, -1, _NO_EXPECTED)
+        return Result(False, -1, None, index, expected)
 
-    return test_item_parser
+    return _node(test_item_parser, "test_item", func=func, description=description)
 
 
 def test_char(func: Callable[..., bool], description: str) -> Parser:
@@ -615,7 +1962,86 @@ def match_item(item: Any, description: str = None) -> Parser:
 
     if description is None:
         description = str(item)
-    return test_item(lambda i: item == i, description)
+    return test_item(partial(operator.eq, item), description)
+
+
+def token(kind: Any, text: str | bytes | None = None) -> Parser:
+    """
+    Returns a parser that matches one token of the given ``kind``, and with
+    the given ``text`` if it is not ``None``, and produces the token. The kind
+    of a token is its ``kind`` attribute, or else its first item, and its text
+    is its ``text`` attribute, or else its second item.
+    """
+    if text is None:
+        return token_from(kind)
+    expected = frozenset([text])
+
+    @Parser
+    def token_parser(stream: TokenStream | list, index: int) -> Result:
+        try:
+            if stream.__class__ is TokenStream:
+                # Compared in place, without making the token
+                start = stream.starts[index]
+                matched = (
+                    stream.kind_names[stream.kinds[index]] == kind
+                    and stream.ends[index] - start == len(text)
+                    and stream.source.startswith(text, start)
+                )
+            else:
+                item = stream[index]
+                matched = _token_kind(item) == kind and _token_text(item) == text
+        except (IndexError, KeyError, TypeError):
+            matched = False
+        if matched:
+            return Result(True, index + 1, stream[index], -1, _NO_EXPECTED)
+        return Result(False, -1, None, index, expected)
+
+    return _node(token_parser, "token", kinds=frozenset([kind]), text=text)
+
+
+def token_from(*kinds: Any) -> Parser:
+    """
+    Returns a parser that matches one token of any of the given kinds, and
+    produces the token. Kinds are read like in ``token``.
+    """
+    kinds = frozenset(kinds)
+
+    @Parser
+    def token_from_parser(stream: TokenStream | list, index: int) -> Result:
+        try:
+            matched = _kind_at(stream, index) in kinds
+        except (IndexError, KeyError, TypeError):
+            matched = False
+        if matched:
+            return Result(True, index + 1, stream[index], -1, _NO_EXPECTED)
+        return Result(False, -1, None, index, kinds)
+
+    return _node(token_from_parser, "token_from", kinds=kinds)
+
+
+def _kind_at(stream: TokenStream | list, index: int) -> Any:
+    """
+    Returns the kind of the token at ``index``. Raises ``IndexError`` at the
+    end of the stream, and ``KeyError`` or ``TypeError`` for items that are
+    not tokens.
+    """
+    if stream.__class__ is TokenStream:
+        return stream.kind_names[stream.kinds[index]]
+    return _token_kind(stream[index])
+
+
+def _token_kind(item: Any) -> Any:
+    try:
+        return item.kind
+    except AttributeError:
+        return item[0]
+
+
+def _token_text(item: Any) -> Any:
+    try:
+        return item.text
+    except AttributeError:
+        return item[1]
 
 
 def string_from(*strings: str, transform: Callable[[str], str] = noop):
@@ -625,8 +2051,105 @@ def string_from(*strings: str, transform: Callable[[str], str] = noop):
     in descending length order, so that overlapping strings are handled correctly
     by checking the longest one first.
     """
+    if not strings:
+        return alt()
     # Sort longest first, so that overlapping options work correctly
-    return alt(*(string(s, transform) for s in sorted(strings, key=len, reverse=True)))
+    strings = tuple(sorted(strings, key=len, reverse=True))
+    return _node(
+        _longest_match(strings, strings, transform),
+        "string_from",
+        strings=strings,
+        values=strings,
+        transform=transform,
+        regular=_is_regular_match(strings, transform),
+    )
+
+
+_MISSING = object()
+
+
+def _is_regular_match(strings: tuple, transform: Callable) -> bool:
+    return transform is noop and len({type(s) for s in strings}) == 1
+
+
+def _trie_pattern(strings: tuple[str, ...] | tuple[bytes, ...]) -> str | bytes:
+    """
+    Returns a regular expression that matches the longest of ``strings``,
+    sharing common prefixes, e.g. ``a(?:bc?|d)`` for "a", "ab", "abc", "ad"
+    """
+    is_bytes = isinstance(strings[0], bytes)
+    trie = {}
+    for s in strings:
+        node = trie
+        for c in s.decode("latin-1") if is_bytes else s:
+            node = node.setdefault(c, {})
+        node[""] = None
+
+    def node_pattern(node):
+        # Longer matches first, then the end of a string
+        alternatives = [re.escape(c) + node_pattern(child) for c, child in node.items() if c]
+        if "" in node:
+            alternatives.append("")
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return "(?:" + "|".join(alternatives) + ")"
+
+    pattern = node_pattern(trie)
+    return pattern.encode("latin-1") if is_bytes else pattern
+
+
+def _longest_match(strings: tuple, values: tuple, transform: Callable) -> Parser:
+    """
+    Returns a parser that behaves like an alt of ``string(s, transform)``
+    parsers for each of ``strings``, which are sorted longest first, producing
+    the corresponding value from ``values``.
+    """
+    expected = frozenset(strings)
+    # Maps each length to a dict from transformed strings of that length to
+    # the value of the first one, and the strings tried before it, longest
+    # first.
+    by_length = {}
+    for i, (s, value) in enumerate(zip(strings, values)):
+        by_length.setdefault(len(s), {}).setdefault(transform(s), (value, frozenset(strings[:i])))
+    tables = tuple(by_length.items())
+
+    def string_from_parser(stream: str | bytes | list, index: int) -> Result:
+        # One slice per length, rather than one per string
+        for length, table in tables:
+            key = transform(stream[index : index + length])
+            try:
+                found = table.get(key)
+            except TypeError:  # unhashable, e.g. a list or bytearray
+                found = next((found for s, found in table.items() if s == key), None)
+            if found is not None:
+                value, failed = found
+                return Result(True, index + length, value, index if failed else -1, failed)
+        return Result(False, -1, None, index, expected)
+
+    if _is_regular_match(strings, transform):
+        flags = 0
+    elif transform is str.lower and all(isinstance(s, str) and s.isascii() for s in strings):
+        # re.IGNORECASE matches everything str.lower does for ASCII strings,
+        # and a bit more (e.g. "ſ" for "s"), so matches are checked below.
+        flags = re.IGNORECASE
+    else:
+        return Parser(string_from_parser)
+
+    stream_type = type(strings[0])
+    match_fn = re.compile(_trie_pattern(strings), flags).match
+    values_by_key = {key: value for table in by_length.values() for key, (value, _) in table.items()}
+
+    def string_from_parser_fast(stream: str | bytes | list, index: int) -> Result:
+        if stream.__class__ is stream_type or (stream.__class__ is memoryview and stream_type is bytes):
+            match = match_fn(stream, index)
+            if match is None:
+                return Result(False, -1, None, index, _NO_EXPECTED)
+            value = values_by_key.get(transform(match.group()), _MISSING)
+            if value is not _MISSING:
+                return Result(True, match.end(), value, -1, _NO_EXPECTED)
+        return string_from_parser(stream, index)
+
+    return Parser(string_from_parser, string_from_parser_fast)
 
 
 def char_from(string: str | bytes) -> Parser:
@@ -635,9 +2158,10 @@ def char_from(string: str | bytes) -> Parser:
     from the string.
     """
     if isinstance(string, bytes):
-        return test_char(lambda c: c in string, b"[" + string + b"]")
+        parser = test_char(lambda c: c in string, b"[" + string + b"]")
     else:
-        return test_char(lambda c: c in string, "[" + string + "]")
+        parser = test_char(lambda c: c in string, "[" + string + "]")
+    return _node(parser, "char_from", characters=string, regular=bool(string))
 
 
 def peek(parser: Parser) -> Parser:
@@ -646,18 +2170,20 @@ def peek(parser: Parser) -> Parser:
     chars.
     """
 
-    @Parser
-    def peek_parser(stream: str | bytes | list, index: int) -> Result:
-        result = parser(stream, index)
-        if result.status:
-            return Result.success(index, result.value)
-        else:
-            return result
+    def make_peek_parser(fn):
+        def peek_parser(stream: str | bytes | list, index: int) -> Result:
+            result = fn(stream, index)
+            if result.status:
+                return Result(True, index, result.value, -1, _NO_EXPECTED)
+            else:
+                return result
 
-    return peek_parser
+        return peek_parser
 
+    return _node(Parser(make_peek_parser(parser.wrapped_fn), make_peek_parser(parser.fast_fn)), "peek", (parser,))
 
-any_char = test_char(lambda c: True, "any character")
+
+any_char = _node(test_char(lambda c: True, "any character"), "any_char", regular=True)
 
 whitespace = regex(r"\s+")
 
@@ -668,6 +2194,9 @@ digit = test_char(lambda c: c.isdigit(), "a digit")
 decimal_digit = char_from("0123456789")
 
 
+_EOF_EXPECTED = frozenset(["EOF"])
+
+
 @Parser
 def eof(stream: str | bytes | list, index: int) -> Result:
     """
@@ -675,9 +2204,12 @@ def eof(stream: str | bytes | list, index: int) -> Result:
     """
 
     if index >= len(stream):
-        return Result.success(index, None)
+        return Result(True, index, None, -1, _NO_EXPECTED)
     else:
-        return Result.failure(index, "EOF")
+        return Result(False, -1, None, index, _EOF_EXPECTED)
+
+
+_node(eof, "eof", regular=True)
 
 
 def from_enum(enum_cls: type[enum.Enum], transform=noop) -> Parser:
@@ -691,7 +2223,43 @@ def from_enum(enum_cls: type[enum.Enum], transform=noop) -> Parser:
     items = sorted(
         ((str(enum_item.value), enum_item) for enum_item in enum_cls), key=lambda t: len(t[0]), reverse=True
     )
-    return alt(*(string(value, transform=transform).result(enum_item) for value, enum_item in items))
+    if not items:
+        return alt()
+    strings, values = (tuple(column) for column in zip(*items))
+    return _node(
+        _longest_match(strings, values, transform),
+        "from_enum",
+        enum_cls=enum_cls,
+        strings=strings,
+        values=values,
+        transform=transform,
+        regular=_is_regular_match(strings, transform),
+    )
+
+
+def compile(parser: Parser) -> Parser:
+    """
+    Returns a parser that produces the same results and error messages as
+    ``parser``, but runs Python code generated for its grammar. See
+    ``parsy.codegen``.
+    """
+    from parsy.codegen import compile_parser
+
+    compiled = compile_parser(parser)
+    compiled._made_by = (compile, (parser,))
+    return compiled
+
+
+def profile(heatmap: bool = False):
+    """
+    Returns a context manager that records statistics about the parsers
+    labelled with ``Parser.named`` or ``Parser.desc``, for the parses done
+    while it is active. With ``heatmap``, it also counts how many times they
+    and the primitives are evaluated at each index.
+    """
+    from parsy._profile import Profile
+
+    return Profile(heatmap)
 
 
 class forward_declaration(Parser):
@@ -700,20 +2268,106 @@ class forward_declaration(Parser):
     especially for parsers that need to be defined recursively.
 
     You must use `.become(parser)` before using.
+
+    The parser may be left recursive, directly or indirectly.
     """
 
+    _kind = "forward_declaration"
+
+    @property
+    def _children(self):
+        return () if self._parser is None else (self._parser,)
+
     def __init__(self):
-        pass
+        self._parser = None
+
+        def make_forward_parser(fn_name):
+            def forward_parser(stream: str | bytes | list, index: int) -> Result:
+                if self._parser is None:
+                    self._raise_error()
+                state = _parse_state.get()
+                if state is None or state.stream is not stream:
+                    # Called outside of `parse`, we need somewhere to keep
+                    # track of left recursion.
+                    state = _ParseState(stream, False, DEFAULT_MEMO_SIZE)
+                    token = _parse_state.set(state)
+                    try:
+                        return forward_parser(stream, index)
+                    finally:
+                        _parse_state.reset(token)
+                        state.finish()
+
+                recursion = state.left_recursion.get((self, index))
+                if recursion is not None:
+                    recursion.detected = True
+                    state.seed_uses += 1
+                    return recursion.seed
+                if state.packrat:
+                    return _memo_call(state, self, grow_parser, stream, index)
+                return grow_parser(stream, index)
+
+            def grow_parser(stream: str | bytes | list, index: int) -> Result:
+                # Left recursion is handled by growing a seed: the first time
+                # a rule calls itself at the same index, the call fails. If
+                # the rule as a whole still succeeds, that result becomes the
+                # answer for the recursive call, and we try again, until the
+                # match stops getting longer.
+                fn = getattr(self._parser, fn_name)
+                left_recursion = _parse_state.get().left_recursion
+                key = (self, index)
+                recursion = left_recursion[key] = _LeftRecursion()
+                try:
+                    result = fn(stream, index)
+                    if not (recursion.detected and result.status):
+                        return result
+                    while True:
+                        recursion.seed = result
+                        attempt = fn(stream, index)
+                        if not attempt.status or attempt.index <= result.index:
+                            return result.aggregate(attempt)
+                        result = attempt
+                finally:
+                    del left_recursion[key]
+
+            return forward_parser
+
+        super().__init__(make_forward_parser("wrapped_fn"), make_forward_parser("fast_fn"))
 
     def _raise_error(self, *args, **kwargs):
         raise ValueError("You must use 'become' before attempting to call `parse` or `parse_partial`")
 
-    parse = _raise_error
-    parse_partial = _raise_error
+    def parse(self, *args, **kwargs):
+        if self._parser is None:
+            self._raise_error()
+        return super().parse(*args, **kwargs)
+
+    def parse_partial(self, *args, **kwargs):
+        if self._parser is None:
+            self._raise_error()
+        return super().parse_partial(*args, **kwargs)
+
+    async def parse_async(self, *args, **kwargs):
+        if self._parser is None:
+            self._raise_error()
+        return await super().parse_async(*args, **kwargs)
+
+    def iter_parse(self, *args, **kwargs):
+        if self._parser is None:
+            self._raise_error()
+        return super().iter_parse(*args, **kwargs)
+
+    def __reduce__(self):
+        # The parser is restored after the declaration is made, so that
+        # grammars that refer back to it can be unpickled.
+        return (forward_declaration, (), self._parser)
+
+    def __setstate__(self, parser: Parser | None):
+        self.become(parser)
 
     def become(self, other: Parser):
         """
         Take on the behavior of the given parser.
         """
-        self.__dict__ = other.__dict__
-        self.__class__ = other.__class__
+        if self._parser is not None:
+            raise TypeError("forward_declaration.become() can only be called once")
+        self._parser = other
@@ -0,0 +1,191 @@
+"""
+Parsing up to an end index of a ``str``, ``bytes`` or list stream without
+slicing it, see ``Parser.parse_prefix``.
+
+The grammar is rebuilt so that its primitives don't read past the end:
+
+- regexes are matched with an ``endpos``, and ``scan_until`` and ``lexer``
+  search up to the end
+- the other primitives only look at a few items after their index, and are
+  run as they are when those are before the end, and on a copy of the items
+  left before the end otherwise
+- parsers that aren't built in are run on a copy of the stream up to the end,
+  made the first time one of them runs
+
+The end is read from a context variable, so the grammar is rebuilt once, for
+any end.
+"""
+
+from __future__ import annotations
+
+from contextvars import ContextVar
+
+from parsy import _NO_EXPECTED, Parser, Result, _find_items
+from parsy._rebuild import _Rebuilder
+
+
+class _Bound:
+    """
+    The end of the stream for the current parse, and the copy of the stream up
+    to it, if one was needed.
+    """
+
+    __slots__ = ("end", "stream", "copy")
+
+    def __init__(self, stream, end: int):
+        self.end = end
+        self.stream = stream
+        self.copy = None
+
+    def sliced(self, stream):
+        if stream is not self.stream:
+            # A stream made while parsing, such as a TokenStream from lexer
+            return stream
+        if self.copy is None:
+            self.copy = stream[: self.end]
+        return self.copy
+
+
+_bound: ContextVar[_Bound] = ContextVar("parsy_bound")
+
+# Primitives that only look at the stream after their index, and how far they
+# look, given their params.
+_LOOKAHEAD = {
+    "string": lambda params: len(params["expected_string"]),
+    "test_item": lambda params: 1,
+    "char_from": lambda params: 1,
+    "any_char": lambda params: 1,
+    "string_from": lambda params: len(params["strings"][0]),
+    "from_enum": lambda params: len(params["strings"][0]),
+    "eof": lambda params: 1,
+    "token": lambda params: 1,
+    "token_from": lambda params: 1,
+}
+
+# Parsers that don't read the stream, or only before their index
+_UNCHANGED = frozenset(["success", "fail", "index", "line_info"])
+
+
+def parse_bounded(parser: Parser, stream, start: int, end: int, packrat: bool, memo_size: int) -> Result:
+    bounded = parser._bounded
+    if bounded is None:
+        bounded = parser._bounded = _Bounder().rebuild(parser)
+    token = _bound.set(_Bound(stream, end))
+    try:
+        return bounded._parse(stream, start, packrat, memo_size)
+    finally:
+        _bound.reset(token)
+
+
+def _clipped(parser: Parser, lookahead: int) -> Parser:
+    """
+    Returns a parser that runs ``parser``, which looks at up to ``lookahead``
+    items after its index, on the items before the end.
+    """
+
+    def make_clipped_parser(fn):
+        def clipped_parser(stream, index: int) -> Result:
+            end = _bound.get().end
+            if index + lookahead <= end:
+                return fn(stream, index)
+            result = fn(stream[index:end], 0)
+            furthest = result.furthest if result.furthest < 0 else result.furthest + index
+            if result.status:
+                return Result(True, result.index + index, result.value, furthest, result.expected)
+            return Result(False, -1, None, furthest, result.expected)
+
+        return clipped_parser
+
+    return Parser(make_clipped_parser(parser.wrapped_fn), make_clipped_parser(parser.fast_fn))
+
+
+def _sliced(parser: Parser) -> Parser:
+    """
+    Returns a parser that runs ``parser`` on the stream up to the end.
+    """
+    fn = parser.wrapped_fn
+    fast_fn = parser.fast_fn
+
+    def sliced_parser(stream, index: int) -> Result:
+        return fn(_bound.get().sliced(stream), index)
+
+    def sliced_parser_fast(stream, index: int) -> Result:
+        return fast_fn(_bound.get().sliced(stream), index)
+
+    return Parser(sliced_parser, sliced_parser_fast)
+
+
+def _bounded_lexer(parser: Parser) -> Parser:
+    """
+    Returns a parser that runs the ``lexer`` parser ``parser`` up to the end.
+    """
+    fn = parser.wrapped_fn
+    fast_fn = parser.fast_fn
+
+    def bounded_lexer_parser(stream, index: int) -> Result:
+        return fn(stream, index, _bound.get().end)
+
+    def bounded_lexer_parser_fast(stream, index: int) -> Result:
+        return fast_fn(stream, index, _bound.get().end)
+
+    return Parser(bounded_lexer_parser, bounded_lexer_parser_fast)
+
+
+class _Bounder(_Rebuilder):
+    def rebuild_node(self, parser: Parser) -> Parser:
+        kind = parser._kind
+        if kind in _LOOKAHEAD:
+            return _clipped(parser, _LOOKAHEAD[kind](parser._params))
+        if kind in _UNCHANGED:
+            return parser
+        if kind == "lexer":
+            return _bounded_lexer(parser)
+        return super().rebuild_node(parser)
+
+    def rebuild_other(self, parser: Parser) -> Parser:
+        # Not built in: it may read the stream anywhere.
+        return _sliced(parser)
+
+    def rebuild_regex(self, params: dict, children: list[Parser]) -> Parser:
+        match = params["exp"].match
+        group = params["group"]
+        expected = frozenset([params["exp"].pattern])
+
+        @Parser
+        def bounded_regex_parser(stream, index: int) -> Result:
+            found = match(stream, index, _bound.get().end)
+            if found:
+                return Result(True, found.end(), found.group(*group), -1, _NO_EXPECTED)
+            return Result(False, -1, None, index, expected)
+
+        return bounded_regex_parser
+
+    def rebuild_scan_until(self, params: dict, children: list[Parser]) -> Parser:
+        terminator = params["terminator"]
+        if isinstance(terminator, (str, bytes)):
+            expected = frozenset([terminator])
+
+            def find(stream, index: int, end: int) -> int:
+                if stream.__class__ is list:
+                    return _find_items(stream, index, end, terminator)
+                return stream.find(terminator, index, end)
+
+        else:
+            search = terminator.search
+            expected = frozenset([terminator.pattern])
+
+            def find(stream, index: int, end: int) -> int:
+                if stream.__class__ is list:
+                    return -1
+                found = search(stream, index, end)
+                return found.start() if found else -1
+
+        @Parser
+        def bounded_scan_until_parser(stream, index: int) -> Result:
+            end = _bound.get().end
+            found = find(stream, index, end)
+            if found == -1:
+                return Result(False, -1, None, end, expected)
+            return Result(True, found, stream[index:found], -1, _NO_EXPECTED)
+
+        return bounded_scan_until_parser
@@ -0,0 +1,608 @@
+"""
+Runs a grammar without using the Python call stack for nesting, see
+``Parser.iterative``.
+
+Each parser is turned into a step, for one phase of parsing. Parsers that can
+only nest as deep as the grammar itself, because they contain no forward
+declarations, ``bind`` or ``generate`` parsers, are native steps that call
+the parser's own function. The others become generator functions, which
+``yield (step, index)`` to run a generator step and are sent its ``Result``.
+``_run`` keeps the generators that are waiting for a result on a list, so
+nesting in the input only uses heap memory.
+
+The generators do what the parsing functions of the combinators do, and in
+the second phase they aggregate failures in the same order, so results and
+errors are the same.
+
+``parse_async`` uses an engine that also makes generator steps of repetitions
+and of the parsers they repeat, so that ``_run_async`` gets control back at
+least once per repetition and can pause to let other tasks run.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from functools import partial
+
+from parsy import (
+    _NO_EXPECTED,
+    _NO_MATCH,
+    DEFAULT_MEMO_SIZE,
+    ParseError,
+    Parser,
+    Result,
+    Span,
+    _alternatives,
+    _as_stream,
+    _combine_dict_kwargs,
+    _kind_at,
+    _LeftRecursion,
+    _line_index,
+    _parse_state,
+    _ParseState,
+    eof,
+)
+from parsy._first import dispatch_table
+
+# Kinds of parser whose structure doesn't determine what they run
+_DYNAMIC = frozenset(["forward_declaration", "bind", "generate"])
+
+# Kinds of parser that repeat their children, which ``parse_async`` pauses
+# between repetitions
+_LOOPS = frozenset(["times", "until"])
+
+
+def iterative(parser: Parser) -> Parser:
+    engine = _Engine()
+    result = Parser(engine.entry(parser, True), engine.entry(parser, False))
+    result._prepare = (partial(engine.prepare, parser),)
+    return result
+
+
+async def parse_async(parser: Parser, stream, yield_every: int, packrat: bool, memo_size: int):
+    if yield_every < 1:
+        raise ValueError("yield_every must be at least 1")
+    engine = parser._async_engine
+    if engine is None:
+        engine = parser._async_engine = _Engine(resumable=True)
+    stream = _as_stream(stream)
+    lines = None
+    for full in (False, True):
+        state = _ParseState(stream, packrat, memo_size, lines)
+        token = _parse_state.set(state)
+        try:
+            result = await _run_async(engine.step(parser, full), stream, 0, yield_every)
+        finally:
+            _parse_state.reset(token)
+            state.finish()
+        # Like parsing with ``parser << eof``
+        if result.status:
+            end = eof(stream, result.index)
+            if end.status:
+                return result.value
+            result = end.aggregate(result)
+        lines = state.lines
+    error = ParseError(result.expected, stream, result.furthest)
+    error._line_index = lines
+    raise error
+
+
+def _run(step: tuple, stream, index: int) -> Result:
+    native, fn = step
+    if native:
+        return fn(stream, index)
+    waiting = []
+    generator = fn(stream, index)
+    result = None
+    while True:
+        try:
+            fn, index = generator.send(result)
+        except StopIteration as stop:
+            if not waiting:
+                return stop.value
+            result = stop.value
+            generator = waiting.pop()
+        else:
+            waiting.append(generator)
+            generator = fn(stream, index)
+            result = None
+
+
+async def _run_async(step: tuple, stream, index: int, yield_every: int) -> Result:
+    """
+    Like ``_run``, letting the event loop run other tasks after every
+    ``yield_every`` steps.
+    """
+    native, fn = step
+    if native:
+        return fn(stream, index)
+    waiting = []
+    generator = fn(stream, index)
+    result = None
+    countdown = yield_every
+    while True:
+        countdown -= 1
+        if not countdown:
+            countdown = yield_every
+            await asyncio.sleep(0)
+        try:
+            fn, index = generator.send(result)
+        except StopIteration as stop:
+            if not waiting:
+                return stop.value
+            result = stop.value
+            generator = waiting.pop()
+        else:
+            waiting.append(generator)
+            generator = fn(stream, index)
+            result = None
+
+
+def _resumable(fn):
+    """
+    Returns a generator step that runs the native step ``fn``.
+    """
+
+    def resumable_step(stream, index: int):
+        return fn(stream, index)
+        yield
+
+    return resumable_step
+
+
+class _Engine:
+    def __init__(self, resumable: bool = False):
+        # Maps parsers to their step, for the second (complete) phase and the
+        # first (fast) phase. Parsers made while parsing are forgotten once
+        # they are no longer used.
+        self.steps = {True: weakref.WeakKeyDictionary(), False: weakref.WeakKeyDictionary()}
+        self.dynamic = weakref.WeakKeyDictionary()
+        # Steps are built by one thread at a time, and only added to steps
+        # once the steps they refer to are all built, since parses on other
+        # threads may be reading them.
+        self.lock = threading.RLock()
+        self.building = None
+        # For parse_async, loops are generator steps that run their children
+        # as generator steps too, so that they are paused between them.
+        self.resumable = resumable
+
+    def prepare(self, parser: Parser) -> bool:
+        # Parsers only produced while parsing get their steps when they are.
+        parser.freeze()
+        self.step(parser, True)
+        self.step(parser, False)
+        return True
+
+    def entry(self, parser: Parser, full: bool):
+        def iterative_parser(stream, index: int) -> Result:
+            step = self.step(parser, full)
+            state = _parse_state.get()
+            if state is not None and state.stream is stream:
+                return _run(step, stream, index)
+            # Called outside of `parse`, forward declarations need somewhere
+            # to keep track of left recursion.
+            state = _ParseState(stream, False, DEFAULT_MEMO_SIZE)
+            token = _parse_state.set(state)
+            try:
+                return _run(step, stream, index)
+            finally:
+                _parse_state.reset(token)
+                state.finish()
+
+        return iterative_parser
+
+    def is_dynamic(self, parser: Parser) -> bool:
+        found = self.dynamic.get(parser)
+        if found is None:
+            kind = parser._kind
+            found = (
+                kind in _DYNAMIC
+                or (self.resumable and kind in _LOOPS)
+                or any(self.is_dynamic(child) for child in parser._children)
+            )
+            self.dynamic[parser] = found
+        return found
+
+    def step(self, parser: Parser, full: bool) -> tuple:
+        """
+        Returns ``(native, fn)`` for running ``parser`` in the second phase if
+        ``full``, and in the first phase otherwise.
+        """
+        if full and parser._errors_from is not None:
+            # Optimized parsers report errors from the original grammar.
+            parser = parser._errors_from
+        found = self.steps[full].get(parser)
+        if found is not None:
+            return found
+        with self.lock:
+            if self.building is not None:
+                return self.build_step(parser, full)
+            self.building = {True: {}, False: {}}
+            try:
+                found = self.build_step(parser, full)
+                for built_full, built in self.building.items():
+                    self.steps[built_full].update(built)
+                return found
+            finally:
+                self.building = None
+
+    def build_step(self, parser: Parser, full: bool) -> tuple:
+        building = self.building[full]
+        found = self.steps[full].get(parser) or building.get(parser)
+        if found is not None:
+            return found
+        if not self.is_dynamic(parser):
+            found = (True, parser.wrapped_fn if full else parser.fast_fn)
+        else:
+            # Set first, so that recursive rules find it.
+            cell = []
+            building[parser] = (False, lambda stream, index: cell[0](stream, index))
+            cell.append(getattr(self, "step_" + parser._kind)(parser, parser._params, full))
+            found = (False, cell[0])
+        building[parser] = found
+        return found
+
+    def child_steps(self, parser: Parser, full: bool) -> list[tuple]:
+        return [self.step(child, full) for child in parser._children]
+
+    def loop_steps(self, parser: Parser, full: bool) -> list[tuple]:
+        steps = self.child_steps(parser, full)
+        if not self.resumable:
+            return steps
+        return [(False, _resumable(fn)) if native else (native, fn) for native, fn in steps]
+
+    def step_seq(self, parser: Parser, params: dict, full: bool):
+        steps = self.child_steps(parser, full)
+        names = params["names"]
+        named_steps = list(zip(names, steps)) if names is not None else None
+
+        def seq_step(stream, index: int):
+            result = None
+            if named_steps is None:
+                values = []
+                for native, fn in steps:
+                    step_result = fn(stream, index) if native else (yield fn, index)
+                    if full:
+                        step_result = step_result.aggregate(result)
+                    result = step_result
+                    if not result.status:
+                        return result
+                    index = result.index
+                    values.append(result.value)
+            else:
+                values = {}
+                for name, (native, fn) in named_steps:
+                    step_result = fn(stream, index) if native else (yield fn, index)
+                    if full:
+                        step_result = step_result.aggregate(result)
+                    result = step_result
+                    if not result.status:
+                        return result
+                    index = result.index
+                    values[name] = result.value
+            done = Result(True, index, values, -1, _NO_EXPECTED)
+            return done.aggregate(result) if full else done
+
+        return seq_step
+
+    def step_alt(self, parser: Parser, params: dict, full: bool):
+        if full:
+            steps = self.child_steps(parser, full)
+
+            def alt_step(stream, index: int):
+                result = None
+                for native, fn in steps:
+                    result = (fn(stream, index) if native else (yield fn, index)).aggregate(result)
+                    if result.status:
+                        return result
+                return result
+
+            return alt_step
+
+        alternatives = [alternative for child in parser._children for alternative in _alternatives(child)]
+        steps = [self.step(alternative, full) for alternative in alternatives]
+        # Built on first use, like the dispatch of alt parsers.
+        dispatch = None
+        kind_dispatch = None
+
+        def make_dispatch(tokens: bool):
+            table = dispatch_table(alternatives, tokens)
+            if table is None:
+                return False
+            return (
+                {key: [steps[i] for i in indices] for key, indices in table[0].items()},
+                [steps[i] for i in table[1]],
+            )
+
+        def alt_step_fast(stream, index: int):
+            nonlocal dispatch, kind_dispatch
+            if dispatch is None:
+                dispatch = make_dispatch(False)
+                kind_dispatch = make_dispatch(True)
+            candidates = steps
+            if dispatch and (stream.__class__ is str or stream.__class__ is bytes or stream.__class__ is memoryview):
+                try:
+                    candidates = dispatch[0].get(stream[index], dispatch[1])
+                except IndexError:
+                    candidates = dispatch[1]
+            elif kind_dispatch:
+                try:
+                    candidates = kind_dispatch[0].get(_kind_at(stream, index), kind_dispatch[1])
+                except (IndexError, KeyError, TypeError):
+                    candidates = kind_dispatch[1]
+            result = _NO_MATCH
+            for native, fn in candidates:
+                result = fn(stream, index) if native else (yield fn, index)
+                if result.status:
+                    return result
+            return result
+
+        return alt_step_fast
+
+    def step_times(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.loop_steps(parser, full)
+        min = params["min"]
+        max = params["max"]
+
+        def times_step(stream, index: int):
+            values = []
+            times = 0
+            result = None
+            while times < max:
+                step_result = fn(stream, index) if native else (yield fn, index)
+                if full:
+                    step_result = step_result.aggregate(result)
+                result = step_result
+                if result.status:
+                    values.append(result.value)
+                    index = result.index
+                    times += 1
+                elif times >= min:
+                    break
+                else:
+                    return result
+            done = Result(True, index, values, -1, _NO_EXPECTED)
+            return done.aggregate(result) if full else done
+
+        return times_step
+
+    def step_bind(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+        bind_fn = params["fn"]
+
+        def bind_step(stream, index: int):
+            result = fn(stream, index) if native else (yield fn, index)
+            if not result.status:
+                return result
+            next_native, next_fn = self.step(bind_fn(result.value), full)
+            next_result = next_fn(stream, result.index) if next_native else (yield next_fn, result.index)
+            return next_result.aggregate(result) if full else next_result
+
+        return bind_step
+
+    def step_map(self, parser: Parser, params: dict, full: bool):
+        return self.transform(parser, params["fn"], full)
+
+    def step_combine(self, parser: Parser, params: dict, full: bool):
+        fn = params["fn"]
+        return self.transform(parser, lambda value: fn(*value), full)
+
+    def step_combine_dict(self, parser: Parser, params: dict, full: bool):
+        fn = params["fn"]
+        return self.transform(parser, lambda value: fn(**_combine_dict_kwargs(value)), full)
+
+    def step_concat(self, parser: Parser, params: dict, full: bool):
+        return self.transform(parser, "".join, full)
+
+    def transform(self, parser: Parser, transform_fn, full: bool):
+        """
+        Returns a step that transforms the value of the only child of
+        ``parser`` with ``transform_fn``.
+        """
+        ((native, fn),) = self.child_steps(parser, full)
+
+        def transform_step(stream, index: int):
+            result = fn(stream, index) if native else (yield fn, index)
+            if not result.status:
+                return result
+            done = Result(True, result.index, transform_fn(result.value), -1, _NO_EXPECTED)
+            return done.aggregate(result) if full else done
+
+        return transform_step
+
+    def step_desc(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+        if not full:
+            # The description only changes the failure message.
+            return fn
+        expected = frozenset([params["description"]])
+
+        def desc_step(stream, index: int):
+            result = fn(stream, index) if native else (yield fn, index)
+            if result.status:
+                return result
+            return Result(False, -1, None, index, expected)
+
+        return desc_step
+
+    def step_named(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+        return fn
+
+    def step_peek(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+
+        def peek_step(stream, index: int):
+            result = fn(stream, index) if native else (yield fn, index)
+            if result.status:
+                return Result(True, index, result.value, -1, _NO_EXPECTED)
+            return result
+
+        return peek_step
+
+    def step_should_fail(self, parser: Parser, params: dict, full: bool):
+        # The value produced is the Result of the initial parser, so it always
+        # runs in the second phase.
+        ((native, fn),) = self.child_steps(parser, True)
+        expected = frozenset([params["description"]])
+
+        def should_fail_step(stream, index: int):
+            result = fn(stream, index) if native else (yield fn, index)
+            if result.status:
+                return Result(False, -1, None, index, expected)
+            return Result(True, index, result, -1, _NO_EXPECTED)
+
+        return should_fail_step
+
+    def step_until(self, parser: Parser, params: dict, full: bool):
+        (native, fn), (other_native, other_fn) = self.loop_steps(parser, full)
+        min = params["min"]
+        max = params["max"]
+        consume_other = params["consume_other"]
+        too_many = frozenset([f"at most {max} items"])
+        no_other = frozenset(["did not find other parser"])
+
+        def until_step(stream, index: int):
+            values = []
+            times = 0
+            while True:
+                result = other_fn(stream, index) if other_native else (yield other_fn, index)
+                if result.status and times >= min:
+                    if consume_other:
+                        values.append(result.value)
+                        index = result.index
+                    return Result(True, index, values, -1, _NO_EXPECTED)
+                if times >= max:
+                    return Result(False, -1, None, index, too_many)
+                result = fn(stream, index) if native else (yield fn, index)
+                if result.status:
+                    values.append(result.value)
+                    index = result.index
+                    times += 1
+                elif times >= min:
+                    return Result(False, -1, None, index, no_other)
+                else:
+                    return Result.failure(index, f"at least {min} items; got {times} item(s)")
+
+        return until_step
+
+    def step_memoize(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+
+        def memo_step(stream, index: int):
+            state = _parse_state.get()
+            if state is None or state.stream is not stream:
+                return fn(stream, index) if native else (yield fn, index)
+            return (yield from _memo_call(state, parser, native, fn, stream, index))
+
+        return memo_step
+
+    def step_span(self, parser: Parser, params: dict, full: bool):
+        ((native, fn),) = self.child_steps(parser, full)
+
+        def span_step(stream, start: int):
+            result = fn(stream, start) if native else (yield fn, start)
+            if not result.status:
+                return result
+            value = Span(result.value, start, result.index, _line_index(stream))
+            return Result(True, result.index, value, result.furthest, result.expected)
+
+        return span_step
+
+    def step_generate(self, parser: Parser, params: dict, full: bool):
+        generator_fn = params["fn"]
+        step = self.step
+
+        def run_generator(stream, index: int):
+            iterator = generator_fn()
+            result = None
+            value = None
+            try:
+                while True:
+                    native, fn = step(iterator.send(value), full)
+                    step_result = fn(stream, index) if native else (yield fn, index)
+                    if full:
+                        step_result = step_result.aggregate(result)
+                    result = step_result
+                    if not result.status:
+                        return result
+                    value = result.value
+                    index = result.index
+            except StopIteration as stop:
+                value = stop.value
+            if isinstance(value, Parser):
+                native, fn = step(value, full)
+                step_result = fn(stream, index) if native else (yield fn, index)
+                return step_result.aggregate(result) if full else step_result
+            done = Result(True, index, value, -1, _NO_EXPECTED)
+            return done.aggregate(result) if full else done
+
+        def generate_step(stream, index: int):
+            state = _parse_state.get()
+            if state is not None and state.packrat and state.stream is stream:
+                return (yield from _memo_call(state, parser, False, run_generator, stream, index))
+            return (yield from run_generator(stream, index))
+
+        return generate_step
+
+    def step_forward_declaration(self, parser: Parser, params: dict, full: bool):
+        def grow(stream, index: int):
+            if parser._parser is None:
+                parser._raise_error()
+            native, fn = self.step(parser._parser, full)
+            left_recursion = _parse_state.get().left_recursion
+            key = (parser, index)
+            recursion = left_recursion[key] = _LeftRecursion()
+            try:
+                result = fn(stream, index) if native else (yield fn, index)
+                if not (recursion.detected and result.status):
+                    return result
+                while True:
+                    recursion.seed = result
+                    attempt = fn(stream, index) if native else (yield fn, index)
+                    if not attempt.status or attempt.index <= result.index:
+                        return result.aggregate(attempt)
+                    result = attempt
+            finally:
+                del left_recursion[key]
+
+        def forward_step(stream, index: int):
+            state = _parse_state.get()
+            recursion = state.left_recursion.get((parser, index))
+            if recursion is not None:
+                recursion.detected = True
+                state.seed_uses += 1
+                return recursion.seed
+            if state.packrat:
+                return (yield from _memo_call(state, parser, False, grow, stream, index))
+            return (yield from grow(stream, index))
+
+        return forward_step
+
+
+def _memo_call(state: _ParseState, parser: Parser, native: bool, fn, stream, index: int):
+    """
+    Like ``parsy._memo_call``, for a step.
+    """
+    memo = state.memo
+    key = (parser, index)
+    counts = state.memo_counts.get(parser)
+    if counts is None:
+        counts = state.memo_counts[parser] = [0, 0]
+    result = memo.get(key)
+    if result is not None:
+        memo.move_to_end(key)
+        counts[0] += 1
+        return result
+
+    counts[1] += 1
+    seed_uses = state.seed_uses
+    result = fn(stream, index) if native else (yield from fn(stream, index))
+    if seed_uses != state.seed_uses and state.left_recursion:
+        return result
+    memo[key] = result
+    if len(memo) > state.memo_size:
+        memo.popitem(last=False)
+    return result
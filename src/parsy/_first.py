@@ -0,0 +1,187 @@
+"""
+FIRST sets: which items a parser can start with.
+
+The FIRST set of a parser is a set of items (characters of a str, ints for
+bytes) such that the parser can only succeed at an index if the item of the
+stream at that index is in the set. ``None`` means that the set is not known,
+or that the parser can succeed without consuming anything.
+
+With ``tokens``, the FIRST set is a set of token kinds instead, made from
+``token`` and ``token_from`` parsers, for streams of tokens.
+
+``alt`` uses these to go straight to the alternatives that can match the next
+item.
+"""
+
+from __future__ import annotations
+
+import re
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
+# Character ranges in regexes bigger than this are not expanded
+_MAX_RANGE = 256
+
+# Kinds of parser whose FIRST set is the one of their first child
+_SAME_AS_CHILD = frozenset(
+    ["bind", "map", "combine", "combine_dict", "concat", "desc", "named", "memoize", "peek", "span"]
+)
+
+# Kinds of parser that never consume anything and always succeed
+_ZERO_WIDTH = frozenset(["success", "index", "line_info"])
+
+
+# Kinds of parser whose FIRST set is made from the ones of their children
+_COMBINATORS = _SAME_AS_CHILD | {"forward_declaration", "times", "alt", "seq", "fail"}
+
+
+def first_set(parser, visiting=None, tokens: bool = False) -> frozenset | None:
+    if visiting is None:
+        visiting = set()
+    if parser in visiting:
+        # Recursive without consuming anything first
+        return None
+    visiting.add(parser)
+    try:
+        return _first_set(parser, visiting, tokens)
+    finally:
+        visiting.discard(parser)
+
+
+def _first_set(parser, visiting, tokens: bool) -> frozenset | None:
+    kind = parser._kind
+    params = parser._params
+    children = parser._children
+    if kind in ("token", "token_from"):
+        return params["kinds"] if tokens else None
+    if tokens and kind not in _COMBINATORS:
+        return None
+    if kind == "string":
+        if not parser._regular or not params["expected_string"]:
+            # a transform, or the empty string
+            return None
+        return frozenset([params["expected_string"][0]])
+    if kind in ("string_from", "from_enum"):
+        strings = params["strings"]
+        if not parser._regular or not all(strings):
+            return None
+        return frozenset(s[0] for s in strings)
+    if kind == "char_from":
+        return frozenset(params["characters"])
+    if kind == "regex":
+        return _regex_first_set(params["exp"])
+    if kind == "fail":
+        return frozenset()
+    if kind in _SAME_AS_CHILD or kind == "forward_declaration":
+        return first_set(children[0], visiting, tokens) if children else None
+    if kind == "times":
+        return first_set(children[0], visiting, tokens) if params["min"] >= 1 else None
+    if kind == "alt":
+        sets = [first_set(child, visiting, tokens) for child in children]
+        if None in sets:
+            return None
+        return frozenset().union(*sets)
+    if kind == "seq":
+        for child in children:
+            if child._kind not in _ZERO_WIDTH:
+                return first_set(child, visiting, tokens)
+        return None
+    return None
+
+
+def _regex_first_set(exp: re.Pattern) -> frozenset | None:
+    if exp.flags & (re.IGNORECASE | re.LOCALE):
+        return None
+    try:
+        parsed = sre_parse.parse(exp.pattern, exp.flags)
+        first, nullable = _sequence_first_set(parsed, isinstance(exp.pattern, bytes))
+    except Exception:
+        return None
+    if first is None or nullable:
+        return None
+    return frozenset(first)
+
+
+def _sequence_first_set(items, is_bytes: bool) -> tuple[set | None, bool]:
+    """
+    Returns the FIRST set of a sequence of parsed regex items, and whether the
+    sequence can match the empty string.
+    """
+    first = set()
+    for op, av in items:
+        item_first, nullable = _item_first_set(op, av, is_bytes)
+        if item_first is None:
+            return None, False
+        first |= item_first
+        if not nullable:
+            return first, False
+    return first, True
+
+
+def _item_first_set(op, av, is_bytes: bool) -> tuple[set | None, bool]:
+    item = (lambda code: code) if is_bytes else chr
+    if op is sre_constants.LITERAL:
+        return {item(av)}, False
+    if op is sre_constants.IN:
+        first = set()
+        for in_op, in_av in av:
+            if in_op is sre_constants.LITERAL:
+                first.add(item(in_av))
+            elif in_op is sre_constants.RANGE and in_av[1] - in_av[0] < _MAX_RANGE:
+                first.update(item(code) for code in range(in_av[0], in_av[1] + 1))
+            else:
+                return None, False
+        return first, False
+    if op is sre_constants.SUBPATTERN:
+        add_flags, pattern = av[1], av[3]
+        if add_flags & (re.IGNORECASE | re.LOCALE):
+            return None, False
+        return _sequence_first_set(pattern, is_bytes)
+    if op is sre_constants.BRANCH:
+        first = set()
+        nullable = False
+        for branch in av[1]:
+            branch_first, branch_nullable = _sequence_first_set(branch, is_bytes)
+            if branch_first is None:
+                return None, False
+            first |= branch_first
+            nullable = nullable or branch_nullable
+        return first, nullable
+    if op in _REPEATS:
+        min, _, pattern = av
+        first, nullable = _sequence_first_set(pattern, is_bytes)
+        return first, nullable or min == 0
+    if op in _ZERO_WIDTH_OPS:
+        return set(), True
+    if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _sequence_first_set(av, is_bytes)
+    return None, False
+
+
+_REPEATS = {
+    getattr(sre_constants, name)
+    for name in ["MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"]
+    if hasattr(sre_constants, name)
+}
+_ZERO_WIDTH_OPS = {sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT}
+
+
+def dispatch_table(parsers, tokens: bool = False) -> tuple[dict, tuple] | None:
+    """
+    For the alternatives of an ``alt``, returns a dict from items to the
+    indices of the alternatives that can match starting with that item, in
+    order, and the indices to use for any other item, or at the end of the
+    stream. Returns ``None`` if this would not skip any alternatives.
+    """
+    sets = [first_set(parser, tokens=tokens) for parser in parsers]
+    keys = set().union(*(first for first in sets if first is not None))
+    default = tuple(i for i, first in enumerate(sets) if first is None)
+    if len(default) == len(parsers):
+        return None
+    table = {key: tuple(i for i, first in enumerate(sets) if first is None or key in first) for key in keys}
+    return table, default
@@ -0,0 +1,278 @@
+"""
+Rewrites a grammar into a simpler one for the first phase of parsing.
+
+Failures are reported by running the original parsers again, so the rewritten
+parsers only need to produce the same results, and each one takes the
+``wrapped_fn`` of the parser it replaces. The rewrites are:
+
+- chains of ``then``, ``skip`` and ``+`` become a single ``seq``
+- nested ``alt`` parsers are flattened, dropping ``fail`` alternatives, and
+  the ones after an alternative that always succeeds
+- adjacent ``string`` parsers whose values are not used, or are added
+  together, are merged
+- ``success`` parsers in a chain are dropped, and their value is used as a
+  constant
+- ``desc``, ``map`` with ``noop`` and nested ``peek`` parsers are removed
+"""
+
+from __future__ import annotations
+
+import operator
+from functools import partial, reduce
+
+from parsy import Parser, _alternatives, _left, _right, alt, forward_declaration, noop, peek, seq, string
+
+
+def optimize(parser: Parser) -> Parser:
+    return _Optimizer().optimize(parser)
+
+
+def _with_errors_from(original: Parser, parser: Parser) -> Parser:
+    """
+    Returns a parser that runs ``parser`` in the first phase, and ``original``
+    in the second phase.
+    """
+    if parser is original:
+        return parser
+    if parser._kind == "forward_declaration":
+        # Its structure can't be copied, but an alt with one alternative
+        # has the same results.
+        parser = alt(parser)
+    result = Parser(original.wrapped_fn, parser.fast_fn)
+    result._kind = parser._kind
+    result._children = parser._children
+    result._params = parser._params
+    result._regular = parser._regular
+    result.memo_stats = parser.memo_stats
+    result._prepare = parser._prepare
+    result._errors_from = original._errors_from or original
+    return result
+
+
+def _same(parsers: list[Parser], originals: tuple[Parser, ...]) -> bool:
+    return len(parsers) == len(originals) and all(p is o for p, o in zip(parsers, originals))
+
+
+def _is_pair(parser: Parser, fns: tuple) -> bool:
+    """
+    Returns True if ``parser`` is ``seq(a, b).combine(fn)`` for one of ``fns``,
+    as made by ``then``, ``skip`` and ``+``.
+    """
+    if parser._kind != "combine" or parser._params["fn"] not in fns:
+        return False
+    (child,) = parser._children
+    return child._kind == "seq" and child._params["names"] is None and len(child._children) == 2
+
+
+def _is_literal(parser: Parser) -> bool:
+    return parser._kind == "string" and parser._params["transform"] is noop
+
+
+def _is_text(parser: Parser) -> bool:
+    """
+    Returns True if the value of ``parser`` is always a str or bytes.
+    """
+    kind = parser._kind
+    params = parser._params
+    if kind == "regex":
+        return params["group"] == (0,)
+    if kind == "string_from":
+        return params["transform"] is noop
+    return _is_literal(parser)
+
+
+def _merge(parsers: list[Parser]) -> list[Parser]:
+    """
+    Merges adjacent literals.
+    """
+    merged = []
+    for parser in parsers:
+        if (
+            merged
+            and _is_literal(parser)
+            and _is_literal(merged[-1])
+            and type(parser._params["expected_string"]) is type(merged[-1]._params["expected_string"])
+        ):
+            merged[-1] = string(merged[-1]._params["expected_string"] + parser._params["expected_string"])
+        else:
+            merged.append(parser)
+    return merged
+
+
+def _constant(value, _):
+    return value
+
+
+def _add(*values):
+    return reduce(operator.add, values)
+
+
+class _Optimizer:
+    def __init__(self):
+        # Maps id(parser) to the parser and its optimized version
+        self.optimized = {}
+
+    def optimize(self, parser: Parser) -> Parser:
+        found = self.optimized.get(id(parser))
+        if found is not None:
+            return found[1]
+        kind = parser._kind
+        if kind == "forward_declaration" and parser._parser is not None:
+            declaration = forward_declaration()
+            self.optimized[id(parser)] = (parser, declaration)
+            declaration.become(self.optimize(parser._parser))
+            return declaration
+        method = getattr(self, "optimize_" + kind, None) if kind is not None else None
+        if method is None:
+            result = parser
+        else:
+            result = _with_errors_from(parser, method(parser, parser._params, parser._children))
+        self.optimized[id(parser)] = (parser, result)
+        return result
+
+    def optimize_children(self, parser: Parser) -> list[Parser] | None:
+        """
+        Returns the optimized children of ``parser``, or None if none of them
+        changed.
+        """
+        children = [self.optimize(child) for child in parser._children]
+        return None if _same(children, parser._children) else children
+
+    def optimize_seq(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        if children is None:
+            return parser
+        if params["names"] is None:
+            return seq(*children)
+        return seq(**dict(zip(params["names"], children)))
+
+    def optimize_alt(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        alternatives = []
+        for child in children:
+            for alternative in _alternatives(self.optimize(child)):
+                if alternative._kind == "fail":
+                    continue
+                alternatives.append(alternative)
+                if alternative._kind == "success":
+                    break
+            if alternatives and alternatives[-1]._kind == "success":
+                break
+        if _same(alternatives, children):
+            return parser
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return alt(*alternatives)
+
+    def optimize_times(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].times(params["min"], params["max"])
+
+    def optimize_bind(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].bind(params["fn"])
+
+    def optimize_map(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        child = self.optimize(children[0])
+        if params["fn"] is noop:
+            return child
+        return parser if child is children[0] else child.map(params["fn"])
+
+    def optimize_combine(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        fn = params["fn"]
+        if _is_pair(parser, (_left, _right)):
+            return self.select(*self.select_chain(parser))
+        if _is_pair(parser, (operator.add,)):
+            return self.add(self.add_chain(parser))
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].combine(fn)
+
+    def select_chain(self, parser: Parser) -> tuple[list[Parser], int]:
+        """
+        Returns the parsers in a chain of ``then`` and ``skip``, and the index
+        of the one whose value is produced.
+        """
+        if not _is_pair(parser, (_left, _right)):
+            return [self.optimize(parser)], 0
+        left, right = parser._children[0]._children
+        left_parsers, left_selected = self.select_chain(left)
+        right_parsers, right_selected = self.select_chain(right)
+        if parser._params["fn"] is _left:
+            return left_parsers + right_parsers, left_selected
+        return left_parsers + right_parsers, len(left_parsers) + right_selected
+
+    def select(self, parsers: list[Parser], selected: int) -> Parser:
+        # Parsers that consume nothing and always succeed can go, except for
+        # the one that produces the value.
+        value_parser = parsers[selected]
+        before = [p for p in parsers[:selected] if p._kind != "success"]
+        after = [p for p in parsers[selected + 1 :] if p._kind != "success"]
+        before = _merge(before)
+        after = _merge(after)
+        parsers = before + [value_parser] + after
+        selected = len(before)
+
+        if len(parsers) == 1:
+            return value_parser
+        if value_parser._kind == "success":
+            value = value_parser._params["value"]
+            rest = before + after
+            return (rest[0] if len(rest) == 1 else seq(*rest)).map(partial(_constant, value))
+        if len(parsers) == 2:
+            return seq(*parsers).combine(_left if selected == 0 else _right)
+        return seq(*parsers).map(operator.itemgetter(selected))
+
+    def add_chain(self, parser: Parser) -> list[Parser]:
+        """
+        Returns the parsers in a chain of ``+``, grouped from the left.
+        """
+        if not _is_pair(parser, (operator.add,)):
+            return [self.optimize(parser)]
+        left, right = parser._children[0]._children
+        return self.add_chain(left) + [self.optimize(right)]
+
+    def add(self, parsers: list[Parser]) -> Parser:
+        if all(_is_text(p) for p in parsers):
+            # str and bytes addition is associative
+            parsers = _merge(parsers)
+        if len(parsers) == 1:
+            return parsers[0]
+        if len(parsers) == 2:
+            return seq(*parsers).combine(operator.add)
+        return seq(*parsers).combine(_add)
+
+    def optimize_combine_dict(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].combine_dict(params["fn"])
+
+    def optimize_concat(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].concat()
+
+    def optimize_desc(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        # Descriptions are only used for error messages.
+        return self.optimize(children[0])
+
+    def optimize_named(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        return parser if children is None else children[0].named(params["name"])
+
+    def optimize_peek(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        child = self.optimize(children[0])
+        if child._kind == "peek":
+            return child
+        return parser if child is children[0] else peek(child)
+
+    def optimize_memoize(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        if children is None:
+            return parser
+        memoized = children[0].memoize()
+        # Hits and misses in the first phase are counted on the original.
+        memoized.memo_stats = parser.memo_stats
+        return memoized
+
+    def optimize_until(self, parser: Parser, params: dict, children: tuple) -> Parser:
+        children = self.optimize_children(parser)
+        if children is None:
+            return parser
+        return children[0].until(children[1], params["min"], params["max"], params["consume_other"])
@@ -0,0 +1,238 @@
+"""
+Profiling of named parsers, see ``parsy.profile``.
+
+While a ``Profile`` is active, ``parse``, ``parse_partial`` and
+``parse_prefix`` run a copy of the grammar in which each parser labelled with
+``named`` or ``desc`` records its calls and time. Other parsers count towards
+the closest labelled parser they are part of. With ``heatmap=True``, the
+primitives also count the positions they are evaluated at.
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from dataclasses import dataclass
+from time import perf_counter
+
+from parsy import Parser, _profile_state
+from parsy._rebuild import _Rebuilder
+from parsy._table import format_table
+
+# The name of the parser at the bottom of every stack
+_ROOT = "<parse>"
+
+# How the primitives are named in a heatmap, like in error messages
+_PRIMITIVE_NAMES = {
+    "string": lambda params: repr(params["expected_string"]),
+    "regex": lambda params: repr(params["exp"].pattern),
+    "scan_until": lambda params: "until " + repr(getattr(params["terminator"], "pattern", params["terminator"])),
+    "test_item": lambda params: params["description"],
+    "token": lambda params: repr(params["text"]),
+    "token_from": lambda params: " | ".join(sorted(map(str, params["kinds"]))),
+    "char_from": lambda params: repr(params["characters"]),
+    "any_char": lambda params: "any character",
+    "string_from": lambda params: " | ".join(repr(s) for s in params["strings"]),
+    "from_enum": lambda params: params["enum_cls"].__name__,
+}
+
+
+@dataclass
+class RuleStats:
+    """
+    Counters for a named parser, accumulated while a ``Profile`` is active.
+    """
+
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    # Seconds spent in the parser, and in the parser but not in other named
+    # parsers, counting recursive calls once.
+    inclusive: float = 0.0
+    exclusive: float = 0.0
+    # Items consumed by successful calls
+    consumed: int = 0
+
+
+class Profile:
+    """
+    Collects statistics for the named parsers of grammars parsed while it is
+    active, as a context manager.
+    """
+
+    def __init__(self, heatmap: bool = False):
+        self.stats: dict[str, RuleStats] = {}
+        # With a heatmap, the number of times each named parser or primitive
+        # is evaluated at each index, the items matched by primitives, and the
+        # length of the input parsed.
+        self.evaluations: Counter[tuple[str, int]] | None = Counter() if heatmap else None
+        self.scanned = 0
+        self.input_length = 0
+        # Exclusive seconds for each stack of names, separated by ";"
+        self.stacks: Counter[str] = Counter()
+        self._names = []
+        # Seconds spent in named parsers called by each frame of _names, and
+        # at the bottom, outside of any parse
+        self._nested = [0.0]
+        self._active: Counter[str] = Counter()
+        self._instrumenter = _Instrumenter(self)
+        self._tokens = []
+
+    def __enter__(self) -> Profile:
+        self._tokens.append(_profile_state.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _profile_state.reset(self._tokens.pop())
+
+    def instrument(self, parser: Parser) -> Parser:
+        """
+        Returns a parser like ``parser`` that records statistics.
+        """
+        return _timed(self, _ROOT, self._instrumenter.rebuild(parser))
+
+    def call(self, name: str, fn, stream, index: int):
+        names = self._names
+        nested = self._nested
+        active = self._active
+        if self.evaluations is not None:
+            if names:
+                self.evaluations[name, index] += 1
+            else:
+                self.input_length += len(stream) - index
+        names.append(name)
+        nested.append(0.0)
+        active[name] += 1
+        start = perf_counter()
+        try:
+            result = fn(stream, index)
+        finally:
+            elapsed = perf_counter() - start
+            exclusive = elapsed - nested.pop()
+            nested[-1] += elapsed
+            self.stacks[";".join(names)] += exclusive
+            names.pop()
+            active[name] -= 1
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = RuleStats()
+            stats.calls += 1
+            stats.exclusive += exclusive
+            if not active[name]:
+                stats.inclusive += elapsed
+        if result.status:
+            stats.successes += 1
+            stats.consumed += result.index - index
+        else:
+            stats.failures += 1
+        return result
+
+    def evaluated(self, name: str, index: int, result):
+        self.evaluations[name, index] += 1
+        if result.status:
+            self.scanned += result.index - index
+
+    @property
+    def wasted_work(self) -> float:
+        """
+        The number of items matched by primitives, for every parse, divided by
+        the length of the input. Without backtracking, this is at most 1.
+        """
+        return self.scanned / self.input_length if self.input_length else 0.0
+
+    def heatmap(self, top: int = 10) -> str:
+        """
+        Returns a table of the ``top`` named parsers and primitives evaluated
+        the most times at the same indexes, with the indexes where they were
+        evaluated the most.
+        """
+        if self.evaluations is None:
+            raise ValueError("profile(heatmap=True) is needed for a heatmap")
+        by_name = {}
+        for (name, index), count in self.evaluations.items():
+            by_name.setdefault(name, []).append((count, index))
+        rows = [("name", "evaluations", "indexes", "repeated", "hottest indexes")]
+        hottest = sorted(by_name.items(), key=lambda item: sum(c for c, _ in item[1]) - len(item[1]), reverse=True)
+        for name, counts in hottest[:top]:
+            evaluations = sum(count for count, _ in counts)
+            counts.sort(key=lambda item: (-item[0], item[1]))
+            rows.append(
+                (
+                    name,
+                    str(evaluations),
+                    str(len(counts)),
+                    str(evaluations - len(counts)),
+                    ", ".join(f"{index} (x{count})" for count, index in counts[:3]),
+                )
+            )
+        return (
+            f"wasted work: {self.wasted_work:.2f} ({self.scanned} items matched, input length {self.input_length})\n"
+            + format_table(rows)
+        )
+
+    def collapsed(self) -> str:
+        """
+        Returns the time spent in each stack of named parsers, in
+        microseconds, in the collapsed stack format read by flame graph tools.
+        """
+        return "".join(
+            f"{stack} {round(seconds * 1e6)}\n" for stack, seconds in sorted(self.stacks.items()) if seconds > 0
+        )
+
+    def report(self) -> str:
+        """
+        Returns a table of the statistics of each named parser, the slowest
+        first.
+        """
+        rows = [("name", "calls", "successes", "failures", "inclusive ms", "exclusive ms", "consumed")]
+        for name, stats in sorted(self.stats.items(), key=lambda item: item[1].exclusive, reverse=True):
+            rows.append(
+                (
+                    name,
+                    str(stats.calls),
+                    str(stats.successes),
+                    str(stats.failures),
+                    f"{stats.inclusive * 1000:.3f}",
+                    f"{stats.exclusive * 1000:.3f}",
+                    str(stats.consumed),
+                )
+            )
+        return format_table(rows)
+
+
+def _timed(profile: Profile, name: str, parser: Parser) -> Parser:
+    def make_timed_parser(fn):
+        def timed_parser(stream, index: int):
+            return profile.call(name, fn, stream, index)
+
+        return timed_parser
+
+    return Parser(make_timed_parser(parser.wrapped_fn), make_timed_parser(parser.fast_fn))
+
+
+def _counted(profile: Profile, name: str, parser: Parser) -> Parser:
+    def make_counted_parser(fn):
+        def counted_parser(stream, index: int):
+            result = fn(stream, index)
+            profile.evaluated(name, index, result)
+            return result
+
+        return counted_parser
+
+    return Parser(make_counted_parser(parser.wrapped_fn), make_counted_parser(parser.fast_fn))
+
+
+class _Instrumenter(_Rebuilder):
+    def __init__(self, profile: Profile):
+        super().__init__()
+        self.profile = profile
+
+    def rebuild_node(self, parser: Parser) -> Parser:
+        result = super().rebuild_node(parser)
+        kind = parser._kind
+        if kind == "named":
+            return _timed(self.profile, parser._params["name"], result)
+        if kind == "desc":
+            return _timed(self.profile, parser._params["description"], result)
+        if kind in _PRIMITIVE_NAMES and self.profile.evaluations is not None:
+            return _counted(self.profile, _PRIMITIVE_NAMES[kind](parser._params), result)
+        return result
@@ -0,0 +1,116 @@
+"""
+Rebuilds a grammar with the built-in combinators, so that some of its parsers
+can be replaced, for ``Parser.parse_stream`` and ``parsy.profile``.
+"""
+
+from __future__ import annotations
+
+import weakref
+
+from parsy import Parser, alt, forward_declaration, generate, peek, seq
+
+
+class _Rebuilder:
+    """
+    Rebuilds each parser from its rebuilt children with ``rebuild_<kind>``.
+    Parsers without such a method are kept by ``rebuild_other``, and forward
+    declarations are replaced by ``declaration``.
+    """
+
+    def __init__(self):
+        # Maps parsers to their rebuilt version. Parsers produced while
+        # parsing, by bind and generate, are forgotten once they are no
+        # longer used.
+        self.rebuilt = weakref.WeakKeyDictionary()
+
+    def rebuild(self, parser: Parser) -> Parser:
+        found = self.rebuilt.get(parser)
+        if found is not None:
+            return found
+        if parser._kind == "forward_declaration" and parser._parser is not None:
+            declaration = forward_declaration()
+            # Set first, so that recursive rules find it.
+            self.rebuilt[parser] = result = self.declaration(parser, declaration)
+            declaration.become(self.rebuild(parser._parser))
+            return result
+        result = self.rebuild_node(parser)
+        self.rebuilt[parser] = result
+        return result
+
+    def rebuild_node(self, parser: Parser) -> Parser:
+        kind = parser._kind
+        method = None if kind is None else getattr(self, "rebuild_" + kind, None)
+        if method is None:
+            return self.rebuild_other(parser)
+        return method(parser._params, [self.rebuild(child) for child in parser._children])
+
+    def declaration(self, parser: Parser, declaration: forward_declaration) -> Parser:
+        return declaration
+
+    def rebuild_other(self, parser: Parser) -> Parser:
+        return parser
+
+    def rebuild_seq(self, params: dict, children: list[Parser]) -> Parser:
+        if params["names"] is None:
+            return seq(*children)
+        return seq(**dict(zip(params["names"], children)))
+
+    def rebuild_alt(self, params: dict, children: list[Parser]) -> Parser:
+        return alt(*children)
+
+    def rebuild_times(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].times(params["min"], params["max"])
+
+    def rebuild_bind(self, params: dict, children: list[Parser]) -> Parser:
+        fn = params["fn"]
+        return children[0].bind(lambda value: self.rebuild(fn(value)))
+
+    def rebuild_map(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].map(params["fn"])
+
+    def rebuild_combine(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].combine(params["fn"])
+
+    def rebuild_combine_dict(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].combine_dict(params["fn"])
+
+    def rebuild_concat(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].concat()
+
+    def rebuild_desc(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].desc(params["description"])
+
+    def rebuild_named(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].named(params["name"])
+
+    def rebuild_peek(self, params: dict, children: list[Parser]) -> Parser:
+        return peek(children[0])
+
+    def rebuild_should_fail(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].should_fail(params["description"])
+
+    def rebuild_until(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].until(children[1], params["min"], params["max"], params["consume_other"])
+
+    def rebuild_span(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].span()
+
+    def rebuild_memoize(self, params: dict, children: list[Parser]) -> Parser:
+        return children[0].memoize()
+
+    def rebuild_generate(self, params: dict, children: list[Parser]) -> Parser:
+        fn = params["fn"]
+        rebuild = self.rebuild
+
+        def rebuilt():
+            iterator = fn()
+            value = None
+            try:
+                while True:
+                    value = yield rebuild(iterator.send(value))
+            except StopIteration as stop:
+                if isinstance(stop.value, Parser):
+                    return rebuild(stop.value)
+                return stop.value
+
+        return generate(rebuilt)
@@ -0,0 +1,147 @@
+"""
+Pickling of parsers, see ``Parser.__reduce__``.
+
+A built-in parser is pickled as the primitive or combinator that made it,
+with the parsers and other arguments it was made from, and is made again when
+unpickled. The functions it was given, such as the ones passed to ``map`` or
+``test_item``, are pickled by reference, so they must be defined at the top
+level of a module. Parsers that are module level names, such as
+``parsy.letter`` or functions decorated with ``generate`` or ``Parser``, are
+pickled by reference too.
+"""
+
+from __future__ import annotations
+
+import importlib
+import sys
+
+import parsy
+from parsy import (
+    Parser,
+    alt,
+    char_from,
+    fail,
+    from_enum,
+    generate,
+    lexer,
+    peek,
+    regex,
+    scan_until,
+    seq,
+    string,
+    string_from,
+    success,
+    test_item,
+    token,
+    token_from,
+)
+
+
+def _seq(children: tuple, params: dict) -> Parser:
+    if params["names"] is None:
+        return seq(*children)
+    return seq(**dict(zip(params["names"], children)))
+
+
+# How each kind of parser is made from its children and params
+_BUILDERS = {
+    "string": lambda children, params: string(params["expected_string"], params["transform"]),
+    "regex": lambda children, params: regex(params["exp"], group=params["group"]),
+    "scan_until": lambda children, params: scan_until(params["terminator"]),
+    "lexer": lambda children, params: lexer(params["rules"], params["skip"], params["flags"]),
+    "test_item": lambda children, params: test_item(params["func"], params["description"]),
+    "token": lambda children, params: token(*params["kinds"], params["text"]),
+    "token_from": lambda children, params: token_from(*params["kinds"]),
+    "char_from": lambda children, params: char_from(params["characters"]),
+    "any_char": lambda children, params: parsy.any_char,
+    "success": lambda children, params: success(params["value"]),
+    "fail": lambda children, params: fail(params["expected"]),
+    "eof": lambda children, params: parsy.eof,
+    "index": lambda children, params: parsy.index,
+    "line_info": lambda children, params: parsy.line_info,
+    "string_from": lambda children, params: string_from(*params["strings"], transform=params["transform"]),
+    "from_enum": lambda children, params: from_enum(params["enum_cls"], params["transform"]),
+    "seq": _seq,
+    "alt": lambda children, params: alt(*children),
+    "times": lambda children, params: children[0].times(params["min"], params["max"]),
+    "bind": lambda children, params: children[0].bind(params["fn"]),
+    "map": lambda children, params: children[0].map(params["fn"]),
+    "combine": lambda children, params: children[0].combine(params["fn"]),
+    "combine_dict": lambda children, params: children[0].combine_dict(params["fn"]),
+    "concat": lambda children, params: children[0].concat(),
+    "desc": lambda children, params: children[0].desc(params["description"]),
+    "named": lambda children, params: children[0].named(params["name"]),
+    "peek": lambda children, params: peek(children[0]),
+    "should_fail": lambda children, params: children[0].should_fail(params["description"]),
+    "until": lambda children, params: children[0].until(
+        children[1], params["min"], params["max"], params["consume_other"]
+    ),
+    "memoize": lambda children, params: children[0].memoize(),
+    "span": lambda children, params: children[0].span(),
+    "generate": lambda children, params: generate(params["fn"]),
+}
+
+# Names of the parsers defined by parsy, by id
+_parsy_names: dict[int, str] | None = None
+
+
+def reduce_parser(parser: Parser):
+    global _parsy_names
+    if _parsy_names is None:
+        _parsy_names = {id(value): name for name, value in vars(parsy).items() if isinstance(value, Parser)}
+    name = _parsy_names.get(id(parser))
+    if name is not None:
+        return name
+    if parser._made_by is not None:
+        return parser._made_by
+    if parser._errors_from is not None:
+        return (Parser.optimize, (parser._errors_from,))
+    kind = parser._kind
+    if kind == "generate":
+        reference = _reference(parser._params["fn"], parser)
+    elif kind in _BUILDERS:
+        return (_build, (kind, parser._children, parser._params))
+    else:
+        reference = _reference(parser.wrapped_fn, parser)
+    if reference is not None:
+        return reference
+    if kind == "generate":
+        return (_build, (kind, (), parser._params))
+    if parser.fast_fn is parser.wrapped_fn:
+        return (Parser, (parser.wrapped_fn,))
+    return (Parser, (parser.wrapped_fn, parser.fast_fn))
+
+
+def _build(kind: str, children: tuple, params: dict) -> Parser:
+    return _BUILDERS[kind](children, params)
+
+
+def _reference(fn, parser: Parser):
+    """
+    Returns how to find ``parser`` from the module level name that ``fn`` was
+    defined as, when it was decorated to make ``parser``, possibly described
+    with ``desc``.
+    """
+    module = sys.modules.get(getattr(fn, "__module__", None))
+    qualname = getattr(fn, "__qualname__", "")
+    if module is None or "<locals>" in qualname:
+        return None
+    value = module
+    for part in qualname.split("."):
+        value = getattr(value, part, None)
+    depth = 0
+    while isinstance(value, Parser) and value is not parser and value._kind == "desc":
+        value = value._children[0]
+        depth += 1
+    if value is not parser:
+        return None
+    return (_find, (module.__name__, qualname, depth))
+
+
+def _find(module: str, qualname: str, depth: int) -> Parser:
+    value = importlib.import_module(module)
+    for part in qualname.split("."):
+        value = getattr(value, part)
+    for _ in range(depth):
+        value = value._children[0]
+    return value
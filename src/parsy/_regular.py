@@ -0,0 +1,376 @@
+"""
+Compiles the regular parts of a grammar into single regular expressions.
+
+A parser made only of ``string``, ``regex``, ``char_from``, ``any_char``,
+``success`` and ``eof``, combined with ``seq``, ``alt``, ``times``, ``map``,
+``combine``, ``combine_dict``, ``concat``, ``desc`` and ``peek``, recognises a
+regular language, and can be matched by the ``re`` engine in one call.
+
+PEG semantics are kept by making every part atomic: alternatives commit to the
+first one that matches, and repetitions are possessive. The value the
+combinators would have produced is rebuilt from named groups in the match.
+Repetitions are rebuilt by matching the repeated part again at each position,
+which the ``re`` engine also does without going through the combinators.
+
+Only the fast phase of parsing uses the compiled expressions. Failures are
+reported by running the original combinators again.
+"""
+
+from __future__ import annotations
+
+import operator
+import re
+import sys
+
+from parsy import _combine_dict_kwargs, _trie_pattern
+
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    sre_constants = sre_parse = None
+
+# Atomic groups and possessive quantifiers need Python 3.11
+SUPPORTED = sys.version_info >= (3, 11)
+
+_MAX_REPEAT = 2**31 - 1
+_INLINE_FLAGS = [(re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x")]
+
+
+class NotRegular(Exception):
+    pass
+
+
+def compile_parser(parser):
+    """
+    Returns a ``(stream_type, match, build)`` tuple for the parser, where
+    ``match`` is the ``match`` method of a compiled pattern for streams of
+    ``stream_type``, and ``build(match, stream)`` returns the value the parser
+    would have produced. Returns ``None`` if the parser is not regular.
+    """
+    if not SUPPORTED:
+        return None
+    try:
+        stream_type = _stream_type(parser)
+        return (stream_type, *_Compiler(stream_type).compile(parser))
+    except NotRegular:
+        return None
+
+
+def _stream_type(node):
+    """
+    Returns the type of stream (str or bytes) the literals and patterns in the
+    parser can match.
+    """
+    found = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        kind = node._kind
+        params = node._params
+        if kind == "string":
+            found.add(type(params["expected_string"]))
+        elif kind == "regex":
+            found.add(type(params["exp"].pattern))
+        elif kind == "char_from":
+            found.add(type(params["characters"]))
+        elif kind in ("string_from", "from_enum"):
+            found.add(type(params["strings"][0]))
+        stack.extend(node._children)
+    if len(found) > 1:
+        raise NotRegular
+    return found.pop() if found else str
+
+
+def _is_text(node) -> bool:
+    """
+    Returns True if the value the parser produces is always the text it
+    matched.
+    """
+    kind = node._kind
+    if kind in ("string", "regex", "char_from", "any_char", "string_from"):
+        return True
+    if kind == "alt":
+        return all(_is_text(child) for child in node._children)
+    if kind in ("desc", "named"):
+        return _is_text(node._children[0])
+    if kind == "concat":
+        return _is_text_list(node._children[0])
+    if kind == "combine" and node._params["fn"] is operator.add:
+        return _is_text_list(node._children[0])
+    return False
+
+
+def _is_text_list(node) -> bool:
+    """
+    Returns True if the value the parser produces is always a list of strings
+    that join up to the text it matched.
+    """
+    kind = node._kind
+    if kind == "seq":
+        return node._params["names"] is None and all(_is_text(child) for child in node._children)
+    if kind == "times":
+        return _is_text(node._children[0])
+    return False
+
+
+def _has_group_references(parsed) -> bool:
+    for op, av in parsed:
+        if op in (sre_constants.GROUPREF, sre_constants.GROUPREF_IGNORE, sre_constants.GROUPREF_EXISTS):
+            return True
+        if isinstance(av, (list, tuple)):
+            for item in av:
+                if isinstance(item, sre_parse.SubPattern) and _has_group_references(item):
+                    return True
+                if isinstance(item, (list, tuple)) and any(
+                    isinstance(sub, sre_parse.SubPattern) and _has_group_references(sub) for sub in item
+                ):
+                    return True
+        elif isinstance(av, sre_parse.SubPattern) and _has_group_references(av):
+            return True
+    return False
+
+
+def _constant(value):
+    return lambda match, stream: value
+
+
+def _group(name):
+    return lambda match, stream: match.group(name)
+
+
+class _Compiler:
+    def __init__(self, stream_type):
+        self.stream_type = stream_type
+        self.group_count = 0
+
+    def compile(self, parser):
+        pattern, build, _ = self.emit(parser, True)
+        try:
+            compiled = re.compile(self.as_stream_type(pattern))
+        except (re.error, RecursionError, OverflowError):
+            raise NotRegular
+        return compiled.match, build
+
+    def new_group(self):
+        self.group_count += 1
+        return f"_parsy_{self.group_count}"
+
+    def as_str(self, text):
+        if isinstance(text, bytes):
+            return text.decode("latin-1")
+        return text
+
+    def as_stream_type(self, pattern):
+        if self.stream_type is bytes:
+            return pattern.encode("latin-1")
+        return pattern
+
+    def capture(self, pattern):
+        name = self.new_group()
+        return f"(?P<{name}>{pattern})", name
+
+    def emit(self, node, want_value):
+        """
+        Returns ``(pattern, build, nullable)`` for the node. ``build`` is None if
+        ``want_value`` is False.
+        """
+        if not node._regular:
+            raise NotRegular
+        return getattr(self, "emit_" + node._kind)(node, node._params, node._children, want_value)
+
+    # Primitives
+
+    def emit_string(self, node, params, children, want_value):
+        expected_string = params["expected_string"]
+        pattern = re.escape(self.as_str(expected_string))
+        return pattern, _constant(expected_string) if want_value else None, not expected_string
+
+    def emit_string_from(self, node, params, children, want_value):
+        strings = params["strings"]
+        pattern = f"(?>{self.as_str(_trie_pattern(strings))})"
+        # Sorted longest first, so only the last can be empty
+        nullable = not strings[-1]
+        if not want_value:
+            return pattern, None, nullable
+        values = {}
+        for s, value in zip(strings, params["values"]):
+            values.setdefault(s, value)
+        pattern, name = self.capture(pattern)
+        return pattern, lambda match, stream: values[match.group(name)], nullable
+
+    emit_from_enum = emit_string_from
+
+    def emit_regex(self, node, params, children, want_value):
+        exp = params["exp"]
+        flags = exp.flags
+        on = "".join(letter for flag, letter in _INLINE_FLAGS if flags & flag)
+        off = "".join(letter for flag, letter in _INLINE_FLAGS if not flags & flag)
+        if flags & re.ASCII:
+            on += "a"
+        if off:
+            on += "-" + off
+        pattern = self.as_str(exp.pattern)
+        if flags & re.VERBOSE:
+            # Don't let a trailing comment swallow the closing parenthesis
+            pattern += "\n"
+        pattern = f"(?>(?{on}:{pattern}))"
+        try:
+            parsed = sre_parse.parse(self.as_stream_type(pattern))
+        except Exception:
+            # The pattern can't be embedded, e.g. it starts with global flags.
+            raise NotRegular
+        if exp.groups and _has_group_references(parsed):
+            # Group numbers change when the pattern is embedded.
+            raise NotRegular
+        nullable = parsed.getwidth()[0] == 0
+        if want_value:
+            pattern, name = self.capture(pattern)
+            return pattern, _group(name), nullable
+        return pattern, None, nullable
+
+    def emit_char_from(self, node, params, children, want_value):
+        pattern = "[" + "".join(re.escape(c) for c in self.as_str(params["characters"])) + "]"
+        if want_value:
+            pattern, name = self.capture(pattern)
+            return pattern, _group(name), False
+        return pattern, None, False
+
+    def emit_any_char(self, node, params, children, want_value):
+        pattern = "(?s:.)"
+        if want_value:
+            pattern, name = self.capture(pattern)
+            return pattern, _group(name), False
+        return pattern, None, False
+
+    def emit_success(self, node, params, children, want_value):
+        return "", _constant(params["value"]) if want_value else None, True
+
+    def emit_eof(self, node, params, children, want_value):
+        return r"\Z", _constant(None) if want_value else None, True
+
+    # Combinators
+
+    def emit_seq(self, node, params, children, want_value):
+        parts = [self.emit(child, want_value) for child in children]
+        pattern = "".join(part[0] for part in parts)
+        nullable = all(part[2] for part in parts)
+        if not want_value:
+            return pattern, None, nullable
+
+        builds = [part[1] for part in parts]
+        names = params["names"]
+        if names is None:
+
+            def build(match, stream):
+                return [build(match, stream) for build in builds]
+
+        else:
+            named_builds = list(zip(names, builds))
+
+            def build(match, stream):
+                return {name: build(match, stream) for name, build in named_builds}
+
+        return pattern, build, nullable
+
+    def emit_alt(self, node, params, children, want_value):
+        parts = [self.emit(child, want_value) for child in children]
+        nullable = any(part[2] for part in parts)
+        if not want_value:
+            return "(?>" + "|".join(part[0] for part in parts) + ")", None, nullable
+
+        branches = []
+        patterns = []
+        for pattern, build, _ in parts:
+            pattern, name = self.capture(pattern)
+            patterns.append(pattern)
+            branches.append((name, build))
+
+        def build(match, stream):
+            for name, build in branches:
+                if match.start(name) != -1:
+                    return build(match, stream)
+
+        return "(?>" + "|".join(patterns) + ")", build, nullable
+
+    def emit_times(self, node, params, children, want_value):
+        (child,) = children
+        min, max = params["min"], params["max"]
+        if min < 0:
+            # The combinators count a negative min as zero, but in a pattern
+            # it would be matched as text.
+            min = 0
+        if max < min:
+            raise NotRegular
+        pattern, _, nullable = self.emit(child, False)
+        if nullable:
+            # The combinators would repeat an empty match up to max times,
+            # which the re engine does not do.
+            raise NotRegular
+        if max == float("inf"):
+            quantifier = f"{{{min},}}+"
+        elif max <= _MAX_REPEAT:
+            quantifier = f"{{{min},{max}}}+"
+        else:
+            raise NotRegular
+        pattern = f"(?:{pattern}){quantifier}"
+        if not want_value:
+            return pattern, None, min == 0
+        pattern, name = self.capture(pattern)
+
+        # Each repetition is matched again, in isolation, to get its value.
+        child_match, child_build = _Compiler(self.stream_type).compile(child)
+
+        def build(match, stream):
+            index, end = match.span(name)
+            values = []
+            while index < end:
+                child = child_match(stream, index)
+                values.append(child_build(child, stream))
+                index = child.end()
+            return values
+
+        return pattern, build, min == 0
+
+    def emit_map(self, node, params, children, want_value):
+        pattern, child_build, nullable = self.emit(children[0], want_value)
+        if not want_value:
+            return pattern, None, nullable
+        fn = params["fn"]
+        return pattern, lambda match, stream: fn(child_build(match, stream)), nullable
+
+    def emit_combine(self, node, params, children, want_value):
+        pattern, child_build, nullable = self.emit(children[0], want_value)
+        if not want_value:
+            return pattern, None, nullable
+        fn = params["fn"]
+        return pattern, lambda match, stream: fn(*child_build(match, stream)), nullable
+
+    def emit_combine_dict(self, node, params, children, want_value):
+        pattern, child_build, nullable = self.emit(children[0], want_value)
+        if not want_value:
+            return pattern, None, nullable
+        fn = params["fn"]
+        return pattern, lambda match, stream: fn(**_combine_dict_kwargs(child_build(match, stream))), nullable
+
+    def emit_concat(self, node, params, children, want_value):
+        (child,) = children
+        if self.stream_type is str and _is_text_list(child):
+            pattern, _, nullable = self.emit(child, False)
+            if not want_value:
+                return pattern, None, nullable
+            pattern, name = self.capture(pattern)
+            return pattern, _group(name), nullable
+        pattern, child_build, nullable = self.emit(child, want_value)
+        if not want_value:
+            return pattern, None, nullable
+        return pattern, lambda match, stream: "".join(child_build(match, stream)), nullable
+
+    def emit_desc(self, node, params, children, want_value):
+        return self.emit(children[0], want_value)
+
+    emit_named = emit_desc
+
+    def emit_peek(self, node, params, children, want_value):
+        pattern, build, _ = self.emit(children[0], want_value)
+        return f"(?={pattern})", build, True
@@ -0,0 +1,352 @@
+"""
+Parsing of streams read from files or iterables of chunks, see
+``Parser.parse_stream``.
+
+The grammar is rebuilt for a ``_StreamBuffer``:
+
+- primitives are run on the part of the stream that has been read, after
+  reading as far ahead as they need
+- parsers that can backtrack (``alt``, ``peek``, forward declarations and so
+  on) pin the position they may go back to while they run, and ``times``
+  moves its pin forward after each repetition, which lets the buffer discard
+  what comes before
+- parsers only known while parsing, from ``bind`` and ``generate``, are
+  rebuilt as they are produced
+
+Only the complete parsing functions are used, in a single phase, since the
+start of the stream may be gone by the time a second phase would need it.
+"""
+
+from __future__ import annotations
+
+from typing import Callable
+
+try:
+    from re import _compiler as sre_compile
+except ImportError:  # Python < 3.11
+    import sre_compile
+
+from parsy import (
+    _NO_EXPECTED,
+    ParseError,
+    Parser,
+    Result,
+    Span,
+    _parse_state,
+    _ParseState,
+    _StreamBuffer,
+    eof,
+    forward_declaration,
+    index,
+    line_info,
+    seq,
+)
+from parsy._first import _regex_first_set, sre_constants, sre_parse
+from parsy._rebuild import _Rebuilder
+
+# Parsers that only look at the stream after their index, and how far they
+# look, given their params and the chunk size.
+_LOOKAHEAD = {
+    "string": lambda params, chunk_size: len(params["expected_string"]),
+    "regex": lambda params, chunk_size: chunk_size,
+    "test_item": lambda params, chunk_size: 1,
+    "char_from": lambda params, chunk_size: 1,
+    "any_char": lambda params, chunk_size: 1,
+    "string_from": lambda params, chunk_size: len(params["strings"][0]),
+    "from_enum": lambda params, chunk_size: len(params["strings"][0]),
+    "eof": lambda params, chunk_size: 1,
+    "scan_until": lambda params, chunk_size: chunk_size,
+}
+
+# Parsers that don't read the stream, or only through line_info_at
+_UNCHANGED = frozenset(["success", "fail", "index", "line_info"])
+
+
+def parse_stream(parser: Parser, source, chunk_size: int, packrat: bool, memo_size: int):
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    stream = _StreamBuffer(_chunks(source, chunk_size), chunk_size)
+    streaming = _Streamer(chunk_size).rebuild(parser << eof)
+    state = _ParseState(stream, packrat, memo_size)
+    token = _parse_state.set(state)
+    try:
+        result = streaming.wrapped_fn(stream, 0)
+    finally:
+        _parse_state.reset(token)
+        state.finish()
+    if result.status:
+        return result.value
+    raise ParseError(result.expected, stream, result.furthest)
+
+
+def _chunks(source, chunk_size: int):
+    if hasattr(source, "read"):
+        read = source.read
+        while chunk := read(chunk_size):
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
+
+
+def _windowed(parser: Parser, lookahead: int) -> Parser:
+    """
+    Returns a parser that runs ``parser`` on the part of the stream that has
+    been read, with at least ``lookahead`` items after the index.
+    """
+    fn = parser.wrapped_fn
+    scan = parser._kind == "scan_until"
+    settled = _regex_settled(parser._params["exp"]) if parser._kind == "regex" else None
+
+    def windowed_parser(stream: _StreamBuffer, index: int) -> Result:
+        stream.check(index)
+        end = index + lookahead
+        while True:
+            stream.fill(end)
+            offset = stream.offset
+            data = stream.data
+            result = fn(data, index - offset)
+            if stream.at_eof:
+                break
+            if settled is not None and not settled(result, data, index - offset):
+                # The regex may match differently with the part that hasn't
+                # been read yet.
+                end = offset + 2 * len(data)
+                continue
+            if scan and not result.status:
+                # The terminator may be in the part that hasn't been read yet.
+                end = offset + 2 * len(data)
+                continue
+            break
+        furthest = result.furthest if result.furthest < 0 else result.furthest + offset
+        if result.status:
+            return Result(True, result.index + offset, result.value, furthest, result.expected)
+        return Result(False, -1, None, furthest, result.expected)
+
+    return Parser(windowed_parser)
+
+
+def _regex_settled(exp) -> Callable[[Result, str | bytes, int], bool]:
+    """
+    Returns a function that tells whether the result of matching ``exp`` at
+    an index of the part of the stream that has been read can't change when
+    more is read.
+    """
+    try:
+        parsed = sre_parse.parse(exp.pattern, exp.flags)
+        width, reach, after = _reach(parsed)
+        repeats = []
+        _, bounded, _ = _reach(parsed, repeats)
+        runs = [sre_compile.compile(_repeat(body), exp.flags).match for body in repeats]
+    except Exception:
+        reach = after = bounded = None
+    first = _regex_first_set(exp)
+
+    def settled(result: Result, data, start: int) -> bool:
+        if reach is not None and len(data) - start >= reach:
+            # Every item the regex can look at has been read.
+            return True
+        if result.status:
+            if after is None or result.index + after >= len(data):
+                # The match could go on, or look at what comes after it.
+                return False
+        elif first is not None and start < len(data) and data[start] not in first:
+            # The regex can only match starting with an item in ``first``.
+            return True
+        if bounded is None:
+            return False
+        # Each unbounded repetition starts within a bounded number of items
+        # of where the one before stopped, and stops at an item it doesn't
+        # match, after which the regex only looks at a bounded number of
+        # items.
+        position = start
+        for run in runs:
+            position = run(data, position + bounded).end()
+            if position == len(data):
+                return False
+            position += 1
+        return position + bounded < len(data)
+
+    return settled
+
+
+def _repeat(body):
+    """
+    Returns the parsed regex that repeats ``body`` any number of times.
+    """
+    return sre_parse.SubPattern(body.state, [(sre_constants.MAX_REPEAT, (0, sre_constants.MAXREPEAT, body))])
+
+
+def _reach(items, repeats: list | None = None) -> tuple[int | None, int | None, int | None]:
+    """
+    For a sequence of parsed regex items, returns the most items it can
+    match, the most items after where it starts that it can look at, and the
+    most items after where a match ends that it can look at, each ``None``
+    when unbounded. With ``repeats``, unbounded repetitions of one item are
+    counted as matching nothing, and their item is added to ``repeats``.
+    """
+    width = reach = after = 0
+    for op, av in items:
+        item_width, item_reach, item_after = _item_reach(op, av, repeats)
+        reach = None if width is None or reach is None or item_reach is None else max(reach, width + item_reach)
+        width = None if width is None or item_width is None else width + item_width
+        after = None if after is None or item_after is None else max(after, item_after)
+    return width, reach, after
+
+
+def _item_reach(op, av, repeats: list | None) -> tuple[int | None, int | None, int | None]:
+    if op in _ONE_ITEM:
+        return 1, 1, 0
+    if op is sre_constants.AT:
+        # Such as $ or \b, which look at the next item
+        return 0, 1, 1
+    if op is sre_constants.SUBPATTERN:
+        return _reach(av[3], repeats)
+    if op is getattr(sre_constants, "ATOMIC_GROUP", None):
+        return _reach(av, repeats)
+    if op is sre_constants.BRANCH:
+        branches = [_reach(branch, repeats) for branch in av[1]]
+        return tuple(None if None in values else max(values) for values in zip(*branches))
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        direction, pattern = av
+        if direction < 0:
+            return 0, 0, 0
+        _, reach, _ = _reach(pattern, repeats)
+        return 0, reach, reach
+    if op in _REPEATS:
+        _, max_count, pattern = av
+        if max_count == 0:
+            return 0, 0, 0
+        if (
+            max_count == sre_constants.MAXREPEAT
+            and repeats is not None
+            and len(pattern) == 1
+            and pattern[0][0] in _ONE_ITEM
+        ):
+            repeats.append(pattern)
+            return 0, 0, 0
+        width, reach, after = _reach(pattern, repeats)
+        if max_count == sre_constants.MAXREPEAT or width is None or reach is None:
+            return None, None, after
+        return max_count * width, (max_count - 1) * width + reach, after
+    return None, None, None
+
+
+_ONE_ITEM = {sre_constants.LITERAL, sre_constants.NOT_LITERAL, sre_constants.ANY, sre_constants.IN}
+_REPEATS = {
+    getattr(sre_constants, name)
+    for name in ["MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"]
+    if hasattr(sre_constants, name)
+}
+
+
+def _pinned(parser: Parser) -> Parser:
+    """
+    Returns a parser that keeps the stream from its index while ``parser``
+    runs, for parsers that may backtrack to it.
+    """
+
+    def pinned_parser(stream: _StreamBuffer, index: int) -> Result:
+        pins = stream.pins
+        pins.append(index)
+        try:
+            return parser.wrapped_fn(stream, index)
+        finally:
+            pins.pop()
+
+    return Parser(pinned_parser)
+
+
+def _times(parser: Parser, min: int, max: int) -> Parser:
+    """
+    Like ``parser.times(min, max)``, letting the stream discard the
+    repetitions that have been parsed.
+    """
+    fn = parser.wrapped_fn
+
+    def times_parser(stream: _StreamBuffer, index: int) -> Result:
+        pins = stream.pins
+        position = len(pins)
+        pins.append(index)
+        try:
+            values = []
+            times = 0
+            result = None
+
+            while times < max:
+                result = fn(stream, index).aggregate(result)
+                if result.status:
+                    values.append(result.value)
+                    index = result.index
+                    times += 1
+                    # The repetitions parsed can't be backtracked into, only
+                    # to the positions pinned by the parsers around this one.
+                    pins[position] = index
+                    stream.release(pins[0])
+                elif times >= min:
+                    break
+                else:
+                    return result
+
+            return Result(True, index, values, -1, _NO_EXPECTED).aggregate(result)
+        finally:
+            pins.pop()
+
+    return Parser(times_parser)
+
+
+class _KnownLines(dict):
+    """
+    Lines and columns of positions looked up while parsing.
+    """
+
+    line_info_at = dict.__getitem__
+
+
+class _Streamer(_Rebuilder):
+    def __init__(self, chunk_size: int):
+        super().__init__()
+        self.chunk_size = chunk_size
+
+    def rebuild_node(self, parser: Parser) -> Parser:
+        kind = parser._kind
+        if kind in _LOOKAHEAD:
+            return _windowed(parser, _LOOKAHEAD[kind](parser._params, self.chunk_size))
+        if kind in _UNCHANGED:
+            return parser
+        return super().rebuild_node(parser)
+
+    def declaration(self, parser: Parser, declaration: forward_declaration) -> Parser:
+        # Left recursion is grown by parsing again at the same index.
+        return _pinned(declaration)
+
+    def rebuild_other(self, parser: Parser) -> Parser:
+        # Not built in: it gets the buffer, and may backtrack anywhere.
+        return _pinned(parser)
+
+    def rebuild_alt(self, params: dict, children: list[Parser]) -> Parser:
+        return _pinned(super().rebuild_alt(params, children))
+
+    def rebuild_times(self, params: dict, children: list[Parser]) -> Parser:
+        return _times(children[0], params["min"], params["max"])
+
+    def rebuild_desc(self, params: dict, children: list[Parser]) -> Parser:
+        # A failure is reported at the index it started at.
+        return _pinned(super().rebuild_desc(params, children))
+
+    def rebuild_peek(self, params: dict, children: list[Parser]) -> Parser:
+        return _pinned(super().rebuild_peek(params, children))
+
+    def rebuild_should_fail(self, params: dict, children: list[Parser]) -> Parser:
+        return _pinned(super().rebuild_should_fail(params, children))
+
+    def rebuild_until(self, params: dict, children: list[Parser]) -> Parser:
+        return _pinned(super().rebuild_until(params, children))
+
+    def rebuild_span(self, params: dict, children: list[Parser]) -> Parser:
+        # The start may be discarded by the time the span is read.
+        def make_span(start, start_info, value, end, end_info):
+            return Span(value, start, end, _KnownLines({start: start_info, end: end_info}))
+
+        return seq(index, line_info, children[0], index, line_info).combine(make_span)
@@ -0,0 +1,16 @@
+"""
+Plain text tables, for ``parsy.profile`` reports and ``parsy.bench``.
+"""
+
+from __future__ import annotations
+
+
+def format_table(rows: list[tuple[str, ...]]) -> str:
+    """
+    Formats rows of cells, the first column aligned left and the others right.
+    """
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return "".join(
+        row[0].ljust(widths[0]) + "".join("  " + cell.rjust(width) for cell, width in zip(row[1:], widths[1:])) + "\n"
+        for row in rows
+    )
@@ -0,0 +1,396 @@
+"""
+Benchmarks for parsy, run with::
+
+    python -m parsy.bench [--quick] [--json results.json] [--compare baseline.json]
+                          [--threads N] [name ...]
+
+Each benchmark builds a grammar and parses generated inputs of increasing
+size, recording the time to build the grammar, percentiles of the time to
+parse, the throughput in items per second and the peak memory allocated while
+parsing. The benchmarks of the example grammars need the ``examples`` package
+of a checkout of the repository, so they are run from its root directory.
+
+With ``--threads``, the largest input is also parsed on that many threads at
+once with the same grammar, to measure how parsing scales, which needs a
+free-threaded build of Python to go beyond one core.
+"""
+
+from __future__ import annotations
+
+import argparse
+import gc
+import importlib
+import json
+import platform
+import random
+import sys
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from time import perf_counter
+from typing import Any, Callable
+
+from parsy import Parser, __version__, forward_declaration, regex, seq, string
+from parsy._table import format_table
+
+
+@dataclass
+class Benchmark:
+    name: str
+    # Builds the grammar, and returns a function that parses an input
+    build: Callable[[], Callable[[Any], Any]]
+    # Returns the input for a size
+    make_input: Callable[[int], Any]
+    sizes: tuple[int, ...]
+
+
+@dataclass
+class Measurement:
+    # The number of items of the input
+    items: int
+    build_ms: float
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    items_per_second: float
+    peak_kib: float
+    repeats: int
+
+
+@dataclass
+class Scaling:
+    threads: int
+    # Items parsed per second by one thread, and by all the threads together
+    items_per_second: float
+    threaded_items_per_second: float
+    speedup: float
+
+
+def _example(module_name: str, get_parse: Callable[[Any], Callable[[Any], Any]]):
+    def build():
+        module = sys.modules.get(module_name)
+        module = importlib.import_module(module_name) if module is None else importlib.reload(module)
+        return get_parse(module)
+
+    return build
+
+
+def _json_input(size: int) -> str:
+    rng = random.Random(size)
+    records = [
+        {
+            "id": i,
+            "name": "".join(rng.choice("abcdefgh") for _ in range(rng.randint(3, 12))),
+            "score": rng.random() * 1000,
+            "tags": ["x", "y\n", "é"][: rng.randint(0, 3)],
+            "active": rng.random() < 0.5,
+            "parent": None if i == 0 else {"id": i - 1},
+        }
+        for i in range(size)
+    ]
+    return json.dumps(records, indent=2)
+
+
+def _sql_input(size: int) -> str:
+    columns = [["field_%d" % i, "'text %d'" % i, str(i)][i % 3] for i in range(size)]
+    return f"SELECT {', '.join(columns)} FROM my_table WHERE id >= 100;"
+
+
+def _logo_input(size: int) -> str:
+    return "".join(f"{['fd', 'bk', 'rt', 'lt'][i % 4]} {i % 360}\n" for i in range(size))
+
+
+def _logo_tokens(size: int) -> list:
+    return importlib.import_module("examples.simple_logo_lexer").lexer.parse(_logo_input(size))
+
+
+def _expression_input(size: int) -> str:
+    rng = random.Random(size)
+    terms = ["1", "2.5 * 4", "(3 - 1 + 7)", "9 / 3", "2 * -6"]
+    return " + ".join(rng.choice(terms) for _ in range(size))
+
+
+def _backtracking():
+    # Each alternative parses the atom again, so nesting makes it exponential.
+    expr = forward_declaration()
+    atom = regex("[0-9]+") | string("(") >> expr << string(")")
+    expr.become(seq(atom, string("+"), expr) | seq(atom, string("-"), expr) | atom)
+    return expr.parse
+
+
+def _nested():
+    value = forward_declaration()
+    value.become(string("[") >> value.sep_by(string(",")) << string("]"))
+    return value
+
+
+def _marks():
+    word = regex("[a-z]+").mark()
+    return word.sep_by(regex(r"\s+")).parse
+
+
+def _words(size: int) -> str:
+    rng = random.Random(size)
+    return "".join(
+        "".join(rng.choice("abcdefgh") for _ in range(rng.randint(1, 8))) + ("\n" if i % 10 == 9 else " ")
+        for i in range(size)
+    ).rstrip()
+
+
+BENCHMARKS = [
+    Benchmark("json", _example("examples.json", lambda m: m.json_doc.parse), _json_input, (10, 100, 1000)),
+    Benchmark("sql_select", _example("examples.sql_select", lambda m: m.select.parse), _sql_input, (10, 100, 1000)),
+    Benchmark(
+        "logo_lexer", _example("examples.simple_logo_lexer", lambda m: m.lexer.parse), _logo_input, (100, 1000, 10000)
+    ),
+    Benchmark(
+        "logo_tokens",
+        _example("examples.simple_logo_parser", lambda m: m.program.parse),
+        _logo_tokens,
+        (100, 1000, 10000),
+    ),
+    # The grammar is built for each expression.
+    Benchmark(
+        "simple_eval", _example("examples.simple_eval", lambda m: m.simple_eval), _expression_input, (10, 100, 1000)
+    ),
+    Benchmark("backtracking", _backtracking, lambda size: "(" * size + "1" + ")" * size, (4, 6, 8)),
+    Benchmark("nesting", lambda: _nested().parse, lambda size: "[" * size + "]" * size, (10, 25, 50)),
+    Benchmark(
+        "nesting_iterative",
+        lambda: _nested().iterative().parse,
+        lambda size: "[" * size + "]" * size,
+        (50, 1000, 10000),
+    ),
+    Benchmark("mark", _marks, _words, (100, 1000, 10000)),
+]
+
+
+def _percentile(times: list[float], percent: int) -> float:
+    # Nearest rank, of sorted times
+    return times[max(0, -(-len(times) * percent // 100) - 1)]
+
+
+def measure(benchmark: Benchmark, size: int, min_time: float, max_repeats: int = 1000) -> Measurement:
+    """
+    Builds the grammar of ``benchmark`` and parses its input for ``size``
+    repeatedly, for at least ``min_time`` seconds and at most ``max_repeats``
+    times.
+    """
+    build_times = []
+    for _ in range(3):
+        start = perf_counter()
+        parse = benchmark.build()
+        build_times.append(perf_counter() - start)
+    data = benchmark.make_input(size)
+
+    parse(data)
+    times = []
+    total = 0.0
+    while not times or (total < min_time and len(times) < max_repeats):
+        start = perf_counter()
+        parse(data)
+        elapsed = perf_counter() - start
+        times.append(elapsed)
+        total += elapsed
+    times.sort()
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        parse(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    p50 = _percentile(times, 50)
+    return Measurement(
+        items=len(data),
+        build_ms=min(build_times) * 1000,
+        p50_ms=p50 * 1000,
+        p90_ms=_percentile(times, 90) * 1000,
+        p99_ms=_percentile(times, 99) * 1000,
+        items_per_second=len(data) / p50 if p50 else 0.0,
+        peak_kib=peak / 1024,
+        repeats=len(times),
+    )
+
+
+def measure_threads(benchmark: Benchmark, size: int, threads: int, min_time: float) -> Scaling:
+    """
+    Parses the input of ``benchmark`` for ``size`` repeatedly on one thread,
+    then as many times on each of ``threads`` threads at once, sharing the
+    grammar, and compares the throughputs.
+    """
+    parse = benchmark.build()
+    grammar = getattr(parse, "__self__", None)
+    if isinstance(grammar, Parser):
+        grammar.freeze()
+    data = benchmark.make_input(size)
+    start = perf_counter()
+    parse(data)
+    repeats = max(1, int(min_time / max(perf_counter() - start, 1e-9)))
+
+    def work(barrier: threading.Barrier):
+        barrier.wait()
+        for _ in range(repeats):
+            parse(data)
+
+    def timed(count: int) -> float:
+        barrier = threading.Barrier(count + 1)
+        with ThreadPoolExecutor(count) as executor:
+            futures = [executor.submit(work, barrier) for _ in range(count)]
+            barrier.wait()
+            start = perf_counter()
+            for future in futures:
+                future.result()
+            return perf_counter() - start
+
+    alone = timed(1)
+    together = timed(threads)
+    items = len(data) * repeats
+    return Scaling(threads, items / alone, items * threads / together, alone * threads / together)
+
+
+def run(names: list[str] = (), quick: bool = False, min_time: float = 0.5, log=None) -> dict[str, Measurement]:
+    """
+    Runs the benchmarks with a name containing one of ``names``, or all of
+    them, and returns the measurements by benchmark name and size, like
+    ``"json[100]"``. With ``quick``, only the smallest size is parsed, once.
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names and not any(name in benchmark.name for name in names):
+            continue
+        for size in benchmark.sizes[:1] if quick else benchmark.sizes:
+            try:
+                results[f"{benchmark.name}[{size}]"] = measure(benchmark, size, 0.0 if quick else min_time)
+            except ImportError as e:
+                if log is not None:
+                    print(f"skipped {benchmark.name}: {e}", file=log)
+                break
+    return results
+
+
+def run_threads(names: list[str], threads: int, quick: bool = False, min_time: float = 0.5) -> dict[str, Scaling]:
+    """
+    Measures the scaling of the benchmarks with a name containing one of
+    ``names``, or all of them, for their largest input, or their smallest
+    with ``quick``.
+    """
+    results = {}
+    for benchmark in BENCHMARKS:
+        if names and not any(name in benchmark.name for name in names):
+            continue
+        size = benchmark.sizes[0] if quick else benchmark.sizes[-1]
+        try:
+            results[f"{benchmark.name}[{size}]"] = measure_threads(
+                benchmark, size, threads, 0.0 if quick else min_time
+            )
+        except ImportError:
+            # Reported by run
+            pass
+    return results
+
+
+def report(results: dict[str, Measurement]) -> str:
+    rows = [("benchmark", "items", "build ms", "p50 ms", "p90 ms", "p99 ms", "items/s", "peak KiB")]
+    for key, m in results.items():
+        rows.append(
+            (
+                key,
+                str(m.items),
+                f"{m.build_ms:.3f}",
+                f"{m.p50_ms:.3f}",
+                f"{m.p90_ms:.3f}",
+                f"{m.p99_ms:.3f}",
+                f"{m.items_per_second:,.0f}",
+                f"{m.peak_kib:,.1f}",
+            )
+        )
+    return format_table(rows)
+
+
+def report_threads(results: dict[str, Scaling]) -> str:
+    gil = getattr(sys, "_is_gil_enabled", lambda: True)()
+    rows = [("benchmark", "threads", "1 thread items/s", "all threads items/s", "speedup")]
+    for key, s in results.items():
+        rows.append(
+            (
+                key,
+                str(s.threads),
+                f"{s.items_per_second:,.0f}",
+                f"{s.threaded_items_per_second:,.0f}",
+                f"{s.speedup:.2f}x",
+            )
+        )
+    return f"GIL enabled: {'yes' if gil else 'no'}\n" + format_table(rows)
+
+
+def _change(new: float, old: float) -> str:
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+
+def compare(results: dict[str, Measurement], baseline: dict[str, dict]) -> str:
+    """
+    Returns a table of the changes from ``baseline``, as loaded from the
+    output of ``--json``, for the benchmarks found in both.
+    """
+    rows = [("benchmark", "p50 ms", "baseline", "change", "items/s", "peak KiB", "build ms")]
+    for key, m in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        rows.append(
+            (
+                key,
+                f"{m.p50_ms:.3f}",
+                f"{old['p50_ms']:.3f}",
+                _change(m.p50_ms, old["p50_ms"]),
+                _change(m.items_per_second, old["items_per_second"]),
+                _change(m.peak_kib, old["peak_kib"]),
+                _change(m.build_ms, old["build_ms"]),
+            )
+        )
+    return format_table(rows)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m parsy.bench", description="Run the parsy benchmarks.")
+    parser.add_argument("names", nargs="*", help="only run the benchmarks with a name containing one of these")
+    parser.add_argument("--quick", action="store_true", help="parse the smallest input of each benchmark once")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to spend parsing each input")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="show the changes from results written with --json")
+    parser.add_argument("--threads", type=int, metavar="N", help="also parse the largest inputs on N threads at once")
+    args = parser.parse_args(argv)
+
+    results = run(args.names, args.quick, args.min_time, log=sys.stderr)
+    print(report(results), end="")
+    scaling = {}
+    if args.threads:
+        scaling = run_threads(args.names, args.threads, args.quick, args.min_time)
+        print()
+        print(report_threads(scaling), end="")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(
+                {
+                    "parsy": __version__,
+                    "python": platform.python_version(),
+                    "results": {key: asdict(m) for key, m in results.items()},
+                    "scaling": {key: asdict(s) for key, s in scaling.items()},
+                },
+                f,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        print()
+        print(compare(results, baseline), end="")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,693 @@
+"""
+Generates Python source for the first phase of parsing.
+
+``compile_parser`` walks the grammar of a parser and writes a function for
+each rule, with the sequences, repetitions and alternatives of the combinators
+written out as straight-line code, and literals, regular expressions and the
+regular parts of the grammar (see ``_regular``) matched in place. The
+functions become the ``fast_fn`` of a new parser. Failures are still reported
+by running the original combinators again, so error messages are the same.
+
+Parsers that are only known while parsing, like the ones produced by
+``generate`` functions, and parsers that aren't built in, are called as they
+are.
+
+``python -m parsy.codegen module:attribute --emit path.py`` writes the source
+to a module, which can be imported instead of generating it at runtime.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import keyword
+import linecache
+import math
+import operator
+import re
+import sys
+from collections import Counter
+
+import parsy
+from parsy import Parser, _alternatives, _left, _right
+from parsy._first import first_set
+from parsy._regular import compile_parser as compile_regular
+
+# Kinds of parser that are written out in the code of their parent
+_COMPOUND = frozenset(
+    ["seq", "alt", "times", "map", "combine", "combine_dict", "concat", "desc", "named", "peek", "bind"]
+)
+
+_IMPORTS = """\
+from parsy import (
+    _NO_EXPECTED,
+    _NO_MATCH,
+    Parser,
+    Result,
+    _combine_dict_kwargs,
+    _memo_call,
+    _parse_state,
+    forward_declaration,
+    line_info_at,
+)
+"""
+
+
+def compile_parser(parser: Parser) -> Parser:
+    """
+    Returns a parser that produces the same results and errors as ``parser``,
+    using generated code for the first phase of parsing.
+    """
+    generator = _Generator(parser)
+    source = generator.source()
+    filename = f"<parsy.codegen {generator.root_name}>"
+    # Lets tracebacks show the generated code
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {name: value for name, (value, _) in generator.constants.items()}
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["parser"]
+
+
+def generate_source(parser: Parser, module: str, attribute: str) -> str:
+    """
+    Returns the source of a module that defines ``parser`` as the compiled
+    version of the parser found at ``attribute`` of ``module``.
+    """
+    return _Generator(parser).source(module, attribute)
+
+
+def _walk(root: Parser) -> tuple[list[Parser], dict[int, tuple]]:
+    """
+    Returns the parsers that make up ``root``, breadth first, and the path of
+    child indices from ``root`` to each of them.
+    """
+    nodes = [root]
+    paths = {id(root): ()}
+    for node in nodes:
+        for i, child in enumerate(node._children):
+            if id(child) not in paths:
+                paths[id(child)] = paths[id(node)] + (i,)
+                nodes.append(child)
+    return nodes, paths
+
+
+def _is_literal(value) -> bool:
+    if value.__class__ is tuple:
+        return all(_is_literal(item) for item in value)
+    if value.__class__ is float:
+        return math.isfinite(value)
+    return value.__class__ in (str, bytes, int, bool, type(None))
+
+
+def _fingerprint(nodes: list[Parser]) -> str:
+    """
+    Identifies the structure of a grammar, and the versions the code generated
+    for it depends on.
+    """
+    digest = hashlib.sha256(repr((parsy.__version__, sys.version_info[:2])).encode())
+    for node in nodes:
+        params = sorted((key, _param_fingerprint(value)) for key, value in node._params.items())
+        if node._kind == "string" and node._params["transform"] is not parsy.noop:
+            # Written into the code when it is a literal
+            transformed = node._params["transform"](node._params["expected_string"])
+            params.append(("transformed", _param_fingerprint(transformed)))
+        digest.update(repr((node._kind, node._regular, len(node._children), params)).encode())
+    return digest.hexdigest()[:16]
+
+
+def _param_fingerprint(value):
+    """
+    Returns what the code generated for a parser depends on in one of its
+    params, such as the pattern of a regex, from which FIRST sets are worked
+    out, or whether a function is one the code treats specially.
+    """
+    if _is_literal(value) or value.__class__ is float:
+        return repr(value)
+    if value.__class__ is re.Pattern:
+        return ("re", value.pattern, value.flags)
+    if value.__class__ is frozenset:
+        return ("frozenset", sorted(_param_fingerprint(item) for item in value))
+    if value is parsy.noop or value is _left or value is _right:
+        return ("fn", value.__name__)
+    if callable(value):
+        return "fn"
+    return None
+
+
+def _stream_type(nodes: list[Parser]) -> type | None:
+    """
+    Returns the type of stream the literals in the grammar can match, or None
+    if they are of different types.
+    """
+    found = set()
+    for node in nodes:
+        kind = node._kind
+        params = node._params
+        if kind == "string":
+            found.add(type(params["expected_string"]))
+        elif kind == "regex":
+            found.add(type(params["exp"].pattern))
+        elif kind == "char_from":
+            found.add(type(params["characters"]))
+        elif kind in ("string_from", "from_enum"):
+            found.update(type(s) for s in params["strings"])
+    if len(found) > 1:
+        return None
+    return found.pop() if found else str
+
+
+def _resolve(node: Parser, accessor):
+    """
+    Returns the constant the generated code uses for ``node``.
+    """
+    if accessor == "node":
+        return node
+    if accessor == "fast_fn":
+        return node.fast_fn
+    if accessor == "wrapped_fn":
+        return node.wrapped_fn
+    if accessor == "match":
+        return node._params["exp"].match
+    if accessor == "regular":
+        return compile_regular(node)[1:]
+    if accessor == "transformed":
+        return node._params["transform"](node._params["expected_string"])
+    return node._params[accessor[1]]
+
+
+def _load_constants(module: str, attribute: str, fingerprint: str, specs: dict) -> dict:
+    """
+    Finds the constants used by a generated module in the grammar it was
+    generated from.
+    """
+    root = _import(module, attribute)
+    nodes, _ = _walk(root)
+    if _fingerprint(nodes) != fingerprint:
+        raise ValueError(
+            f"{module}:{attribute} has changed since it was compiled, or a different version of parsy or Python is "
+            "used. Run python -m parsy.codegen again."
+        )
+    constants = {}
+    for name, (path, accessor) in specs.items():
+        node = root
+        for i in path:
+            node = node._children[i]
+        constants[name] = _resolve(node, accessor)
+    return constants
+
+
+def _import(module: str, attribute: str):
+    value = importlib.import_module(module)
+    for name in attribute.split("."):
+        value = getattr(value, name)
+    return value
+
+
+def _negate(test: str) -> str:
+    if test.endswith(" is not None"):
+        return test[: -len(" is not None")] + " is None"
+    if " and " in test:
+        return f"not ({test})"
+    return f"not {test}"
+
+
+class _Function:
+    """
+    The source of a generated function, which takes a stream and an index and
+    returns a Result.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lines = []
+        self.indent = 1
+        self.count = 0
+
+    def temp(self, prefix: str) -> str:
+        self.count += 1
+        return f"{prefix}{self.count}"
+
+    def emit(self, line: str):
+        self.lines.append("    " * self.indent + line)
+
+    def source(self) -> str:
+        return f"def {self.name}(stream, index):\n" + "\n".join(self.lines) + "\n"
+
+
+class _Generator:
+    def __init__(self, root: Parser):
+        self.root = root
+        nodes, self.paths = _walk(root)
+        self.fingerprint = _fingerprint(nodes)
+        self.stream_type = _stream_type(nodes)
+        self.parents = Counter(id(child) for node in nodes for child in node._children)
+        self.count = 0
+        # Maps names to (value, (path, accessor)) for values that can't be
+        # written in the source.
+        self.constants = {}
+        self.constant_names = {}
+        # Module level statements, before and after the functions
+        self.definitions = []
+        self.functions = []
+        self.finish = []
+        # Maps id(node) to the name of the function that runs it
+        self.function_names = {}
+        self.pending = []
+        self.regular_names = {}
+
+        self.root_name = self.new_name("root")
+        wrapped = self.constant(root, "wrapped_fn", "w")
+        original = self.constant(root, "fast_fn", "o")
+        if self.stream_type is None:
+            self.finish.append(f"parser = Parser({wrapped}, {original})")
+            return
+        entry = self.function(root)
+        while self.pending:
+            self.write_function(*self.pending.pop(0))
+        self.functions.append(
+            f"def {self.root_name}(stream, index):\n"
+            f"    if stream.__class__ is {self.stream_type.__name__}:\n"
+            f"        return {entry}(stream, index)\n"
+            f"    return {original}(stream, index)\n"
+        )
+        self.finish.append(f"parser = Parser({wrapped}, {self.root_name})")
+
+    def source(self, module: str | None = None, attribute: str | None = None) -> str:
+        parts = []
+        if module is not None:
+            specs = "".join(f"        {name!r}: {spec!r},\n" for name, (_, spec) in self.constants.items())
+            parts.append(
+                f'"""\nGenerated by python -m parsy.codegen from {module}:{attribute}\n"""\n\n'
+                + _IMPORTS
+                + "from parsy.codegen import _load_constants\n\n"
+                + f"_constants = _load_constants(\n    {module!r},\n    {attribute!r},\n    {self.fingerprint!r},\n"
+                + f"    {{\n{specs}    }},\n)\n"
+                + "".join(f"{name} = _constants[{name!r}]\n" for name in self.constants)
+            )
+        else:
+            parts.append(_IMPORTS)
+        if self.definitions:
+            parts.append("\n".join(self.definitions) + "\n")
+        parts.extend(self.functions)
+        parts.append("\n".join(self.finish) + "\n")
+        return "\n\n".join(parts)
+
+    def new_name(self, prefix: str) -> str:
+        self.count += 1
+        return f"_{prefix}{self.count}"
+
+    def constant(self, node: Parser, accessor, prefix: str) -> str:
+        key = (id(node), accessor)
+        name = self.constant_names.get(key)
+        if name is None:
+            name = self.constant_names[key] = self.new_name(prefix)
+            self.constants[name] = (_resolve(node, accessor), (self.paths[id(node)], accessor))
+        return name
+
+    def param(self, node: Parser, key: str) -> str:
+        value = node._params[key]
+        if _is_literal(value):
+            return repr(value)
+        return self.constant(node, ("param", key), "c")
+
+    # Functions
+
+    def function(self, node: Parser) -> str:
+        """
+        Returns the name of a function that runs ``node``.
+        """
+        name = self.function_names.get(id(node))
+        if name is not None:
+            return name
+        kind = node._kind
+        if kind == "forward_declaration" and node._parser is not None:
+            # A new forward declaration keeps track of left recursion and
+            # packrat parsing for the generated code.
+            declaration = self.new_name("d")
+            name = self.function_names[id(node)] = declaration + "_fast"
+            self.definitions.append(f"{declaration} = forward_declaration()")
+            self.definitions.append(f"{name} = {declaration}.fast_fn")
+            target = node._parser
+            self.finish.insert(
+                0,
+                f"{declaration}.become(Parser({self.constant(target, 'wrapped_fn', 'w')}, {self.function(target)}))",
+            )
+        elif kind in _COMPOUND or kind == "memoize" or self.primitive(None, node) is not None:
+            name = self.function_names[id(node)] = self.new_name("f")
+            self.pending.append((node, name))
+        else:
+            name = self.function_names[id(node)] = self.constant(node, "fast_fn", "o")
+        return name
+
+    def write_function(self, node: Parser, name: str):
+        f = _Function(name)
+        if node._kind == "memoize":
+            inner = self.function(node._children[0])
+            f.emit("state = _parse_state.get()")
+            f.emit("if state is None or state.stream is not stream:")
+            f.emit(f"    return {inner}(stream, index)")
+            f.emit(f"return _memo_call(state, {self.constant(node, 'node', 'n')}, {inner}, stream, index)")
+        else:
+            self.statement(f, node, "value", True, inline=True)
+            f.emit("return Result(True, index, value, -1, _NO_EXPECTED)")
+        self.functions.append(f.source())
+
+    # Expressions
+
+    def expression(self, f: _Function, node: Parser) -> tuple[str, str, str, bool]:
+        """
+        Returns Python expressions for whether ``node`` matches at ``index``,
+        and if it does, the value it produces and the index after it, and
+        whether the test is expensive. The test may assign variables used by
+        the other expressions.
+        """
+        primitive = self.primitive(f, node)
+        if primitive is not None:
+            return primitive
+        result = f.temp("r")
+        return f"({result} := {self.function(node)}(stream, index)).status", f"{result}.value", f"{result}.index", True
+
+    def regular(self, node: Parser) -> tuple[str, str] | None:
+        """
+        Returns the names of the match and build functions of a regular parser
+        (see ``_regular``).
+        """
+        if id(node) not in self.regular_names:
+            names = None
+            compiled = compile_regular(node)
+            if compiled is not None and compiled[0] is self.stream_type:
+                constant = self.constant(node, "regular", "r")
+                names = (constant + "_match", constant + "_build")
+                self.definitions.append(f"{names[0]}, {names[1]} = {constant}")
+            self.regular_names[id(node)] = names
+        return self.regular_names[id(node)]
+
+    def primitive(self, f: _Function | None, node: Parser) -> tuple[str, str, str, bool] | None:
+        """
+        Like ``expression``, for parsers that don't need a function of their
+        own. With ``f`` set to None, only checks whether there is one.
+        """
+        kind = node._kind
+        params = node._params
+        if node._regular and (kind in _COMPOUND or kind in ("string_from", "from_enum")):
+            names = self.regular(node)
+            if names is None or f is None:
+                return names
+            match = f.temp("m")
+            return (
+                f"({match} := {names[0]}(stream, index)) is not None",
+                f"{names[1]}({match}, stream)",
+                f"{match}.end()",
+                True,
+            )
+        if kind not in _PRIMITIVES:
+            return None
+        if f is None:
+            return ()
+        return getattr(self, "primitive_" + kind)(f, node, params)
+
+    def primitive_string(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        value = self.param(node, "expected_string")
+        end = f"index + {len(params['expected_string'])}"
+        if params["transform"] is parsy.noop:
+            return f"stream.startswith({value}, index)", value, end, False
+        transformed = params["transform"](params["expected_string"])
+        if _is_literal(transformed):
+            transformed = repr(transformed)
+        else:
+            transformed = self.constant(node, "transformed", "c")
+        transform = self.param(node, "transform")
+        return f"{transform}(stream[index : {end}]) == {transformed}", value, end, False
+
+    def primitive_regex(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        match = f.temp("m")
+        group = params["group"]
+        if group == (0,):
+            value = f"{match}.group()"
+        elif len(group) == 1:
+            value = f"{match}.group({group[0]!r})"
+        else:
+            value = f"{match}.group(*{group!r})"
+        match_fn = self.constant(node, "match", "x")
+        return f"({match} := {match_fn}(stream, index)) is not None", value, f"{match}.end()", True
+
+    def primitive_char_from(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        item = f.temp("c")
+        characters = self.param(node, "characters")
+        return f"({item} := stream[index : index + 1]) and {item} in {characters}", item, "index + 1", False
+
+    def primitive_any_char(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        item = f.temp("c")
+        return f"({item} := stream[index : index + 1])", item, "index + 1", False
+
+    def primitive_test_item(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        item = f.temp("c")
+        return (
+            f"({item} := stream[index : index + 1]) and {self.param(node, 'func')}({item})",
+            item,
+            "index + 1",
+            False,
+        )
+
+    def primitive_eof(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        return "index >= len(stream)", "None", "index", False
+
+    def primitive_success(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        return "True", self.param(node, "value"), "index", False
+
+    def primitive_fail(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        return "False", "None", "index", False
+
+    def primitive_index(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        return "True", "index", "index", False
+
+    def primitive_line_info(self, f: _Function, node: Parser, params: dict) -> tuple[str, str, str, bool]:
+        return "True", "line_info_at(stream, index)", "index", False
+
+    # Statements
+
+    def can_inline(self, node: Parser) -> bool:
+        return node._kind in _COMPOUND and self.primitive(None, node) is None and self.parents[id(node)] == 1
+
+    def statement(self, f: _Function, node: Parser, target: str, want: bool, inline: bool = False):
+        """
+        Writes code that runs ``node`` at ``index``, returning a failure if it
+        fails, and otherwise moving ``index`` past it and assigning its value
+        to ``target`` if ``want`` is True.
+        """
+        if node._kind in _COMPOUND and self.primitive(None, node) is None and (inline or self.parents[id(node)] == 1):
+            getattr(self, "inline_" + node._kind)(f, node, target, want)
+            return
+        test, value, end, _ = self.expression(f, node)
+        if test != "True":
+            f.emit(f"if {_negate(test)}:")
+            f.emit("    return _NO_MATCH")
+        self.advance(f, target if want else None, value, end)
+
+    def advance(self, f: _Function, target: str | None, value: str, end: str):
+        if target is not None:
+            f.emit(f"{target} = {value}")
+        if end != "index":
+            f.emit(f"index = {end}")
+
+    def values(self, f: _Function, children: tuple, wants: list) -> list[str]:
+        names = []
+        for child, want in zip(children, wants):
+            name = want if isinstance(want, str) else f.temp("v")
+            self.statement(f, child, name, bool(want))
+            names.append(name)
+        return names
+
+    def inline_seq(self, f: _Function, node: Parser, target: str, want: bool):
+        children = node._children
+        values = self.values(f, children, [want] * len(children))
+        if not want:
+            return
+        names = node._params["names"]
+        if names is None:
+            f.emit(f"{target} = [{', '.join(values)}]")
+        else:
+            items = ", ".join(f"{name!r}: {value}" for name, value in zip(names, values))
+            f.emit(f"{target} = {{{items}}}")
+
+    def inline_map(self, f: _Function, node: Parser, target: str, want: bool):
+        value = f.temp("v")
+        self.statement(f, node._children[0], value, True)
+        self.call(f, target if want else None, f"{self.param(node, 'fn')}({value})")
+
+    def call(self, f: _Function, target: str | None, expression: str):
+        # Functions are called even if their value isn't used, for any
+        # exceptions they raise.
+        f.emit(expression if target is None else f"{target} = {expression}")
+
+    def inline_combine(self, f: _Function, node: Parser, target: str, want: bool):
+        fn = node._params["fn"]
+        (child,) = node._children
+        if not (self.can_inline(child) and child._kind == "seq" and child._params["names"] is None):
+            value = f.temp("v")
+            self.statement(f, child, value, True)
+            self.call(f, target if want else None, f"{self.param(node, 'fn')}(*{value})")
+            return
+
+        # The arguments are passed straight from the sequence.
+        children = child._children
+        if fn in (_left, _right) and len(children) == 2:
+            # The selected value goes straight to the target.
+            selected = 0 if fn is _left else 1
+            self.values(f, children, [want and i == selected and target for i in range(2)])
+            return
+        values = self.values(f, children, [True] * len(children))
+        if fn is operator.add and len(children) == 2:
+            expression = f"{values[0]} + {values[1]}"
+        else:
+            expression = f"{self.param(node, 'fn')}({', '.join(values)})"
+        self.call(f, target if want else None, expression)
+
+    def inline_combine_dict(self, f: _Function, node: Parser, target: str, want: bool):
+        fn = self.param(node, "fn")
+        (child,) = node._children
+        if self.can_inline(child) and child._kind == "seq" and child._params["names"] is not None:
+            values = self.values(f, child._children, [True] * len(child._children))
+            arguments = []
+            for name, value in zip(child._params["names"], values):
+                if name.startswith("_"):
+                    continue
+                if name.isidentifier() and not keyword.iskeyword(name):
+                    arguments.append(f"{name}={value}")
+                else:
+                    arguments.append(f"**{{{name!r}: {value}}}")
+            expression = f"{fn}({', '.join(arguments)})"
+        else:
+            value = f.temp("v")
+            self.statement(f, child, value, True)
+            expression = f"{fn}(**_combine_dict_kwargs({value}))"
+        self.call(f, target if want else None, expression)
+
+    def inline_concat(self, f: _Function, node: Parser, target: str, want: bool):
+        value = f.temp("v")
+        self.statement(f, node._children[0], value, True)
+        self.call(f, target if want else None, f'"".join({value})')
+
+    def inline_desc(self, f: _Function, node: Parser, target: str, want: bool):
+        self.statement(f, node._children[0], target, want)
+
+    inline_named = inline_desc
+
+    def inline_peek(self, f: _Function, node: Parser, target: str, want: bool):
+        start = f.temp("i")
+        f.emit(f"{start} = index")
+        self.statement(f, node._children[0], target, want)
+        f.emit(f"index = {start}")
+
+    def inline_bind(self, f: _Function, node: Parser, target: str, want: bool):
+        value = f.temp("v")
+        self.statement(f, node._children[0], value, True)
+        result = f.temp("r")
+        f.emit(f"{result} = {self.param(node, 'fn')}({value}).fast_fn(stream, index)")
+        f.emit(f"if not {result}.status:")
+        f.emit("    return _NO_MATCH")
+        self.advance(f, target if want else None, f"{result}.value", f"{result}.index")
+
+    def inline_times(self, f: _Function, node: Parser, target: str, want: bool):
+        min, max = node._params["min"], node._params["max"]
+        test, value, end, _ = self.expression(f, node._children[0])
+        if max == 1:
+            f.emit(f"if {test}:")
+            f.indent += 1
+            self.advance(f, target if want else None, f"[{value}]", end)
+            if not want and end == "index":
+                f.emit("pass")
+            f.indent -= 1
+            if min >= 1:
+                f.emit("else:")
+                f.emit("    return _NO_MATCH")
+            elif want:
+                f.emit("else:")
+                f.emit(f"    {target} = []")
+            return
+        bounded = max != float("inf")
+        count = f.temp("n") if bounded or min > 0 else None
+        if want:
+            f.emit(f"{target} = []")
+        if count is not None:
+            f.emit(f"{count} = 0")
+        f.emit(f"while {count} < {max!r}:" if bounded else "while True:")
+        f.indent += 1
+        f.emit(f"if {_negate(test)}:")
+        if min > 0:
+            f.emit(f"    if {count} < {min!r}:")
+            f.emit("        return _NO_MATCH")
+        f.emit("    break")
+        if want:
+            f.emit(f"{target}.append({value})")
+        if end != "index":
+            f.emit(f"index = {end}")
+        if count is not None:
+            f.emit(f"{count} += 1")
+        f.indent -= 1
+
+    def inline_alt(self, f: _Function, node: Parser, target: str, want: bool):
+        alternatives = _alternatives(node)
+        if not alternatives:
+            f.emit("return _NO_MATCH")
+            return
+        branches = []
+        item = None
+        for alternative in alternatives:
+            test, value, end, expensive = self.expression(f, alternative)
+            first = first_set(alternative) if expensive else None
+            if first is not None:
+                # Skip alternatives that can't start with the next item.
+                if item is None:
+                    item = f.temp("c")
+                    f.emit(f"{item} = stream[index : index + 1]")
+                if self.stream_type is bytes:
+                    first = frozenset(bytes([code]) for code in first)
+                first_name = self.new_name("s")
+                self.definitions.append(f"{first_name} = frozenset({sorted(first)!r})")
+                test = f"{item} in {first_name} and {test}"
+            branches.append((test, value, end))
+        for i, (test, value, end) in enumerate(branches):
+            if test == "True":
+                # Always matches, so the alternatives after it are never tried.
+                f.emit("else:" if i else "if True:")
+            else:
+                f.emit(f"{'elif' if i else 'if'} {test}:")
+            f.indent += 1
+            if want or end != "index":
+                self.advance(f, target if want else None, value, end)
+            else:
+                f.emit("pass")
+            f.indent -= 1
+            if test == "True":
+                return
+        f.emit("else:")
+        f.emit("    return _NO_MATCH")
+
+
+_PRIMITIVES = frozenset(
+    ["string", "regex", "char_from", "any_char", "test_item", "eof", "success", "fail", "index", "line_info"]
+)
+
+
+def main(argv: list[str] | None = None):
+    arg_parser = argparse.ArgumentParser(
+        prog="python -m parsy.codegen", description="Generates the Python source of a compiled parser."
+    )
+    arg_parser.add_argument("parser", help="the parser to compile, as module:attribute")
+    arg_parser.add_argument("--emit", metavar="PATH", help="write the source to PATH, instead of standard output")
+    args = arg_parser.parse_args(argv)
+    module, _, attribute = args.parser.partition(":")
+    if not module or not attribute:
+        arg_parser.error("the parser must be given as module:attribute")
+    source = generate_source(_import(module, attribute), module, attribute)
+    if args.emit:
+        with open(args.emit, "w", encoding="utf-8") as f:
+            f.write(source)
+    else:
+        sys.stdout.write(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,104 @@
 # -*- code: utf8 -*-
+import asyncio
+import contextlib
 import enum
+import importlib
+import io
+import itertools
+import json
+import mmap
+import operator
+import os
+import pickle
 import re
+import sys
+import tempfile
+import threading
 import unittest
+import unittest.mock
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from functools import partial
 
 from parsy import (
     ParseError,
+    Parser,
+    Result,
+    Span,
+    Token,
+    TokenStream,
+    _first,
+    _regular,
     alt,
     any_char,
+    bench,
     char_from,
+    codegen,
+)
+from parsy import compile as parsy_compile  # to not shadow the builtin
+from parsy import (
     decimal_digit,
     digit,
+    eof,
+    fail,
     forward_declaration,
     from_enum,
     generate,
     index,
     letter,
+    lexer,
     line_info,
     line_info_at,
     match_item,
+    noop,
     peek,
+    profile,
     regex,
+    scan_until,
     seq,
     string,
     string_from,
+    success,
 )
 from parsy import test_char as parsy_test_char  # to stop pytest thinking this function is a test
 from parsy import test_item as parsy_test_item  # to stop pytest thinking this function is a test
-from parsy import whitespace
+from parsy import token, token_from, whitespace
+
+
+def outcome(parse, text, **kwargs):
+    """
+    Returns ``("ok", value)`` or ``("error", message)`` for parsing ``text``
+    with the function ``parse``.
+    """
+    try:
+        return ("ok", parse(text, **kwargs))
+    except ParseError as err:
+        return ("error", str(err))
+
+
+def parse_async(parser, text, **kwargs):
+    return asyncio.run(parser.parse_async(text, **kwargs))
+
+
+class SameResultsMixin:
+    """
+    For the tests of another way of running a grammar, given by ``engine``,
+    which returns the function that parses with it for a parser.
+    """
+
+    engine = None
+
+    def assert_same_results(self, parser, texts, reference=None, **kwargs):
+        """
+        Checks that ``parser`` gives the same results and error messages when
+        run by ``engine`` as ``reference``, by default ``parser``, does with
+        ``Parser.parse``.
+        """
+        parse = self.engine(parser)
+        reference = parser if reference is None else reference
+        for text in texts:
+            self.assertEqual(outcome(parse, text, **kwargs), outcome(reference.parse, text, **kwargs))
 
 
 class TestParser(unittest.TestCase):
@@ -38,6 +108,95 @@ class TestParser(unittest.TestCase):
 
         self.assertRaises(ParseError, parser.parse, "y")
 
+    def test_string_other_stream_types(self):
+        self.assertRaises(ParseError, string("x").parse, b"x")
+        self.assertRaises(ParseError, string("x").parse, ["x"])
+        self.assertEqual(string(b"x").parse(b"x"), b"x")
+
+    def test_parse_prefix(self):
+        parser = regex("[a-z]+")
+        self.assertEqual(parser.parse_prefix("hello world"), ("hello", 5))
+        self.assertEqual(parser.parse_prefix("hello world", 6), ("world", 11))
+        self.assertEqual(parser.parse_prefix("hello world", 6, 9), ("wor", 9))
+        self.assertEqual(regex(b"[a-z]+$").parse_prefix(b"hello world", 0, 3), (b"hel", 3))
+        self.assertEqual(letter.many().concat().parse_prefix(["a", "b", "c"], 1, 2), ("b", 2))
+        with self.assertRaises(ParseError) as err:
+            (parser << eof).parse_prefix("hello world", 0, 6)
+        self.assertEqual(str(err.exception), "expected 'EOF' at 0:5")
+
+    def test_parse_prefix_end(self):
+        @Parser
+        def rest_length(stream, index):
+            return Result.success(len(stream), len(stream) - index)
+
+        word = regex("[a-z]+")
+        comment = string("/*") >> scan_until("*/") << string("*/")
+        parser = seq(
+            word.sep_by(char_from(" ,")),
+            comment.optional(),
+            string_from("!", "!!").optional(),
+            (any_char.until(string("x")).concat() << string("x")).optional(),
+            eof.result("end").optional(),
+            rest_length,
+        )
+        text = "ab cd,ef /* c */!!zyx tail"
+        for start in range(len(text)):
+            for end in range(start, len(text) + 1):
+                self.assertEqual(
+                    outcome(partial(parser.parse_prefix, start=start, end=end), text),
+                    outcome(partial(parser.parse_prefix, start=start), text[:end]),
+                )
+
+        # Parsers made with Parser get bytes rather than a memoryview.
+        @Parser
+        def pair(stream, index):
+            text = stream[index : index + 2].decode()
+            if not text:
+                return Result.failure(index, "pair")
+            return Result.success(index + len(text), text)
+
+        data = b"ab cd,ef /* c */!!zyx tail"
+        self.assertEqual(pair.many().parse_prefix(b"abcd", end=3), (["ab", "c"], 3))
+        self.assertEqual(
+            seq(regex(b"[a-z]+"), string(b" ") >> scan_until(b"/*"), pair).parse_prefix(data, end=12),
+            ([b"ab", b"cd,ef ", "/*"], 11),
+        )
+        for end in range(len(data) + 1):
+            self.assertEqual(pair.many().parse_prefix(data, 3, end), pair.many().parse_prefix(data[:end], 3))
+
+        tokens = lexer([("NAME", "[a-z]+")], skip=[" "])
+        self.assertEqual(list(tokens.parse_prefix("ab cd ef", 0, 4)[0]), [Token("NAME", "ab"), Token("NAME", "c")])
+
+        # Only the items a primitive looks at past the end are copied
+        copied = []
+
+        class Items(list):
+            def __getitem__(self, key):
+                if key.__class__ is slice:
+                    copied.append(key)
+                return super().__getitem__(key)
+
+        items = Items("abcabc")
+        self.assertEqual(match_item("a").many().parse_prefix(items, 3, 4), (["a"], 4))
+        self.assertEqual(copied, [slice(4, 4)])
+
+    def test_buffer_streams(self):
+        parser = seq(string(b"ab"), regex(b"[0-9]+").map(int), char_from(b"xy").many())
+        data = b"ab12xyxzz"
+        mapped = mmap.mmap(-1, len(data))
+        mapped.write(data)
+        for stream in [mapped, memoryview(data), memoryview(bytearray(data))]:
+            self.assertEqual(parser.parse_prefix(stream), ([b"ab", 12, [b"x", b"y", b"x"]], 7))
+            self.assertEqual(parser.parse_prefix(stream, 0, 5), ([b"ab", 12, [b"x"]], 5))
+            self.assertEqual(
+                seq(parser, string_from(b"x", b"zz")).parse(stream), [[b"ab", 12, [b"x", b"y", b"x"]], b"zz"]
+            )
+            value, remainder = parser.parse_partial(stream)
+            self.assertIsInstance(remainder, memoryview)
+            self.assertEqual(remainder, b"zz")
+            del remainder
+        self.assertEqual(any_char.parse_prefix(memoryview(data), 3), (b"2", 4))
+
     def test_string_transform(self):
         parser = string("x", transform=lambda s: s.lower())
         self.assertEqual(parser.parse("x"), "x")
@@ -208,6 +367,28 @@ class TestParser(unittest.TestCase):
         self.assertEqual(letters, ["q", "w", "e", "r"])
         self.assertEqual(end, (1, 4))
 
+    def test_span(self):
+        parser = (letter.many().concat().span() << string("\n")).many()
+        lines = parser.parse("asdf\n\nqwer\n")
+        self.assertEqual([span.value for span in lines], ["asdf", "", "qwer"])
+        self.assertEqual([(span.start, span.end) for span in lines], [(0, 4), (5, 5), (6, 10)])
+        self.assertEqual([span.start_line_info for span in lines], [(0, 0), (1, 0), (2, 0)])
+        self.assertEqual(lines[2].end_line_info, (2, 4))
+        self.assertEqual(lines[0], Span("asdf", 0, 4, None))
+        self.assertEqual(repr(lines[0]), "Span(value='asdf', start=0, end=4)")
+        self.assertEqual(parser.parse_stream(["as", "df\n\nq", "wer\n"], 1), lines)
+        self.assertEqual(parser.parse_stream(["as", "df\n\nq", "wer\n"], 1)[2].start_line_info, (2, 0))
+
+    def test_line_index(self):
+        text = "ab\n\ncd\nef"
+        parser = (line_info << any_char).many()
+        expected = [line_info_at(text, i) for i in range(len(text))]
+        self.assertEqual(parser.parse(text), expected)
+        self.assertEqual(parser.mark().parse(text), ((0, 0), expected, (3, 2)))
+        with self.assertRaises(ParseError) as err:
+            (string("ab\n\nc") >> line_info >> string("x")).parse(text)
+        self.assertEqual(err.exception.line_info(), "2:1")
+
     def test_tag(self):
         parser = letter.many().concat().tag("word")
         self.assertEqual(
@@ -417,6 +598,44 @@ class TestParser(unittest.TestCase):
             until.parse_partial("ssssssx")
         assert cm.exception.args[0] == frozenset({"at most 5 items"})
 
+    def test_until_scanning(self):
+        # any_char.until(...) finds a string or regex in one call, with the
+        # same results as trying it at each index.
+        every_char = parsy_test_char(lambda c: True, "any character")
+        for other in [string("*/"), string(""), regex(r"\*+/"), regex("$"), string(b"*/")]:
+            for fewest, most in [(0, float("inf")), (1, 3), (2, 2), (4, 10)]:
+                for consume_other in [False, True]:
+                    scanning = any_char.until(other, fewest, most, consume_other)
+                    expected = every_char.until(other, fewest, most, consume_other)
+                    for text in ["*/", "a*/", "ab**/c*/", "abc", "a*", "", "abcde*/"]:
+                        if isinstance(other._params.get("expected_string"), bytes):
+                            text = text.encode()
+                        for fn in ["fast_fn", "wrapped_fn"]:
+                            self.assertEqual(getattr(scanning, fn)(text, 0), getattr(expected, fn)(text, 0))
+
+    def test_scan_until(self):
+        comment = string("/*") >> scan_until("*/") << string("*/")
+        self.assertEqual(comment.parse("/* a * b */"), " a * b ")
+        self.assertEqual(comment.parse("/**/"), "")
+        with self.assertRaises(ParseError) as err:
+            comment.parse("/* a")
+        self.assertEqual(str(err.exception), "expected '*/' at 0:4")
+
+        statement = scan_until(re.compile(r"\s*;"))
+        self.assertEqual(statement.parse_partial("a b  ; c"), ("a b", "  ; c"))
+        comment = string(b"/*") >> scan_until(b"*/") << string(b"*/")
+        self.assertEqual(comment.parse(b"/* a */"), b" a ")
+        self.assertEqual(comment.parse_prefix(b"/* a */ b", end=7), (b" a ", 7))
+        self.assertEqual(comment.parse_stream(io.BytesIO(b"/*" + b"a*" * 10 + b"*/"), chunk_size=3), b"a*" * 10)
+
+        # Lists are compared item by item like string() does, which never
+        # matches, like any_char.until(string(...)).
+        items = ["a", "x"]
+        for parser in [scan_until("x"), scan_until(re.compile("x")), any_char.until(string("x"))]:
+            self.assertRaises(ParseError, parser.parse_partial, items)
+            self.assertRaises(ParseError, parser.parse_prefix, items, end=1)
+        self.assertEqual((scan_until("x") | any_char.many()).parse(items), items)
+
     def test_optional(self):
         p = string("a").optional()
         self.assertEqual(p.parse("a"), "a")
@@ -542,6 +761,26 @@ class TestParser(unittest.TestCase):
         self.assertEqual(titles.parse("MR"), "Mr")
         self.assertEqual(titles.parse("MR."), "Mr.")
 
+    def test_string_from_many(self):
+        keywords = ["SELECT", "SEL", "FROM", "WHERE", "S"] + [f"KEYWORD{i}" for i in range(400)]
+        keyword = string_from(*keywords, transform=str.lower)
+        self.assertEqual(keyword.parse("select"), "SELECT")
+        self.assertEqual(keyword.parse("Sel"), "SEL")
+        self.assertEqual(keyword.parse("keyword123"), "KEYWORD123")
+        self.assertEqual(keyword.parse_partial("keyword3990"), ("KEYWORD399", "0"))
+        # Case insensitive regular expressions match more than str.lower does
+        self.assertRaises(ParseError, keyword.parse, "\u017fel")
+        self.assertEqual(keyword.parse("\u212aeyword1"), "KEYWORD1")
+
+        with self.assertRaises(ParseError) as err:
+            (string_from("", "ab", "ac") + string("x")).parse("y")
+        self.assertEqual(str(err.exception), "expected one of 'ab', 'ac', 'x' at 0:0")
+
+    def test_string_from_bytes(self):
+        titles = string_from(b"Mr", b"Mrs")
+        self.assertEqual(titles.parse(b"Mrs"), b"Mrs")
+        self.assertEqual(titles.parse(bytearray(b"Mr")), b"Mr")
+
     def test_peek(self):
         self.assertEqual(peek(any_char).parse_partial("abc"), ("a", "abc"))
         with self.assertRaises(ParseError) as err:
@@ -632,6 +871,1006 @@ class TestParser(unittest.TestCase):
         self.assertEqual(pet.parse("cat"), Pet.CAT)
         self.assertEqual(pet.parse("CAT"), Pet.CAT)
 
+        pet = from_enum(Pet, transform=str.lower)
+        self.assertEqual(pet.parse("dOg"), Pet.DOG)
+        self.assertRaises(ParseError, pet.parse, "cats")
+
+    def test_custom_parser(self):
+        @Parser
+        def two_items(stream, index):
+            if index + 2 <= len(stream):
+                return Result.success(index + 2, stream[index : index + 2])
+            return Result.failure(index, "two items")
+
+        parser = seq(two_items, letter.many().concat(), two_items)
+        self.assertEqual(parser.parse("12abc34"), ["12", "abc", "34"])
+        self.assertEqual(two_items("12", 0), Result.success(2, "12"))
+
+        with self.assertRaises(ParseError) as err:
+            parser.parse("12abc3")
+        self.assertEqual(str(err.exception), "expected one of 'a letter', 'two items' at 0:5")
+
+
+class TestTwoPhaseParsing(unittest.TestCase):
+    def test_error_phase_only_on_failure(self):
+        calls = []
+
+        @Parser
+        def counted(stream, index):
+            calls.append(index)
+            return string("a")(stream, index)
+
+        parser = counted.many().concat() + string("b")
+        self.assertEqual(parser.parse("aab"), "aab")
+        self.assertEqual(calls, [0, 1, 2])
+
+        del calls[:]
+        with self.assertRaises(ParseError) as err:
+            parser.parse("aac")
+        self.assertEqual(str(err.exception), "expected one of 'a', 'b' at 0:2")
+        self.assertEqual(calls, [0, 1, 2, 0, 1, 2])
+
+    def test_fast_fn(self):
+        parser = seq(string("a").many(), string("b").desc("B") | string("c"))
+        for text in ["aab", "ac", "aa", "x", ""]:
+            fast = parser.fast_fn(text, 0)
+            exact = parser.wrapped_fn(text, 0)
+            self.assertEqual((fast.status, fast.index, fast.value), (exact.status, exact.index, exact.value))
+
+        self.assertEqual(parser.fast_fn("aab", 0).expected, frozenset())
+        self.assertEqual(parser.wrapped_fn("aab", 0).expected, frozenset(["a"]))
+
+    def test_derived_combinators(self):
+        # then, skip, +, optional and sep_by run their parsers directly, with
+        # the same results as the combinators they are described as.
+        item = string("a").desc("A") | (string("b") >> string("c"))
+        sep = string(",") | string(";;")
+        cases = [
+            (item >> sep, seq(item, sep).bind(lambda values: success(values[1]))),
+            (item << sep, seq(item, sep).bind(lambda values: success(values[0]))),
+            (item.times(1) + sep.many(), seq(item.times(1), sep.many()).bind(lambda values: success(sum(values, [])))),
+            (item.optional("none"), item.times(0, 1).bind(lambda values: success(values[0] if values else "none"))),
+        ]
+        for fewest, most in [(0, float("inf")), (2, 3), (0, 1), (3, 2)]:
+            items = seq(item.times(1), (sep >> item).times(fewest - 1, most - 1))
+            expected = items.bind(lambda values: success(values[0] + values[1]))
+            if fewest == 0:
+                expected |= success([])
+            cases.append((item.sep_by(sep, min=fewest, max=most), expected))
+        for parser, expected in cases:
+            for text in ["", "a", "a,", "a,bc;;a", "a;;", "a,b", "a,a,a,a", "bc;", "x"]:
+                self.assertEqual(parser.wrapped_fn(text, 0), expected.wrapped_fn(text, 0))
+                fast = parser.fast_fn(text, 0)
+                exact = expected.wrapped_fn(text, 0)
+                self.assertEqual((fast.status, fast.index, fast.value), (exact.status, exact.index, exact.value))
+
+        self.assertEqual(item.sep_by(sep).parse("a,bc"), ["a", "c"])
+        with self.assertRaises(ParseError) as err:
+            (item << sep).parse("a,a")
+        self.assertEqual(str(err.exception), "expected 'EOF' at 0:2")
+
+    def test_transforms_make_no_parsers(self):
+        word = regex("[a-z]") | Parser(lambda stream, index: Result.failure(index, "custom"))
+        parser = seq(
+            word.map(str.upper),
+            seq(word, word).combine(operator.add),
+            seq(a=word, _b=word).combine_dict(dict),
+            word.tag("t"),
+            word.result(1),
+            word.times(2).concat(),
+        )
+        with unittest.mock.patch("parsy.success") as success:
+            self.assertEqual(parser.parse("abcdefghi"), ["A", "bc", {"a": "d"}, ("t", "f"), 1, "hi"])
+        success.assert_not_called()
+
+    def test_custom_parser_fast_fn(self):
+        @Parser
+        def custom(stream, index):
+            return Result.success(index, None)
+
+        self.assertIs(custom.fast_fn, custom.wrapped_fn)
+
+        fast = Parser(custom.wrapped_fn, lambda stream, index: Result.success(index, "fast"))
+        self.assertEqual(fast.parse(""), "fast")
+        self.assertEqual(fast(None, 0).value, None)
+
+
+class TestRegularParsers(unittest.TestCase):
+    def assert_same_as_combinators(self, parser, texts):
+        for text in texts:
+            fast = parser.fast_fn(text, 0)
+            exact = parser.wrapped_fn(text, 0)
+            self.assertEqual((fast.status, fast.index, fast.value), (exact.status, exact.index, exact.value))
+
+    @unittest.skipUnless(_regular.SUPPORTED, "needs atomic groups")
+    def test_compiled(self):
+        string_part = regex(r'[^"\\]+')
+        string_esc = string("\\") >> (
+            string("\\")
+            | string('"')
+            | string("n").result("\n")
+            | regex(r"u[0-9a-fA-F]{4}").map(lambda s: chr(int(s[1:], 16)))
+        )
+        quoted = string('"') >> (string_part | string_esc).many().concat() << string('"') << regex(r"\s*")
+
+        self.assertIsNotNone(_regular.compile_parser(quoted))
+        self.assertEqual(quoted.parse(r'"a\n\u0041b" '), "a\nAb")
+        self.assert_same_as_combinators(quoted, [r'"abc"', r'"\"\\" ', r'"\x"', '"abc', ""])
+
+    @unittest.skipUnless(_regular.SUPPORTED, "needs atomic groups")
+    def test_values(self):
+        number = regex(r"(-)?[0-9]+").map(int)
+        parser = seq(
+            number.sep_by(string(","), min=1),
+            alt(string("ab"), string("a").result("A"), success("none")),
+            peek(char_from("xy")) | success(None),
+            seq(first=any_char, _second=regex("[A-Z]", re.I)).combine_dict(lambda first: first),
+            eof,
+        )
+        self.assertIsNotNone(_regular.compile_parser(parser))
+        self.assert_same_as_combinators(parser, ["1,-2abxq", "3axQ", "4yQQ", "5", "5,", "6Z1"])
+
+        # ordered choice and greedy repetition, as with the combinators
+        parser = (string("a") | string("ab")).many() + string("b").times(1, 2)
+        self.assert_same_as_combinators(parser, ["aab", "abb", "abbb", "b"])
+
+        # sep_by with a max and no min repeats the rest with a negative min
+        parser = string("a").sep_by(string(","), max=3)
+        self.assert_same_as_combinators(parser, ["", "a", "a,a,a,a", "b"])
+        self.assertEqual(parser.parse("a,a"), ["a", "a"])
+
+    @unittest.skipUnless(_regular.SUPPORTED, "needs atomic groups")
+    def test_bytes(self):
+        parser = seq(string(b"ab"), regex(b"[0-9]+").map(int), char_from(b"xy").many())
+        self.assertIsNotNone(_regular.compile_parser(parser))
+        self.assertEqual(parser.parse(b"ab12xyx"), [b"ab", 12, [b"x", b"y", b"x"]])
+        self.assert_same_as_combinators(parser, [b"ab12xyx", b"ab", b"ab1z"])
+
+    def test_not_regular(self):
+        self.assertIsNone(_regular.compile_parser(string("a", transform=str.lower).many()))
+        self.assertIsNone(_regular.compile_parser(regex("a*").times(2)))
+        self.assertIsNone(_regular.compile_parser(regex(r"(a)\1").many()))
+        self.assertIsNone(_regular.compile_parser(seq(string("a"), string(b"b"))))
+
+        parser = regex("a*").times(2) + string("b").many()
+        self.assertEqual(parser.parse("aab"), ["aa", "", "b"])
+
+    def test_errors(self):
+        parser = (string("a") | string("ab")).many() + string("b")
+        with self.assertRaises(ParseError) as err:
+            parser.parse("aac")
+        self.assertEqual(str(err.exception), "expected one of 'a', 'ab', 'b' at 0:2")
+
+    def test_other_streams(self):
+        parser = char_from("ab").many()
+        self.assertEqual(parser.parse(["a", "b"]), ["a", "b"])
+
+
+class TestAltDispatch(unittest.TestCase):
+    def test_first_set(self):
+        class Pet(enum.Enum):
+            CAT = "cat"
+            DOG = "dog"
+
+        self.assertEqual(_first.first_set(string("ab")), frozenset("a"))
+        self.assertEqual(_first.first_set(string_from("x", "yz")), frozenset("xy"))
+        self.assertEqual(_first.first_set(char_from(b"ab")), frozenset(b"ab"))
+        self.assertEqual(_first.first_set(regex(r"-?[0-2]x")), frozenset("-012"))
+        self.assertEqual(_first.first_set(from_enum(Pet)), frozenset("cd"))
+        self.assertEqual(_first.first_set(seq(success(1), string("a") | string("b"))), frozenset("ab"))
+
+        self.assertIsNone(_first.first_set(regex("a", re.I)))
+        self.assertIsNone(_first.first_set(regex("a*")))
+        self.assertIsNone(_first.first_set(string("a", transform=str.lower)))
+        self.assertIsNone(_first.first_set(string("a").optional()))
+        self.assertIsNone(_first.first_set(any_char))
+
+    def test_ordered_choice(self):
+        expr = forward_declaration()
+        keyword = alt(
+            string("if") >> expr,
+            string("i") >> expr,
+            regex(r"[a-z]+") >> expr,
+            success("default") << expr,
+        ).tag("stmt")
+        expr.become(regex("[0-9]").map(int))
+
+        self.assertEqual(keyword.parse("if1"), ("stmt", 1))
+        self.assertEqual(keyword.parse("i2"), ("stmt", 2))
+        self.assertEqual(keyword.parse("ix3"), ("stmt", 3))
+        self.assertEqual(keyword.parse("4"), ("stmt", "default"))
+        with self.assertRaises(ParseError) as err:
+            keyword.parse("!")
+        self.assertEqual(str(err.exception), "expected one of '[0-9]', '[a-z]+', 'i', 'if' at 0:0")
+
+    def test_other_streams(self):
+        expr = forward_declaration()
+        expr.become(alt(match_item("a") >> expr, string("b"), success(None)))
+        self.assertEqual(expr.parse(["a", "a"]), None)
+
+        expr = forward_declaration()
+        expr.become(alt(string(b"a") >> expr, string(b"b")))
+        self.assertEqual(expr.parse(b"aab"), b"b")
+
+
+class TestCompile(SameResultsMixin, unittest.TestCase):
+    engine = staticmethod(lambda parser: parsy_compile(parser).parse)
+
+    def test_same_results(self):
+        number = regex(r"-?[0-9]+").map(int)
+        word = parsy_test_char(str.isalpha, "a letter").at_least(1).concat()
+        pair = seq(key=word, _eq=string("="), value=number | word).combine_dict(lambda key, value: (key, value))
+        items = (pair | number.tag("number")).sep_by(string(",") << whitespace.optional())
+        parser = seq(index, items, string(";").times(0, 2), line_info)
+        self.assert_same_results(parser, ["a=1, 2,b=c;", "", "a=", "1,,2", "a=1;;;", "x=y\n"])
+
+        bound = number.bind(lambda n: any_char.times(n))
+        self.assert_same_results(bound, ["2ab", "3ab", "0"])
+
+    def test_recursion(self):
+        expr = forward_declaration()
+        atom = (string("(") >> expr << string(")")) | regex("[0-9]+").map(int)
+        expr.become(seq(expr << string("-"), atom).combine(operator.sub) | atom)
+        self.assert_same_results(expr, ["1-2-3", "(1-(2-3))", "1-", "(1", ""])
+        self.assert_same_results(expr, ["1-2-3", "(1-"], packrat=True)
+        self.assertEqual(parsy_compile(expr).parse("10-(2-3)-4"), 7)
+
+    def test_memoize_and_generate(self):
+        a = string("a").memoize()
+
+        @generate
+        def a_then_b():
+            first = yield a
+            return (first, (yield string("b")))
+
+        parser = (a_then_b | a + string("c")).many()
+        self.assert_same_results(parser, ["abacab", "ad"])
+
+    def test_other_streams(self):
+        parser = seq(string(b"ab"), regex(b"[0-9]+").map(int), char_from(b"xy").many())
+        self.assert_same_results(parser, [b"ab12xy", b"ab12z"])
+
+        parser = any_char.many()
+        self.assertEqual(parsy_compile(parser).parse(["a", 1]), ["a", 1])
+
+    def test_emit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "example_grammar.py"), "w") as f:
+                f.write("from parsy import regex, string\n")
+                f.write("number = regex('[0-9]+').map(int)\n")
+                f.write("parser = number.sep_by(string(','))\n")
+            sys.path.insert(0, directory)
+            try:
+                codegen.main(["example_grammar:parser", "--emit", os.path.join(directory, "example_compiled.py")])
+                example_compiled = importlib.import_module("example_compiled")
+            finally:
+                sys.path.remove(directory)
+                sys.modules.pop("example_grammar", None)
+                sys.modules.pop("example_compiled", None)
+
+        self.assertEqual(example_compiled.parser.parse("1,23"), [1, 23])
+        with self.assertRaises(ParseError) as err:
+            example_compiled.parser.parse("1,")
+        self.assertEqual(str(err.exception), "expected '[0-9]+' at 0:2")
+
+    def test_fingerprint(self):
+        def fingerprint(parser):
+            return codegen._fingerprint(codegen._walk(parser)[0])
+
+        def grammar(exp):
+            return alt(regex(exp).bind(success), string("x").bind(success))
+
+        # The FIRST sets written into the code depend on the regexes
+        self.assertEqual(fingerprint(grammar("[a-c]+")), fingerprint(grammar("[a-c]+")))
+        self.assertNotEqual(fingerprint(grammar("[a-c]+")), fingerprint(grammar("[a-z]+")))
+        self.assertNotEqual(fingerprint(regex("a")), fingerprint(regex("a", re.I)))
+        self.assertNotEqual(fingerprint(string("a", str.upper)), fingerprint(string("a", str.lower)))
+        self.assertNotEqual(fingerprint(string("a").many()), fingerprint(string("a").times(0, 5)))
+
+
+class TestOptimize(SameResultsMixin, unittest.TestCase):
+    engine = staticmethod(lambda parser: parser.optimize().parse)
+
+    def test_structure(self):
+        number = regex("[0-9]+")
+        parser = seq(number, string("x") | string("y"))
+        self.assertEqual(parser.kind, "seq")
+        self.assertEqual(parser.children[0], number)
+        self.assertEqual(parser.children[1].kind, "alt")
+        self.assertEqual(number.params["exp"], re.compile("[0-9]+"))
+        self.assertEqual(parser.params, {"names": None})
+        self.assertIsNone(Parser(lambda stream, index: None).kind)
+
+    def test_chains(self):
+        parser = string("(") >> string("[") >> regex("[a-z]+") << string("]") << string(")")
+        optimized = parser.optimize()
+        self.assertEqual(optimized.kind, "map")
+        self.assertEqual(
+            [child.params["expected_string"] for child in optimized.children[0].children if child.kind == "string"],
+            ["([", "])"],
+        )
+        self.assert_same_results(parser, ["([abc])", "([abc]", "(abc)", ""])
+
+        parser = string("a") + string("b") + regex("[0-9]") + string("c")
+        self.assertEqual(len(parser.optimize().children[0].children), 3)
+        self.assert_same_results(parser, ["ab1c", "ab1", "abc"])
+
+        parser = whitespace.optional() >> string("true").result(True) << eof
+        self.assert_same_results(parser, ["true", " true", "tru", "true "])
+
+    def test_alternatives(self):
+        parser = alt(string("a") | fail("x"), string("b") | (success("default") | string("c")))
+        optimized = parser.optimize()
+        self.assertEqual([child.kind for child in optimized.children], ["string", "string", "success"])
+        self.assert_same_results(parser, ["a", "b", "", "c"])
+
+        parser = string("a").desc("letter a").map(noop)
+        self.assertEqual(parser.optimize().kind, "string")
+        self.assert_same_results(parser, ["a", "b"])
+
+    def test_recursion(self):
+        expr = forward_declaration()
+        atom = (string("(") >> expr << string(")")) | regex("[0-9]+").map(int)
+        expr.become(seq(expr << string("-"), atom).combine(operator.sub) | atom)
+        self.assert_same_results(expr, ["1-2-3", "(1-(2-3))", "1-", "(1", ""])
+        self.assertEqual(expr.optimize().parse("10-(2-3)-4", packrat=True), 7)
+
+    def test_memo_stats(self):
+        word = (string("a") >> string("b") >> regex("[a-z]")).memoize()
+        parser = (word << string("!")) | (word << string("?"))
+        optimized = parser.optimize()
+        self.assertEqual(optimized.parse("abc?", packrat=True), "c")
+        self.assertEqual((word.memo_stats.hits, word.memo_stats.misses), (1, 1))
+        with self.assertRaises(ParseError):
+            optimized.parse("abc", packrat=True)
+        # One hit and one miss in each phase
+        self.assertEqual((word.memo_stats.hits, word.memo_stats.misses), (3, 3))
+
+    def test_pickle(self):
+        parser = string("a") >> success("x") << string("b")
+        optimized = parser.optimize()
+        self.assertEqual(optimized.kind, "map")
+        self.assertEqual(pickle.loads(pickle.dumps(optimized)).parse("ab"), "x")
+        # The rewritten parsers can be pickled as they are too.
+        fn = pickle.loads(pickle.dumps(optimized.params["fn"]))
+        self.assertEqual(optimized.children[0].map(fn).parse("ab"), "x")
+
+
+class TestIterative(SameResultsMixin, unittest.TestCase):
+    engine = staticmethod(lambda parser: parser.iterative().parse)
+
+    def test_same_results(self):
+        value = forward_declaration()
+        number = regex("[0-9]+").map(int).desc("number")
+        items = value.sep_by(string(","))
+        value.become(number | (string("[") >> items << string("]")) | seq(k=string("{") >> value << string("}")))
+        texts = ["1", "[1,[2,3],[]]", "{[4]}", "[1,", "[1,{]", "", "[[[x]]]"]
+        self.assert_same_results(value, texts)
+        self.assert_same_results(value.optimize(), texts)
+        self.assert_same_results(value.until(string("!"), min=1, max=2), ["1[2]!", "1!", "!", "1[2]3!"])
+        self.assert_same_results(value.span().map(lambda s: (s.value, s.start, s.end)), ["[1]"])
+
+    def test_deep_nesting(self):
+        value = forward_declaration()
+        value.become(string("x") | (string("[") >> value << string("]")))
+        depth = sys.getrecursionlimit()
+        text = "[" * depth + "x" + "]" * depth
+        with self.assertRaises(RecursionError):
+            value.parse(text)
+        self.assertEqual(value.iterative().parse(text), "x")
+        with self.assertRaises(ParseError) as err:
+            value.iterative().parse(text[:-1])
+        self.assertEqual(str(err.exception), f"expected ']' at 0:{len(text) - 1}")
+
+    def test_bind_and_generate(self):
+        @generate
+        def nested():
+            if (yield string("(").optional()):
+                inner = yield nested
+                yield string(")")
+                return [inner]
+            return (yield regex("[0-9]+").bind(lambda digits: success(int(digits))))
+
+        self.assert_same_results(nested, ["((1))", "((1)", "()"])
+        self.assert_same_results(nested, ["((1))"], packrat=True)
+        text = "(" * 5000 + "1" + ")" * 5000
+        result = nested.iterative().parse(text)
+        for _ in range(5000):
+            (result,) = result
+        self.assertEqual(result, 1)
+
+    def test_left_recursion(self):
+        expr = forward_declaration()
+        atom = regex("[0-9]+").map(int)
+        expr.become(seq(expr << string("-"), atom).combine(operator.sub) | atom)
+        self.assert_same_results(expr, ["1-2-3", "1-", ""])
+        self.assert_same_results(expr.memoize(), ["10-2-3"], packrat=True)
+
+
+class TestProfile(unittest.TestCase):
+    def test_named(self):
+        number = regex("[0-9]+")
+        named = number.named("number")
+        self.assertIs(named.wrapped_fn, number.wrapped_fn)
+        self.assertEqual((named.kind, named.params), ("named", {"name": "number"}))
+        self.assertEqual(named.sep_by(string(",")).parse("1,2"), ["1", "2"])
+
+    def test_profile(self):
+        value = forward_declaration()
+        number = regex("[0-9]+").map(int).named("number")
+        items = (string("[") >> value.sep_by(string(",")) << string("]")).named("list")
+        value.become(number | items.desc("a list"))
+
+        with profile() as prof:
+            self.assertEqual(value.parse("[1,[2,3]]"), [1, [2, 3]])
+            with self.assertRaises(ParseError):
+                value.parse("[x]")
+        value.parse("[4]")
+
+        self.assertEqual(sorted(prof.stats), ["<parse>", "a list", "list", "number"])
+        stats = prof.stats["number"]
+        # Five calls for the first parse, and two for the second: the parse
+        # done again for its error message isn't counted
+        self.assertEqual((stats.calls, stats.successes, stats.failures, stats.consumed), (7, 3, 4, 3))
+        self.assertEqual(prof.stats["list"].calls, 4)
+        self.assertEqual(prof.stats["list"].consumed, 14)
+        self.assertEqual(prof.stats["<parse>"].calls, 2)
+        self.assertTrue(prof.stats["<parse>"].inclusive >= prof.stats["list"].inclusive > 0)
+
+        stacks = dict(line.rsplit(" ", 1) for line in prof.collapsed().splitlines())
+        self.assertIn("<parse>;a list;list;number", stacks)
+        self.assertIn("<parse>;a list;list;a list;list;number", stacks)
+        self.assertTrue(all(count.isdigit() for count in stacks.values()))
+        report = prof.report().splitlines()
+        self.assertEqual(report[0].split()[:4], ["name", "calls", "successes", "failures"])
+        self.assertEqual(sorted(line.split()[0] for line in report[1:]), ["<parse>", "a", "list", "number"])
+        self.assertEqual(len(report), 5)
+        with self.assertRaises(ValueError):
+            prof.heatmap()
+
+    def test_heatmap(self):
+        word = regex("[a-z]+").named("word")
+        # Both alternatives parse the same word again after a failure.
+        pair = seq(word << string("="), word) | seq(word << string(":"), word)
+        with profile(heatmap=True) as prof:
+            self.assertEqual(pair.sep_by(string(",")).parse("ab:c,d:e"), [["ab", "c"], ["d", "e"]])
+
+        self.assertEqual(prof.input_length, 8)
+        # Each word and separator once, and "ab" and "d" twice
+        self.assertEqual(prof.scanned, 8 + 3)
+        self.assertAlmostEqual(prof.wasted_work, 11 / 8)
+        self.assertEqual(prof.evaluations["word", 0], 2)
+        self.assertEqual(prof.evaluations["word", 3], 1)
+        self.assertEqual(prof.evaluations["'='", 2], 1)
+        heatmap = prof.heatmap(2).splitlines()
+        self.assertEqual(heatmap[0], "wasted work: 1.38 (11 items matched, input length 8)")
+        self.assertEqual(heatmap[2].split(), ["word", "6", "4", "2", "0", "(x2),", "5", "(x2),", "3", "(x1)"])
+        self.assertEqual(heatmap[3].split()[0], "'[a-z]+'")
+        self.assertEqual(len(heatmap), 4)
+
+        # A failed parse is counted once, without the parse done again for
+        # the error message
+        with profile(heatmap=True) as prof:
+            with self.assertRaises(ParseError):
+                pair.sep_by(string(",")).parse("ab:c,d!e")
+        self.assertEqual(prof.input_length, 8)
+        self.assertEqual(prof.evaluations["word", 0], 2)
+        self.assertEqual(prof.evaluations["word", 5], 2)
+        self.assertEqual(prof.scanned, 8 + 1)
+
+
+class TestParseStream(unittest.TestCase):
+    def setUp(self):
+        number = regex(r"[0-9]+").map(int)
+        self.record = seq(string("id=") >> number, string(",") >> regex(r"[a-z]*") << string("\n"))
+        self.text = "".join(f"id={i},{'abc' * (i % 5)}\n" for i in range(200))
+
+    def test_same_results(self):
+        parser = self.record.many()
+        expected = parser.parse(self.text)
+        for chunk_size in [1, 3, 16, 1000]:
+            self.assertEqual(parser.parse_stream(io.StringIO(self.text), chunk_size), expected)
+            chunks = [self.text[i : i + 7] for i in range(0, len(self.text), 7)]
+            self.assertEqual(parser.parse_stream(chunks, chunk_size), expected)
+        self.assertEqual(parser.parse_stream(io.BytesIO(b""), 4), [])
+        self.assertEqual(string(b"ab").many().parse_stream(io.BytesIO(b"ababab"), 4), [b"ab"] * 3)
+        self.assertEqual(
+            ((letter.many().concat() << string("!")) | any_char.many().concat()).parse_stream(["ab", "c1", "23"], 2),
+            "abc123",
+        )
+
+    def test_long_regex_matches(self):
+        # Tokens longer than the chunk size, and regexes that look ahead
+        lines = "".join(f"line {i} {'x' * i}\n" for i in range(40))
+        cases = [
+            (regex("a?b"), "ab"),
+            (regex("(a)b"), "ab"),
+            (regex(r"[^\n]*\n").many(), lines),
+            (regex("a{30}b"), "a" * 30 + "b"),
+            (regex(r"x(?=y{20})") + regex("y+"), "x" + "y" * 20),
+            (regex(r"[a-z]+\b").sep_by(string(" ")), "abcdef ghijkl"),
+            (regex(r"[^b]+a").sep_by(string("b")) << regex(".*"), "a  a abaa b"),
+        ]
+        for parser, text in cases:
+            for chunk_size in [1, 2, 5]:
+                self.assertEqual(parser.parse_stream(io.StringIO(text), chunk_size), parser.parse(text))
+
+        offsets = []
+
+        @Parser
+        def offset(stream, index):
+            offsets.append(stream.offset)
+            return Result.success(index, None)
+
+        (regex(r"[^\n]*\n") << offset).many().parse_stream(io.StringIO(lines), 4)
+        self.assertTrue(offsets[-1] > len(lines) - 100)
+
+    def test_discards_parsed_prefix(self):
+        offsets = []
+
+        @Parser
+        def offset(stream, index):
+            offsets.append(stream.offset)
+            return Result.success(index, None)
+
+        parser = (self.record << offset).many()
+        parser.parse_stream(io.StringIO(self.text), 16)
+        self.assertTrue(offsets[-1] > len(self.text) - 100)
+
+        # Alternatives can still backtrack to where they started.
+        parser = (self.record.many() << string("end")) | self.record.many().map(len)
+        self.assertEqual(parser.parse_stream(io.StringIO(self.text), 16), 200)
+
+    def test_errors(self):
+        parser = self.record.many()
+        text = self.text + "id=x"
+        with self.assertRaises(ParseError) as expected:
+            parser.parse(text)
+        with self.assertRaises(ParseError) as err:
+            parser.parse_stream(io.StringIO(text), 16)
+        self.assertEqual(str(err.exception), str(expected.exception))
+        self.assertEqual(str(err.exception), "expected '[0-9]+' at 200:3")
+
+        # A description is reported where it started, which is kept.
+        parser = (char_from("ab").many() >> string("!")).desc("word")
+        for chunk_size in [1, 4]:
+            with self.assertRaises(ParseError) as err:
+                parser.parse_stream(["ab", "ba", "b"], chunk_size)
+            self.assertEqual(str(err.exception), "expected 'word' at 0:0")
+
+        # Positions that were discarded are given as an index.
+        streams = []
+
+        @Parser
+        def buffer(stream, index):
+            streams.append(stream)
+            return Result.success(index, None)
+
+        (char_from("ab").many() >> buffer).parse_stream(["ab", "ba"], 1)
+        self.assertEqual(str(ParseError(frozenset(["x"]), streams[0], 0)), "expected 'x' at 0")
+
+    def test_combinators(self):
+        expr = forward_declaration()
+        expr.become(seq(expr, string("+") >> digit).combine(lambda a, b: a + int(b)) | digit.map(int))
+
+        @generate
+        def lines():
+            values = []
+            while True:
+                value = yield (expr << string("\n")).optional()
+                if value is None:
+                    return values
+                values.append(value)
+
+        text = "1+2+3\n4\n" * 50
+        self.assertEqual(lines.parse_stream(io.StringIO(text), 4, packrat=True), [6, 4] * 50)
+        parser = line_info.bind(lambda info: string("a").result(info)).sep_by(string("\n"))
+        self.assertEqual(parser.parse_stream(["a\na", "\na"], 1), [(0, 0), (1, 0), (2, 0)])
+
+
+class TestBench(unittest.TestCase):
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertEqual(bench.main(["--quick", "--json", path, "--threads", "2", "nesting", "mark"]), 0)
+            lines, scaling_lines = (part.splitlines() for part in output.getvalue().split("\n\n"))
+            self.assertEqual(lines[0].split()[:4], ["benchmark", "items", "build", "ms"])
+            self.assertRegex(scaling_lines[0], "^GIL enabled: (yes|no)$")
+            self.assertEqual(len(scaling_lines), 5)
+            self.assertEqual(
+                [line.split()[0] for line in lines[1:]], ["nesting[10]", "nesting_iterative[50]", "mark[100]"]
+            )
+            with open(path) as f:
+                results = json.load(f)["results"]
+            self.assertEqual(results["nesting[10]"]["items"], 20)
+            self.assertEqual(results["mark[100]"]["repeats"], 1)
+            with open(path) as f:
+                scaling = json.load(f)["scaling"]
+            self.assertEqual(sorted(scaling), ["mark[100]", "nesting[10]", "nesting_iterative[50]"])
+            self.assertEqual(scaling["mark[100]"]["threads"], 2)
+
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                bench.main(["--quick", "--compare", path, "mark"])
+            comparison = output.getvalue().split("\n\n")[1].splitlines()
+            self.assertEqual(comparison[0].split()[:4], ["benchmark", "p50", "ms", "baseline"])
+            self.assertEqual(comparison[1].split()[0], "mark[100]")
+            self.assertRegex(comparison[1].split()[3], r"^[+-][0-9.]+%$")
+
+
+# Module level, so that grammars using them can be pickled
+class Unit(enum.Enum):
+    CM = "cm"
+    M = "m"
+
+
+def measurement(number, unit):
+    return (float(number), unit)
+
+
+@generate("a range")
+def number_range():
+    start = yield regex("[0-9]+").map(int)
+    yield string("..")
+    end = yield regex("[0-9]+").map(int)
+    return range(start, end)
+
+
+@Parser
+def rest(stream, index):
+    return Result.success(len(stream), stream[index:])
+
+
+class TestPickle(unittest.TestCase):
+    def setUp(self):
+        value = forward_declaration()
+        quantity = seq(regex("[0-9]+"), from_enum(Unit)).combine(measurement)
+        items = string("[") >> value.sep_by(string(",")) << string("]")
+        quoted = string('"') >> scan_until('"') << string('"')
+        value.become(
+            number_range | quantity | items | letter.at_least(1).concat().tag("word") | string_from("+", "-") | quoted
+        )
+        self.grammar = value
+
+    def test_grammar(self):
+        text = '[1..3,[2cm,ab],5m,[],+,"x"]'
+        expected = [range(1, 3), [(2.0, Unit.CM), ("word", "ab")], (5.0, Unit.M), [], "+", "x"]
+        for protocol in range(2, pickle.HIGHEST_PROTOCOL + 1):
+            grammar = pickle.loads(pickle.dumps(self.grammar, protocol))
+            self.assertIsInstance(grammar, forward_declaration)
+            self.assertEqual(grammar.parse(text), expected)
+            with self.assertRaises(ParseError) as error:
+                grammar.parse("[1..]")
+            self.assertEqual(str(error.exception), "expected one of 'cm', 'm' at 0:2")
+
+        for parser in [self.grammar.optimize(), self.grammar.iterative(), parsy_compile(self.grammar)]:
+            self.assertEqual(pickle.loads(pickle.dumps(parser)).parse(text), expected)
+
+    def test_references(self):
+        self.assertIs(pickle.loads(pickle.dumps(letter)), letter)
+        self.assertIs(pickle.loads(pickle.dumps(rest)), rest)
+        self.assertIs(pickle.loads(pickle.dumps(number_range))._children[0], number_range._children[0])
+        parser = seq(match_item("a").optional("b").tag("t"), rest)
+        self.assertEqual(pickle.loads(pickle.dumps(parser)).parse("ac"), [("t", "a"), "c"])
+
+    def test_left_recursion(self):
+        expr = forward_declaration()
+        expr.become(seq(expr << string("-"), decimal_digit).combine(operator.add) | decimal_digit)
+        self.assertEqual(pickle.loads(pickle.dumps(expr)).parse("1-2-3"), "123")
+
+    def test_unpicklable(self):
+        with self.assertRaises((pickle.PicklingError, AttributeError)):
+            pickle.dumps(string("a").map(lambda value: value))
+
+    def test_parse_error(self):
+        with self.assertRaises(ParseError) as error:
+            self.grammar.parse("[%")
+        unpickled = pickle.loads(pickle.dumps(error.exception))
+        self.assertEqual((unpickled.index, str(unpickled)), (1, str(error.exception)))
+
+
+class TestThreads(unittest.TestCase):
+    def setUp(self):
+        value = forward_declaration()
+        items = (string("[") >> value.sep_by(string(",")) << string("]")).memoize()
+        value.become(items | regex("[0-9]+").map(int) | string("true").result(True) | string("false").result(False))
+        self.items = items
+        self.grammar = value
+
+    def test_freeze(self):
+        self.assertIs(self.grammar.freeze(), self.grammar)
+        with unittest.mock.patch("parsy._regular.compile_parser") as compile_parser:
+            with unittest.mock.patch("parsy._first.dispatch_table") as dispatch_table:
+                self.assertEqual(self.grammar.parse("[1,[true]]"), [1, [True]])
+        compile_parser.assert_not_called()
+        dispatch_table.assert_not_called()
+
+        iterative = self.grammar.iterative()
+        self.assertIs(iterative.freeze(), iterative)
+        self.assertEqual(iterative.parse("[1,[true]]"), [1, [True]])
+
+        declaration = forward_declaration()
+        with self.assertRaises(ValueError):
+            (string("a") | declaration).freeze()
+
+    def test_parse_on_threads(self):
+        text = "[1,[2,[3,false]],[]]"
+        expected = [1, [2, [3, False]], []]
+        threads = 8
+        for parser in [self.grammar, self.grammar.iterative(), self.grammar.optimize(), parsy_compile(self.grammar)]:
+            stats = self.items.memo_stats
+            before = (stats.hits, stats.misses)
+            parser.parse(text, packrat=True)
+            per_parse = (stats.hits - before[0], stats.misses - before[1])
+            barrier = threading.Barrier(threads)
+
+            def work():
+                barrier.wait()
+                return [parser.parse(text, packrat=True) for _ in range(20)]
+
+            with ThreadPoolExecutor(threads) as executor:
+                futures = [executor.submit(work) for _ in range(threads)]
+                self.assertEqual([future.result() for future in futures], [[expected] * 20] * threads)
+            total = threads * 20 + 1
+            self.assertEqual(
+                (stats.hits, stats.misses), (before[0] + per_parse[0] * total, before[1] + per_parse[1] * total)
+            )
+
+    def test_iterative_steps_on_threads(self):
+        # Steps are built while parsing, which other threads must not see
+        # half done.
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(10):
+                value = forward_declaration()
+                prefixed = alt(*(string(f"k{i}") >> value for i in range(30)))
+                value.become(prefixed | string("[") >> value.sep_by(string(",")) << string("]") | regex("[0-9]+"))
+                parser = value.bind(success).iterative()
+                barrier = threading.Barrier(8)
+
+                def work():
+                    barrier.wait()
+                    return parser.parse("[k3k4[1],k29]")
+
+                with ThreadPoolExecutor(8) as executor:
+                    futures = [executor.submit(work) for _ in range(8)]
+                    self.assertEqual([future.result() for future in futures], [[["1"], "9"]] * 8)
+        finally:
+            sys.setswitchinterval(interval)
+
+
+class TestParseAsync(SameResultsMixin, unittest.TestCase):
+    engine = staticmethod(lambda parser: partial(parse_async, parser, yield_every=2))
+
+    def test_same_results(self):
+        value = forward_declaration()
+        number = regex("[0-9]+").map(int).desc("number")
+        value.become(number | (string("[") >> value.sep_by(string(",")) << string("]")))
+        texts = ["1", "[1,[2,3],[]]", "[1,", "[1,]", "", "[1]2"]
+        for parser in [value, value.until(string("!"), min=1), regex("[a-z]").many().concat(), string("a")]:
+            self.assert_same_results(parser, texts + ["a", "ab", "12!", "1[2]"], packrat=True)
+
+        status, result = outcome(partial(parse_async, value), "[" * 5000 + "1" + "]" * 5000)
+        for _ in range(5000):
+            (result,) = result
+        self.assertEqual((status, result), ("ok", 1))
+        with self.assertRaises(ValueError):
+            parse_async(value, "1", yield_every=0)
+        with self.assertRaises(ValueError):
+            parse_async(forward_declaration(), "1")
+
+    def test_yields(self):
+        async def main(parser, text, yield_every):
+            ticks = 0
+            parsing = asyncio.ensure_future(parser.parse_async(text, yield_every=yield_every))
+            while not parsing.done():
+                ticks += 1
+                await asyncio.sleep(0)
+            return parsing.result(), ticks
+
+        letters = letter.many().concat()
+        result, ticks = asyncio.run(main(letters, "a" * 1000, 1000))
+        self.assertEqual(result, "a" * 1000)
+        self.assertLess(ticks, 5)
+        result, ticks = asyncio.run(main(letters, "a" * 1000, 10))
+        self.assertEqual(result, "a" * 1000)
+        self.assertGreater(ticks, 100)
+
+    def test_cancel(self):
+        async def main():
+            parsing = asyncio.ensure_future(any_char.many().parse_async("a" * 100_000, yield_every=1))
+            await asyncio.sleep(0)
+            parsing.cancel()
+            await parsing
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(main())
+
+
+class TestIterParse(SameResultsMixin, unittest.TestCase):
+    engine = staticmethod(lambda parser: lambda text, **kwargs: list(parser.iter_parse(text, **kwargs)))
+
+    def test_same_results(self):
+        value = forward_declaration()
+        value.become(regex("[0-9]+").map(int) | string("[") >> value.sep_by(string(",")) << string("]"))
+        item = value << regex(r"\s*")
+        texts = ["", "1 [2,[3]] 4", "1 [2,", "1 2]", "[1,[]] x"]
+        self.assert_same_results(item, texts, reference=item.many(), packrat=True)
+
+        with self.assertRaises(ValueError):
+            forward_declaration().iter_parse("1")
+
+    def test_lazy(self):
+        parsed = []
+        line = regex("[a-z]+").map(parsed.append) << string("\n")
+        results = line.iter_parse("a\nb\nc\n1")
+        self.assertEqual(parsed, [])
+        next(results)
+        self.assertEqual(parsed, ["a"])
+        self.assertEqual(list(itertools.islice(results, 1)), [None])
+        self.assertEqual(parsed, ["a", "b"])
+        with self.assertRaises(ParseError) as err:
+            list(results)
+        self.assertEqual(str(err.exception), "expected one of 'EOF', '[a-z]+' at 3:0")
+
+
+class TestLexer(unittest.TestCase):
+    def setUp(self):
+        self.lexer = lexer(
+            [("NUM", r"[0-9]+"), ("NAME", r"[a-z]+"), ("OP", r"[-+*/()]"), ("OP", r"\*\*")],
+            skip=[r"\s+", r"#[^\n]*"],
+        )
+
+    def test_tokens(self):
+        tokens = self.lexer.parse("x + 12 # comment\n* (y)")
+        self.assertIsInstance(tokens, TokenStream)
+        self.assertEqual(len(tokens), 7)
+        self.assertEqual(tokens[0], Token("NAME", "x"))
+        self.assertEqual(tokens[0].kind, "NAME")
+        self.assertEqual(tokens[2].text, "12")
+        self.assertEqual(
+            [tuple(token) for token in tokens],
+            [("NAME", "x"), ("OP", "+"), ("NUM", "12"), ("OP", "*"), ("OP", "("), ("NAME", "y"), ("OP", ")")],
+        )
+        self.assertEqual(tokens.kind_names, ("NUM", "NAME", "OP"))
+        self.assertEqual(list(tokens.kinds), [1, 2, 0, 2, 2, 1, 2])
+        self.assertEqual(list(tokens.starts), [0, 2, 4, 17, 19, 20, 21])
+        self.assertEqual(list(tokens.ends), [1, 3, 6, 18, 20, 21, 22])
+        self.assertEqual(list(tokens[1:3]), [Token("OP", "+"), Token("NUM", "12")])
+        self.assertEqual(self.lexer.parse(""), TokenStream("", (), [], [], []))
+
+        # Rules are tried in order
+        self.assertEqual(list(self.lexer.parse("**")), [Token("OP", "*"), Token("OP", "*")])
+        power = lexer([("POW", r"\*\*"), ("OP", r"\*")])
+        self.assertEqual(list(power.parse("***")), [Token("POW", "**"), Token("OP", "*")])
+
+        self.assertEqual(
+            list(lexer([("A", b"a+")], skip=[b" "]).parse(b"aa a")),
+            [Token("A", b"aa"), Token("A", b"a")],
+        )
+        with self.assertRaises(ValueError):
+            lexer([])
+
+    def test_lexing_error(self):
+        with self.assertRaises(ParseError) as err:
+            self.lexer.parse("x + 1\n  $")
+        self.assertEqual(str(err.exception), "expected one of 'EOF', 'NAME', 'NUM', 'OP' at 1:2")
+        self.assertEqual(self.lexer.parse_partial("1 $ 2")[1], "$ 2")
+        # Empty matches stop the lexer
+        self.assertEqual(list(lexer([("A", "a*")]).parse_partial("aab")[0]), [Token("A", "aa")])
+
+    def test_token_parsers(self):
+        tokens = self.lexer.parse("x + 12\n* y")
+        number = parsy_test_item(lambda token: token.kind == "NUM", "number").map(lambda token: int(token.text))
+        name = parsy_test_item(lambda token: token.kind == "NAME", "name")
+        expr = seq(name, match_item(Token("OP", "+")), number)
+        self.assertEqual(expr.parse_partial(tokens), ([Token("NAME", "x"), Token("OP", "+"), 12], tokens[3:]))
+        self.assertEqual((expr >> match_item(("OP", "*")) >> name).parse(tokens), Token("NAME", "y"))
+        self.assertEqual(
+            parsy_compile(expr.many()).parse_partial(tokens)[0], [[Token("NAME", "x"), Token("OP", "+"), 12]]
+        )
+
+        # Errors give the line and column of the token in the source
+        with self.assertRaises(ParseError) as err:
+            expr.parse(tokens)
+        self.assertEqual(str(err.exception), "expected 'EOF' at 1:0")
+        with self.assertRaises(ParseError) as err:
+            (expr >> match_item(("OP", "*")) >> number).parse(tokens)
+        self.assertEqual(str(err.exception), "expected 'number' at 1:2")
+        with self.assertRaises(ParseError) as err:
+            (expr >> match_item(("OP", "*")) >> name >> name).parse(tokens)
+        self.assertEqual(str(err.exception), "expected 'name' at 1:3")
+
+        self.assertEqual(
+            seq(index, line_info, any_char.span()).map(lambda v: (v[0], v[1], v[2].end_line_info)).parse(tokens[3:4]),
+            (0, (1, 0), (1, 1)),
+        )
+
+    def test_pickle(self):
+        grammar = pickle.loads(pickle.dumps(self.lexer))
+        self.assertEqual(grammar.parse("a+b"), self.lexer.parse("a+b"))
+        tokens = self.lexer.parse("a+b")
+        self.assertEqual(pickle.loads(pickle.dumps(tokens)), tokens)
+
+
+class TestTokens(unittest.TestCase):
+    def setUp(self):
+        self.lexer = lexer([("NUM", r"[0-9]+"), ("NAME", r"[a-z]+"), ("OP", r"[-+*/()]")], skip=[r"\s+"])
+        expr = forward_declaration()
+        atom = alt(
+            token("NUM").map(lambda t: int(t[1])),
+            token("NAME").map(lambda t: t[1]),
+            token("OP", "(") >> expr << token("OP", ")"),
+        )
+        expr.become(seq(atom, seq(token_from("OP").map(lambda t: t[1]), atom).many()))
+        self.expr = expr
+
+    def test_token_streams(self):
+        tokens = self.lexer.parse("x + (12 * y)")
+        self.assertEqual(self.expr.parse(tokens), ["x", [["+", [12, [["*", "y"]]]]]])
+        self.assertEqual(token("OP", "+").parse(self.lexer.parse("+")), Token("OP", "+"))
+        with self.assertRaises(ParseError) as err:
+            self.expr.parse(self.lexer.parse("x +\n (12 *)"))
+        self.assertEqual(str(err.exception), "expected one of '(', 'NAME', 'NUM' at 1:6")
+        with self.assertRaises(ParseError) as err:
+            token("OP", "+").parse(self.lexer.parse("-"))
+        self.assertEqual(str(err.exception), "expected '+' at 0:0")
+
+    def test_other_streams(self):
+        Tok = namedtuple("Tok", ["kind", "text", "line"])
+        tokens = [Tok("NAME", "x", 0), Tok("OP", "+", 0), Tok("NUM", "1", 1)]
+        self.assertEqual(self.expr.parse(tokens), ["x", [["+", 1]]])
+        self.assertEqual(self.expr.parse([("NUM", "1"), ("OP", "-"), ("NAME", "y")]), [1, [["-", "y"]]])
+
+        # Items that are not tokens fail to match, and can be matched by other
+        # alternatives
+        either = token("A") | match_item(1) | token_from("B", "C")
+        self.assertEqual(either.many().parse([("C", "c"), 1, ("A", "a")]), [("C", "c"), 1, ("A", "a")])
+        with self.assertRaises(ParseError) as err:
+            either.parse([None])
+        self.assertEqual(str(err.exception), "expected one of '1', 'A', 'B', 'C' at 0")
+        with self.assertRaises(ParseError) as err:
+            either.parse([])
+        self.assertEqual(str(err.exception), "expected one of '1', 'A', 'B', 'C' at 0")
+
+    def test_dispatch(self):
+        alternatives = [token("A"), token_from("B", "A") >> token("C"), parsy_test_item(bool, "x"), fail("y")]
+        self.assertEqual(
+            _first.dispatch_table(alternatives, tokens=True),
+            ({"A": (0, 1, 2), "B": (1, 2)}, (2,)),
+        )
+        self.assertIsNone(_first.first_set(token("A")))
+        self.assertIsNone(_first.first_set(token("A").optional(), tokens=True))
+        self.assertIsNone(_first.first_set(string("a"), tokens=True))
+
+        tokens = self.lexer.parse("(1 + x) * 2")
+        expected = self.expr.parse(tokens)
+        for parser in [self.expr.optimize(), self.expr.iterative(), parsy_compile(self.expr)]:
+            self.assertEqual(parser.parse(tokens), expected)
+        self.assertEqual(
+            pickle.loads(pickle.dumps(token("OP", "+") | token_from("A", "B"))).parse([("B", "")]), ("B", "")
+        )
+
+
+class TestResult(unittest.TestCase):
+    def test_slots(self):
+        result = Result.success(1, "x")
+        self.assertFalse(hasattr(result, "__dict__"))
+        self.assertEqual(result, Result(True, 1, "x", -1, frozenset()))
+
+    def test_aggregate(self):
+        success = Result.success(1, "x")
+        a = Result.failure(1, "a")
+        b = Result.failure(1, "b")
+        self.assertIs(success.aggregate(None), success)
+        self.assertEqual(success.aggregate(a), Result(True, 1, "x", 1, frozenset(["a"])))
+        self.assertEqual(a.aggregate(b), Result(False, -1, None, 1, frozenset(["a", "b"])))
+        self.assertIs(a.aggregate(Result.failure(0, "c")), a)
+        self.assertIs(a.aggregate(success), a)
+
 
 class TestParserTokens(unittest.TestCase):
     """
@@ -733,6 +1972,143 @@ class TestForwardDeclaration(unittest.TestCase):
         with self.assertRaises((AttributeError, TypeError)):
             dec.become(other)
 
+    def test_left_recursion(self):
+        expr = forward_declaration()
+        number = regex(r"[0-9]+").map(int)
+        expr.become(
+            seq(expr << string("-"), number).combine(operator.sub)
+            | seq(expr << string("+"), number).combine(operator.add)
+            | number
+        )
+
+        self.assertEqual(expr.parse("1"), 1)
+        self.assertEqual(expr.parse("10-2-3"), 5)
+        self.assertEqual(expr.parse("10-2+3"), 11)
+        self.assertEqual(expr.parse("-".join(["1"] * 5000)), -4998)
+        self.assertEqual(expr.parse_partial("1-2*3"), (-1, "*3"))
+
+        with self.assertRaises(ParseError) as err:
+            expr.parse("1-")
+        self.assertEqual(str(err.exception), "expected '[0-9]+' at 0:2")
+
+        with self.assertRaises(ParseError) as err:
+            expr.parse("1-2x")
+        self.assertEqual(str(err.exception), "expected one of '+', '-', 'EOF' at 0:3")
+
+    def test_left_recursion_packrat(self):
+        expr = forward_declaration()
+        term = forward_declaration()
+        number = regex(r"[0-9]+").map(int)
+        expr.become(seq(expr << string("+"), term).combine(operator.add) | term)
+        term.become(seq(term << string("*"), number).combine(operator.mul) | number)
+
+        for packrat in [False, True]:
+            self.assertEqual(expr.parse("2*3+4*5*6+1", packrat=packrat), 127)
+
+    def test_indirect_left_recursion(self):
+        x = forward_declaration()
+        y = forward_declaration()
+        x.become((y + string("a")) | string("b"))
+        y.become((x + string("c")) | x)
+
+        for packrat in [False, True]:
+            self.assertEqual(x.parse("b", packrat=packrat), "b")
+            self.assertEqual(x.parse("ba", packrat=packrat), "ba")
+            self.assertEqual(x.parse("bcaca", packrat=packrat), "bcaca")
+            self.assertEqual(x.parse("baaca", packrat=packrat), "baaca")
+            self.assertRaises(ParseError, x.parse, "bc", packrat=packrat)
+
+    def test_left_recursion_called_directly(self):
+        expr = forward_declaration()
+        expr.become((expr + string("a")) | string("b"))
+        self.assertEqual(expr("xbaa", 1), Result.success(4, "baa").aggregate(Result.failure(4, "a")))
+
+
+class TestMemoize(unittest.TestCase):
+    def counting_parser(self, parser):
+        calls = []
+
+        @Parser
+        def counted(stream, index):
+            calls.append(index)
+            return parser(stream, index)
+
+        return counted, calls
+
+    def test_memoize(self):
+        counted, calls = self.counting_parser(string("a"))
+        a = counted.memoize()
+        parser = (a + string("b")) | (a + string("c"))
+        self.assertEqual(parser.parse("ac"), "ac")
+        self.assertEqual(calls, [0])
+        self.assertEqual(a.memo_stats.hits, 1)
+        self.assertEqual(a.memo_stats.misses, 1)
+
+        # The memo only lasts for a single parse, but stats accumulate.
+        self.assertEqual(parser.parse("ac"), "ac")
+        self.assertEqual(calls, [0, 0])
+        self.assertEqual(a.memo_stats.hits, 2)
+        self.assertEqual(a.memo_stats.misses, 2)
+
+    def test_memoize_failure(self):
+        counted, calls = self.counting_parser(string("a"))
+        a = counted.memoize()
+        parser = (a + string("b")) | (a + string("c")) | string("d")
+        with self.assertRaises(ParseError) as err:
+            parser.parse("x")
+        self.assertEqual(err.exception.expected, frozenset(["a", "d"]))
+        # Once for the fast phase, and once for building the error message.
+        self.assertEqual(calls, [0, 0])
+
+    def test_memoize_called_directly(self):
+        counted, calls = self.counting_parser(string("a"))
+        a = counted.memoize()
+        self.assertEqual(a("xa", 1), Result.success(2, "a"))
+        self.assertEqual(a("xa", 1), Result.success(2, "a"))
+        self.assertEqual(calls, [1, 1])
+
+    def test_memo_size(self):
+        counted, calls = self.counting_parser(string("a"))
+        a = counted.memoize()
+        b = string("b").memoize()
+        parser = (a + b + string("c")) | (a + b + string("d"))
+        self.assertEqual(parser.parse("abd"), "abd")
+        self.assertEqual(calls, [0])
+        self.assertEqual(parser.parse("abd", memo_size=1), "abd")
+        self.assertEqual(calls, [0, 0, 0])
+
+    def test_packrat(self):
+        counted, calls = self.counting_parser(string("x"))
+        expr = forward_declaration()
+        term = (string("(") >> expr << string(")")) | counted
+        expr.become(seq(term, string("+"), expr) | seq(term, string("-"), expr) | term)
+
+        text = "((((x))))"
+        self.assertEqual(expr.parse(text), "x")
+        self.assertEqual(len(calls), 3**5)
+
+        del calls[:]
+        self.assertEqual(expr.parse(text, packrat=True), "x")
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(expr.memo_stats.hits > 0)
+
+        with self.assertRaises(ParseError) as err:
+            expr.parse("((x)", packrat=True)
+        self.assertEqual(str(err.exception), "expected one of ')', '+', '-' at 0:4")
+
+    def test_packrat_generate(self):
+        counted, calls = self.counting_parser(string("x"))
+
+        @generate
+        def item():
+            return (yield counted)
+
+        parser = (item + string("y")) | (item + string("z"))
+        self.assertEqual(parser.parse("xz"), "xz")
+        self.assertEqual(calls, [0, 0])
+        self.assertEqual(parser.parse("xz", packrat=True), "xz")
+        self.assertEqual(calls, [0, 0, 0])
+
 
 if __name__ == "__main__":
     unittest.main()